@@ -148,6 +148,26 @@ class Empty(AST):
 # BinaryOperator, UnaryOperator, ConstDeclaration, VarDeclaration, 
 # AssignmentStatement, etc...
 
+def left_chain(node, chained):
+    '''
+    Return the list of nodes reached from node by following the left
+    operand for as long as chained(node) is true, deepest first.  The
+    parser turns a + b + c + ... into such a chain down the left side,
+    thousands of nodes deep for generated programs.  Visitors walk it
+    with a loop instead of recursing into the left operand:
+
+        chain = left_chain(node, lambda n: isinstance(n, BinaryOp))
+        self.visit(chain[0].left)
+        for op in chain:
+            self.visit(op.right)
+            ...
+    '''
+    chain = [node]
+    while chained(chain[-1].left):
+        chain.append(chain[-1].left)
+    chain.reverse()
+    return chain
+
 # ----------------------------------------------------------------------
 #                  DO NOT MODIFY ANYTHING BELOW HERE
 # ----------------------------------------------------------------------
@@ -0,0 +1,124 @@
+# exprbench.py
+'''
+Interpreter benchmarks
+======================
+Compiles an Expr program and times different ways of running the
+resulting intermediate code.  Output of the benchmarked program is
+discarded while the timings are taken.  Run as:
+
+    bash % python exprbench.py loop.e
+    bash % python exprbench.py -r 10 loop.e
+    bash % python exprbench.py -O3 loop.e
+'''
+
+import os
+import sys
+import time
+import optparse
+
+import exprlex
+import exprparse
+import exprcheck
+import exprcode
+import exprinterp
+import exprpy
+import exprpass
+import exprfuse
+from errors import subscribe_errors, errors_reported
+
+def compile_file(filename):
+    '''
+    Compile an Expr source file into basic blocks.  Returns the start
+    block or None if errors were reported.
+    '''
+    lexer = exprlex.make_lexer()
+    parser = exprparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg+"\n")):
+        program = parser.parse(open(filename).read())
+        exprcheck.check_program(program)
+        if errors_reported():
+            return None
+        code = exprcode.generate_code(program)
+        return code.start_block
+
+def link(start_block):
+    '''
+    Link basic blocks into a list of instruction tuples.
+    '''
+    linker = exprinterp.BlockLinker()
+    linker.visit(start_block)
+    linker.patch_jumps()
+    return linker.code
+
+def timeit(func, repeat):
+    '''
+    Call func() repeat times with stdout silenced and return the
+    best wall time in seconds.
+    '''
+    best = None
+    devnull = open(os.devnull, "w")
+    stdout = sys.stdout
+    try:
+        for i in range(repeat):
+            sys.stdout = devnull
+            start = time.time()
+            func()
+            elapsed = time.time() - start
+            sys.stdout = stdout
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+    return best
+
+def bench_dispatch(start_block, repeat):
+    '''
+    Time the original string dispatching loop against the threaded
+    code interpreter, with variables kept in a dictionary and in
+    integer slots, with superinstructions, with traces compiled for
+    hot loops, and against the Python code generator.  Returns a list
+    of (name, seconds) tuples.
+    '''
+    ircode = link(start_block)
+    fused = exprfuse.fuse(ircode)
+
+    def run_slots(interpreter_class=exprinterp.Interpreter, code=ircode):
+        resolver = exprinterp.SlotResolver()
+        slotcode = resolver.resolve(code)
+        interpreter = interpreter_class()
+        interpreter.vars = resolver.register_file()
+        interpreter.run(slotcode)
+
+    return [
+        ("dispatch", timeit(lambda: exprinterp.Interpreter().dispatch(ircode), repeat)),
+        ("threaded", timeit(lambda: exprinterp.Interpreter().run(ircode), repeat)),
+        ("slots", timeit(run_slots, repeat)),
+        ("fused", timeit(lambda: run_slots(code=fused), repeat)),
+        ("tracing", timeit(lambda: run_slots(exprinterp.TracingInterpreter), repeat)),
+        ("python", timeit(lambda: exprpy.compile_blocks(start_block)[0](), repeat)),
+    ]
+
+def report(results):
+    base = results[0][1]
+    for name, seconds in results:
+        print "%-12s %8.4fs  %5.2fx" % (name, seconds, base / seconds)
+
+def get_options():
+    parser = optparse.OptionParser(usage="%prog [options] file.e")
+    parser.add_option("-r", "--repeat", type="int",
+                      dest="repeat", default=5,
+                      help="number of timed runs per variant (best is reported)")
+    exprpass.add_options(parser)
+    options, args = parser.parse_args(sys.argv[1:])
+    if len(args) != 1:
+        parser.error("expected exactly one source file")
+    return options, args
+
+if __name__ == '__main__':
+    options, args = get_options()
+    start_block = compile_file(args[0])
+    if start_block is not None:
+        exprpass.optimize_with_options(start_block, options)
+        print "%s: %d instructions" % (args[0], len(link(start_block)))
+        report(bench_dispatch(start_block, options.repeat))
@@ -13,11 +13,23 @@ See Exercise 7.
 # An example of how to create basic blocks, control flow graphs,
 # and low-level code using Python ASTs.
 
+# Attributes linking a block to other blocks
+links = ('next_block', 'if_branch', 'else_branch', 'body')
+
 class Block(object):
+    # Counts changes of the links between blocks.  exprcfg.py uses it to
+    # tell whether a control flow graph built earlier is still valid.
+    generation = 0
+
     def __init__(self):
         self.instructions = []   # Instructions in the block
         self.next_block =None    # Link to the next block
 
+    def __setattr__(self, name, value):
+        if name in links:
+            Block.generation += 1
+        object.__setattr__(self, name, value)
+
     def append(self,instr):
         self.instructions.append(instr)
 
@@ -61,6 +73,27 @@ class BlockVisitor(object):
                 getattr(self,name)(block)
             block = block.next_block
 
+def all_blocks(block):
+    '''
+    Return a list of all blocks reachable from block, including the
+    branches of IfBlocks and the bodies of WhileBlocks.  The blocks are
+    listed in the order in which they are linked into code.
+    '''
+    blocks = []
+    stack = [block]
+    while stack:
+        block = stack.pop()
+        if not isinstance(block, Block):
+            continue
+        blocks.append(block)
+        stack.append(block.next_block)
+        if isinstance(block, IfBlock):
+            stack.append(block.else_branch)
+            stack.append(block.if_branch)
+        elif isinstance(block, WhileBlock):
+            stack.append(block.body)
+    return blocks
+
 import ast
 class CodeGenerator(ast.NodeVisitor):
     '''
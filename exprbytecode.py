@@ -0,0 +1,331 @@
+# exprbytecode.py
+'''
+Bytecode Files
+==============
+The linked code of BlockLinker is a list of instruction tuples.  This
+file defines a binary format for it that can be written to a file and
+run straight from memory with mmap, without building any tuples or
+unpickling anything first.  Programs start at once no matter how large
+they are, and processes running the same file share its pages.
+
+A file consists of a header and four sections.  All numbers are
+little-endian.
+
+    Header           struct '<8sIIIIIIII'
+                     magic 'EXPRBC\\0\\0', format version, number of
+                     instructions, number of pool entries, offsets of
+                     the instruction, pool and table sections, number of
+                     slots, and the length of the whole file.
+
+    Instructions     Five signed 32-bit integers each:
+
+                          opcode  a  b  c  d
+
+                     opcode is an index into the opcode table.  The
+                     operands are encoded by kind (see exprir.py):
+
+                          USE, DEF, LOAD, STORE    slot number
+                          LABEL                    instruction number
+                          VALUE, FUNC              constant number
+                          TYPE                     index in exprir.typenames
+
+                     Instructions with a variable number of operands
+                     ('call_func' and 'extern_func') keep their operands
+                     in the pool: a is the first pool entry, b the
+                     number of operands.  Others use a, b, c and d
+                     in order and put 0 in the unused ones.
+
+    Pool             Signed 32-bit integers.
+
+    Tables           The opcode table, the constant pool and the symbol
+                     table (the name of every slot), one after the
+                     other.  Each starts with its number of entries.
+                     Strings are an unsigned 32-bit length followed by
+                     the bytes.  Constants are a tag byte followed by
+                     the value: 'i' 64-bit integer, 'l' long integer as
+                     a decimal string, 'f' double, 's' string, 'b' bool.
+
+The opcode table makes a file independent of the numbering of opcodes
+in the compiler.  Run a file with
+
+    bash % python exprbytecode.py -O2 loop.e      # writes loop.ebc
+    bash % python exprinterp.py loop.ebc
+'''
+
+import os
+import mmap
+import struct
+import exprir
+
+MAGIC = 'EXPRBC\0\0'
+VERSION = 2
+
+HEADER = struct.Struct('<8sIIIIIIII')
+INSTRUCTION = struct.Struct('<iiiii')
+INTEGER = struct.Struct('<i')
+LENGTH = struct.Struct('<I')
+INT64 = struct.Struct('<q')
+DOUBLE = struct.Struct('<d')
+
+class BytecodeError(Exception):
+    pass
+
+def variable(opcode):
+    '''
+    Return True if the operands of opcode are kept in the pool.
+    '''
+    return '*' in exprir.signatures[exprir.split_opcode(opcode)[0]]
+
+def pack_string(value):
+    return LENGTH.pack(len(value)) + value
+
+def pack_constant(value):
+    if isinstance(value, bool):
+        return 'b' + chr(value)
+    elif isinstance(value, (int, long)):
+        if -2**63 <= value < 2**63:
+            return 'i' + INT64.pack(value)
+        return 'l' + pack_string(str(value))
+    elif isinstance(value, float):
+        return 'f' + DOUBLE.pack(value)
+    elif isinstance(value, str):
+        return 's' + pack_string(value)
+    raise BytecodeError("Can't store constant %r" % (value,))
+
+def encode(code):
+    '''
+    Return the bytecode of a list of linked instruction tuples as a string.
+    '''
+    opcodes = {}
+    constants = {}
+    constant_list = []
+    slots = {}
+    instructions = []
+    pool = []
+
+    def constant(value):
+        # repr() keeps 1, 1.0, True and 0.0, -0.0 apart
+        key = (type(value), repr(value))
+        if key not in constants:
+            constants[key] = len(constant_list)
+            constant_list.append(value)
+        return constants[key]
+
+    for inst in code:
+        operands = []
+        for kind, arg in zip(exprir.operand_kinds(inst), inst[1:]):
+            if kind in exprir.NAMES:
+                operands.append(slots.setdefault(arg, len(slots)))
+            elif kind in (exprir.VALUE, exprir.FUNC):
+                operands.append(constant(arg))
+            elif kind == exprir.TYPE:
+                operands.append(exprir.typenames.index(arg))
+            else:
+                operands.append(arg)
+        if variable(inst[0]):
+            start = len(pool)
+            pool.extend(operands)
+            operands = [start, len(operands)]
+        elif len(operands) > 4:
+            raise BytecodeError("Too many operands in %r" % (inst,))
+        opcode = opcodes.setdefault(inst[0], len(opcodes))
+        instructions.append(INSTRUCTION.pack(opcode, *(operands + [0] * (4 - len(operands)))))
+
+    opcode_list = sorted(opcodes, key=opcodes.get)
+    symbol_list = sorted(slots, key=slots.get)
+    tables = [LENGTH.pack(len(opcode_list))] + [pack_string(name) for name in opcode_list]
+    tables += [LENGTH.pack(len(constant_list))] + [pack_constant(value) for value in constant_list]
+    tables += [LENGTH.pack(len(symbol_list))] + [pack_string(str(name)) for name in symbol_list]
+
+    code_offset = HEADER.size
+    pool_offset = code_offset + INSTRUCTION.size * len(instructions)
+    table_offset = pool_offset + INTEGER.size * len(pool)
+    body = ''.join(instructions) + ''.join(INTEGER.pack(n) for n in pool) + ''.join(tables)
+    header = HEADER.pack(MAGIC, VERSION, len(instructions), len(pool),
+                         code_offset, pool_offset, table_offset, len(slots),
+                         HEADER.size + len(body))
+    return header + body
+
+def write(code, filename):
+    '''
+    Write a list of linked instruction tuples to a bytecode file.
+    '''
+    with open(filename, 'wb') as f:
+        f.write(encode(code))
+
+def is_bytecode(filename):
+    '''
+    Return True if filename is a bytecode file.
+    '''
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+class Bytecode(object):
+    '''
+    A bytecode program in a buffer (a string or an mmap).  Only the
+    tables are decoded; instructions are read from the buffer when
+    needed.
+
+        buffer          The bytes of the file
+        count           Number of instructions
+        code_offset     Start of the instructions in buffer
+        opcodes         Opcode names, indexed by opcode number
+        constants       Constant values
+        symbols         Names of the slots
+        slots           Number of slots
+    '''
+    def __init__(self, buffer):
+        if len(buffer) < HEADER.size:
+            raise BytecodeError("Truncated bytecode")
+        (magic, version, self.count, pool_count, self.code_offset, self.pool_offset,
+         table_offset, self.slots, length) = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise BytecodeError("Not a bytecode file of version %d" % VERSION)
+        if length != len(buffer):
+            raise BytecodeError("Truncated bytecode")
+        self.buffer = buffer
+        self.offset = table_offset
+        try:
+            self.opcodes = [self.read_string() for n in range(self.read_length())]
+            self.constants = [self.read_constant() for n in range(self.read_length())]
+            self.symbols = [self.read_string() for n in range(self.read_length())]
+        except (struct.error, IndexError, ValueError):
+            raise BytecodeError("Damaged bytecode tables")
+        for name in self.opcodes:
+            if exprir.split_opcode(name)[0] not in exprir.signatures:
+                raise BytecodeError("Unknown opcode %s" % name)
+
+    @classmethod
+    def open(cls, filename):
+        '''
+        Map a bytecode file into memory read-only.
+        '''
+        with open(filename, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                raise BytecodeError("Truncated bytecode")
+            return cls(mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ))
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def read_length(self):
+        value, = LENGTH.unpack_from(self.buffer, self.offset)
+        self.offset += LENGTH.size
+        return value
+
+    def read_string(self):
+        length = self.read_length()
+        value = self.buffer[self.offset:self.offset+length]
+        self.offset += length
+        return value
+
+    def read_constant(self):
+        tag = self.buffer[self.offset]
+        self.offset += 1
+        if tag == 'b':
+            value = self.buffer[self.offset] != '\0'
+            self.offset += 1
+        elif tag == 'i':
+            value, = INT64.unpack_from(self.buffer, self.offset)
+            self.offset += INT64.size
+        elif tag == 'l':
+            value = long(self.read_string())
+        elif tag == 'f':
+            value, = DOUBLE.unpack_from(self.buffer, self.offset)
+            self.offset += DOUBLE.size
+        elif tag == 's':
+            value = self.read_string()
+        else:
+            raise BytecodeError("Bad constant tag %r" % tag)
+        return value
+
+    def pool(self, start, count):
+        '''
+        Return count pool entries starting at start.
+        '''
+        offset = self.pool_offset + INTEGER.size * start
+        return struct.unpack_from('<%di' % count, self.buffer, offset)
+
+    def decoder(self, kind):
+        '''
+        Return a function turning an encoded operand of a kind into the
+        value the run_opcode() methods of the Interpreter take, or None
+        if it is used as it is (slot numbers and labels).
+        '''
+        if kind in (exprir.VALUE, exprir.FUNC):
+            return self.constants.__getitem__
+        elif kind == exprir.TYPE:
+            return exprir.typenames.__getitem__
+        return None
+
+    def instruction(self, pc):
+        '''
+        Return instruction number pc as the pair (opcode, operands), with
+        constants and types decoded and slot numbers left as they are.
+        '''
+        number, a, b, c, d = INSTRUCTION.unpack_from(self.buffer, self.code_offset + INSTRUCTION.size * pc)
+        opcode = self.opcodes[number]
+        if variable(opcode):
+            operands = self.pool(a, b)
+        else:
+            operands = (a, b, c, d)[:len(exprir.operand_kinds((opcode,)))]
+        decoders = [self.decoder(kind) for kind in exprir.operand_kinds((opcode,) + operands)]
+        if any(decoders):
+            operands = tuple(decode(value) if decode else value
+                             for decode, value in zip(decoders, operands))
+        return opcode, operands
+
+    def instructions(self):
+        '''
+        Return the program as a list of instruction tuples, with slots
+        turned back into names.
+        '''
+        code = []
+        symbols = self.symbols
+        for pc in range(self.count):
+            opcode, operands = self.instruction(pc)
+            kinds = exprir.operand_kinds((opcode,) + operands)
+            code.append((opcode,) + tuple(symbols[value] if kind in exprir.NAMES else value
+                                          for kind, value in zip(kinds, operands)))
+        return code
+
+if __name__ == '__main__':
+    import exprlex
+    import exprparse
+    import exprcheck
+    import exprcode
+    import exprpass
+    import exprfuse
+    import exprinterp
+    import sys
+    import optparse
+    from errors import subscribe_errors, errors_reported
+
+    parser = optparse.OptionParser(usage="%prog [options] file.e")
+    parser.add_option("-o", "--output",
+                     action="store", dest="output", default=None,
+                     help="bytecode file to write (default file.ebc)")
+    exprpass.add_options(parser)
+    exprfuse.add_options(parser)
+    options, args = parser.parse_args(sys.argv[1:])
+    lexer = exprlex.make_lexer()
+    parser = exprparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg+"\n")):
+        program = parser.parse(open(args[0]).read())
+        # Check the program
+        exprcheck.check_program(program)
+        # If no errors occurred, generate code
+        if not errors_reported():
+            code = exprcode.generate_code(program)
+            exprpass.optimize_with_options(code.start_block, options)
+            linker = exprinterp.BlockLinker()
+            linker.visit(code.start_block)
+            linker.patch_jumps()
+            code = exprfuse.fuse(linker.code) if options.fuse else linker.code
+            output = options.output or os.path.splitext(args[0])[0] + '.ebc'
+            write(code, output)
+            bytecode = Bytecode.open(output)
+            print "%s: %d instructions, %d constants, %d slots, %d bytes" % (
+                output, bytecode.count, len(bytecode.constants), bytecode.slots, len(bytecode.buffer))
@@ -0,0 +1,177 @@
+# exprcache.py
+'''
+Compilation Cache
+=================
+Running a program with exprinterp.py lexes, parses, checks, generates
+code, optimizes and links it every time, even if neither the program
+nor the compiler has changed.  Like Python's __pycache__, this file
+keeps the linked code on disk, as bytecode files of exprbytecode.py,
+and reuses it:
+
+    bash % python exprinterp.py -O2 loop.e       # compiles and stores
+    bash % python exprinterp.py -O2 loop.e       # loads the stored code
+
+The cache is content addressed.  The key of a program is the SHA-1
+hash of
+
+    -  the source text of the program,
+    -  the source of the compiler (every expr*.py file and errors.py
+       next to this one), so that changing the compiler makes all
+       entries stale,
+    -  the passes run (see exprpass.py), and
+    -  the version of the bytecode format,
+
+and the linked code is stored in the file <key>.ebc of a directory
+__exprcache__ next to the program (or the directory given with
+--cache-dir).  Programs with the same text share an entry, and entries
+are never changed once written, only replaced by identical ones.
+
+A file is written under a temporary name in the same directory and
+then renamed, which replaces the directory entry atomically, so a
+process running at the same time sees either no entry or a complete
+one.  Loading an entry maps the file into memory, so a program runs
+without decoding its instructions first.  A file that isn't valid
+bytecode is ignored.  The cache is only an optimization: if the
+directory can't be written, the program is compiled as usual.
+'''
+
+import os
+import sys
+import errno
+import hashlib
+import tempfile
+import exprbytecode
+
+_compiler_hash = None
+
+def compiler_hash():
+    '''
+    Return a hash of the source files of the compiler.
+    '''
+    global _compiler_hash
+    if _compiler_hash is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        names = sorted(name for name in os.listdir(directory)
+                       if name.endswith('.py') and (name.startswith('expr') or name == 'errors.py'))
+        digest = hashlib.sha1()
+        for name in names:
+            with open(os.path.join(directory, name), 'rb') as f:
+                digest.update(name + '\0' + f.read() + '\0')
+        _compiler_hash = digest.hexdigest()
+    return _compiler_hash
+
+class CompilationCache(object):
+    '''
+    Linked code of programs stored on disk.  directory is where the
+    entries go, or None for an __exprcache__ directory next to each
+    program.  self.hits and self.misses count the lookups.
+    '''
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, source, pipeline):
+        '''
+        Return the key of the program with text source, optimized by the
+        list of pass names pipeline.
+        '''
+        digest = hashlib.sha1()
+        for part in (str(exprbytecode.VERSION), compiler_hash(), ','.join(pipeline), source):
+            digest.update(part + '\0')
+        return digest.hexdigest()
+
+    def path(self, filename, key):
+        '''
+        Return the path of the cache file for key of the program in filename.
+        '''
+        directory = self.directory
+        if directory is None:
+            directory = os.path.join(os.path.dirname(os.path.abspath(filename)), '__exprcache__')
+        return os.path.join(directory, key + '.ebc')
+
+    def load(self, filename, key):
+        '''
+        Return the stored code for key as an exprbytecode.Bytecode, or
+        None if there isn't any.
+        '''
+        try:
+            code = exprbytecode.Bytecode.open(self.path(filename, key))
+        except (EnvironmentError, exprbytecode.BytecodeError):
+            code = None
+        if code is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return code
+
+    def store(self, filename, key, code):
+        '''
+        Store the list of instruction tuples code for key.  Returns
+        False if it couldn't be written.
+        '''
+        path = self.path(filename, key)
+        directory = os.path.dirname(path)
+        try:
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                # Another process may have made it at the same time
+                if e.errno != errno.EEXIST:
+                    raise
+            fd, temp = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(exprbytecode.encode(code))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.chmod(temp, 0644)
+                try:
+                    os.rename(temp, path)
+                except OSError:
+                    # Windows can't rename over an existing file, but then
+                    # another process has already stored the same code
+                    if not os.path.exists(path):
+                        raise
+                    os.unlink(temp)
+            except:
+                if os.path.exists(temp):
+                    os.unlink(temp)
+                raise
+        except (IOError, OSError):
+            return False
+        return True
+
+def add_options(parser):
+    '''
+    Add the command line options of the cache to an
+    optparse.OptionParser.
+    '''
+    parser.add_option("--no-cache",
+                     action="store_false", dest="cache", default=True,
+                     help="always compile, don't use the compilation cache")
+    parser.add_option("--cache-dir",
+                     action="store", dest="cache_dir", default=None,
+                     help="directory of the compilation cache (default __exprcache__ next to the program)")
+
+def cache_from_options(options):
+    '''
+    Return the CompilationCache selected by the options of
+    add_options(), or None if caching is off.
+    '''
+    if not options.cache:
+        return None
+    return CompilationCache(options.cache_dir)
+
+if __name__ == '__main__':
+    import exprpass
+    import optparse
+
+    parser = optparse.OptionParser(usage="%prog [options] file.e")
+    exprpass.add_options(parser)
+    add_options(parser)
+    options, args = parser.parse_args(sys.argv[1:])
+    cache = CompilationCache(options.cache_dir)
+    key = cache.key(open(args[0]).read(), exprpass.selected_pipeline(options))
+    path = cache.path(args[0], key)
+    print "%s %s" % (path, "cached" if cache.load(args[0], key) is not None else "not cached")
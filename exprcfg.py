@@ -0,0 +1,401 @@
+# exprcfg.py
+'''
+Control Flow Graph
+==================
+The blocks made by exprcode.py only link forward: a block knows its
+next_block, an IfBlock its two branches and a WhileBlock its body.
+Where control goes at the end of a chain of blocks is implied by the
+structure:
+
+    -  At the end of an if or else branch, control goes to the
+       next_block of the IfBlock.
+
+    -  At the end of the body of a while loop, control goes back to
+       the WhileBlock, which evaluates the test again.
+
+    -  At the end of the top-level chain, the program stops.
+
+This file makes these edges explicit.  For every block reachable from
+the start block, a ControlFlowGraph lists its successors and
+predecessors, a reverse postorder numbering and the immediate
+dominator of each block.  Dominators are computed with the iterative
+algorithm of Cooper, Harvey and Kennedy ("A Simple, Fast Dominance
+Algorithm").  A block X dominates block Y if every path from the start
+block to Y goes through X.
+
+On top of the dominators the graph provides
+
+    -  the dominator tree, and a preorder and postorder numbering of
+       it, which answers dominates(x, y) in constant time.
+
+    -  the dominance frontiers (used by exprssa.py).
+
+    -  the loop-nesting forest.  Every edge to a block dominating its
+       source is a back edge, and the header it goes to together with
+       all the blocks that reach the back edge without passing the
+       header form a natural loop.  Loops are found innermost first,
+       and each finished loop is collapsed into its header with a
+       union-find structure, so that no block is looked at again by
+       the loops around it.  For the code of exprcode.py the headers
+       are exactly the WhileBlocks.
+
+All of these are computed once, on first use, in time close to linear
+in the number of blocks.  For example:
+
+       cfg = control_flow_graph(start_block)
+       for loop in cfg.loops:
+           print loop.header, loop.depth, len(loop.all_blocks())
+
+The graph is a snapshot of the links between the blocks.  Setting
+next_block, if_branch, else_branch or body of any block counts up
+Block.generation (see exprblock.py), which marks all graphs built
+before as out of date.  control_flow_graph() returns the graph built
+last if it is still valid, so that passes which don't relink blocks
+share one graph.  Changing the instructions of blocks doesn't change
+the graph.
+'''
+
+from exprblock import Block, IfBlock, WhileBlock
+
+class Loop(object):
+    '''
+    A natural loop of a control flow graph.
+
+        header         The block all back edges of the loop go to
+        blocks         Blocks of the loop not in an inner loop, in
+                       reverse postorder (the header comes first)
+        parent         The innermost loop around this one, or None
+        children       Loops directly inside this one
+        depth          Nesting depth, 1 for an outermost loop
+    '''
+    def __init__(self, header):
+        self.header = header
+        self.blocks = []
+        self.parent = None
+        self.children = []
+        self.depth = 1
+
+    def all_blocks(self):
+        '''
+        Return all blocks of the loop, including those of inner loops.
+        '''
+        blocks = []
+        stack = [self]
+        while stack:
+            loop = stack.pop()
+            blocks.extend(loop.blocks)
+            stack.extend(reversed(loop.children))
+        return blocks
+
+    def __repr__(self):
+        return "<Loop %s depth %d>" % (self.header, self.depth)
+
+class ControlFlowGraph(object):
+    '''
+    Successors, predecessors and dominators of the blocks reachable
+    from a start block.
+
+        succs[block]   List of successor blocks
+        preds[block]   List of predecessor blocks
+        order          Blocks in reverse postorder
+        number[block]  Position of the block in order
+        idom[block]    Immediate dominator (None for the start block)
+        generation     Block.generation when the graph was built
+
+    The dominator tree, dominance frontiers and loops are computed on
+    first use.  The dictionaries and lists returned are shared and
+    must not be changed.
+    '''
+    def __init__(self, start_block):
+        self.start_block = start_block
+        self.generation = Block.generation
+        self.succs = {}
+        self.preds = {}
+        self.build()
+        self.order = self.reverse_postorder()
+        self.number = dict((block, n) for n, block in enumerate(self.order))
+        self.idom = self.dominators()
+        self._children = None
+        self._frontiers = None
+        self._interval = None
+        self._loops = None
+
+    def valid(self):
+        '''
+        Return True if no block has been relinked since the graph was built.
+        '''
+        return self.generation == Block.generation
+
+    def build(self):
+        '''
+        Fill in succs and preds by walking every chain of blocks
+        together with the block that follows the end of the chain.
+        '''
+        chains = [(self.start_block, None)]
+        while chains:
+            block, follow = chains.pop()
+            while isinstance(block, Block):
+                if isinstance(block.next_block, Block):
+                    after = block.next_block
+                else:
+                    after = follow
+                if isinstance(block, IfBlock):
+                    succs = [block.if_branch or after, block.else_branch or after]
+                    chains.append((block.if_branch, after))
+                    chains.append((block.else_branch, after))
+                elif isinstance(block, WhileBlock):
+                    succs = [block.body or block, after]
+                    chains.append((block.body, block))
+                else:
+                    succs = [after]
+                self.succs[block] = []
+                self.preds.setdefault(block, [])
+                for succ in succs:
+                    if succ is not None and succ not in self.succs[block]:
+                        self.succs[block].append(succ)
+                        self.preds.setdefault(succ, []).append(block)
+                block = block.next_block
+
+    def reverse_postorder(self):
+        '''
+        Return the reachable blocks in reverse postorder.  Successors
+        are searched last to first, which puts the body of a loop right
+        after its WhileBlock and if branches before else branches, the
+        same as the order of the code.
+        '''
+        postorder = []
+        visited = set([self.start_block])
+        stack = [(self.start_block, reversed(self.succs[self.start_block]))]
+        while stack:
+            block, succs = stack[-1]
+            for succ in succs:
+                if succ not in visited:
+                    visited.add(succ)
+                    stack.append((succ, reversed(self.succs[succ])))
+                    break
+            else:
+                stack.pop()
+                postorder.append(block)
+        postorder.reverse()
+        return postorder
+
+    def dominators(self):
+        '''
+        Compute the immediate dominator of every reachable block.
+        '''
+        number = self.number
+        start = self.start_block
+        idom = {start: start}
+
+        def intersect(a, b):
+            while a is not b:
+                while number[a] > number[b]:
+                    a = idom[a]
+                while number[b] > number[a]:
+                    b = idom[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for block in self.order[1:]:
+                new_idom = None
+                for pred in self.preds[block]:
+                    if pred in idom:
+                        new_idom = pred if new_idom is None else intersect(pred, new_idom)
+                if idom.get(block) is not new_idom:
+                    idom[block] = new_idom
+                    changed = True
+        idom[start] = None
+        return idom
+
+    def dominator_tree(self):
+        '''
+        Return a dictionary mapping each block to the list of blocks it
+        immediately dominates, in reverse postorder.
+        '''
+        if self._children is None:
+            children = dict((block, []) for block in self.order)
+            for block in self.order[1:]:
+                children[self.idom[block]].append(block)
+            self._children = children
+        return self._children
+
+    def dominates(self, a, b):
+        '''
+        Return True if block a dominates block b.  Every block dominates
+        itself.
+        '''
+        if self._interval is None:
+            self._interval = self.number_dominator_tree()
+        first_a, last_a = self._interval[a]
+        first_b, last_b = self._interval[b]
+        return first_a <= first_b and last_b <= last_a
+
+    def number_dominator_tree(self):
+        '''
+        Number the dominator tree in preorder and postorder with one
+        counter.  Returns a dictionary mapping each block to the pair of
+        numbers, so that a dominates b if the pair of b lies within the
+        pair of a.
+        '''
+        children = self.dominator_tree()
+        interval = {}
+        counter = 0
+        stack = [(self.start_block, False)]
+        while stack:
+            block, leaving = stack.pop()
+            if leaving:
+                interval[block] = (interval[block], counter)
+            else:
+                interval[block] = counter
+                stack.append((block, True))
+                for child in reversed(children[block]):
+                    stack.append((child, False))
+            counter += 1
+        return interval
+
+    def dominance_frontiers(self):
+        '''
+        Return a dictionary mapping each block to the set of blocks in
+        its dominance frontier: the blocks where its dominance ends.
+        '''
+        if self._frontiers is None:
+            frontiers = dict((block, set()) for block in self.order)
+            for block in self.order:
+                preds = [pred for pred in self.preds[block] if pred in frontiers]
+                if len(preds) < 2:
+                    continue
+                for pred in preds:
+                    runner = pred
+                    while runner is not self.idom[block]:
+                        frontiers[runner].add(block)
+                        runner = self.idom[runner]
+            self._frontiers = frontiers
+        return self._frontiers
+
+    @property
+    def loops(self):
+        '''
+        All loops, outer loops before the loops inside them.
+        '''
+        if self._loops is None:
+            self.find_loops()
+        return self._loops
+
+    @property
+    def loop_of(self):
+        '''
+        Dictionary mapping each block inside a loop to the innermost
+        Loop containing it.
+        '''
+        if self._loops is None:
+            self.find_loops()
+        return self._loop_of
+
+    def loop_depth(self, block):
+        '''
+        Return the number of loops around block (0 outside of loops).
+        '''
+        loop = self.loop_of.get(block)
+        return loop.depth if loop else 0
+
+    def find_loops(self):
+        '''
+        Build the loop-nesting forest.  Headers are handled in reverse
+        order of their reverse postorder number, so that an inner loop
+        is complete before the loop around it.
+        '''
+        collapsed = {}              # Block -> header of a finished loop containing it
+
+        def find(block):
+            root = block
+            while root in collapsed:
+                root = collapsed[root]
+            while block is not root:
+                collapsed[block], block = root, collapsed[block]
+            return root
+
+        headers = {}                # Header -> Loop
+        loop_of = {}
+        for header in reversed(self.order):
+            latches = [pred for pred in self.preds[header]
+                       if pred in self.number and self.dominates(header, pred)]
+            if not latches:
+                continue
+            loop = Loop(header)
+            members = set()
+            work = [find(pred) for pred in latches]
+            while work:
+                block = work.pop()
+                if block is header or block in members:
+                    continue
+                members.add(block)
+                for pred in self.preds[block]:
+                    # Edges from outside the header's dominance only exist
+                    # in irreducible graphs, which exprcode.py never makes
+                    if pred in self.number and self.dominates(header, pred):
+                        work.append(find(pred))
+            for block in members:
+                collapsed[block] = header
+                if block in headers:
+                    headers[block].parent = loop
+                else:
+                    loop_of[block] = loop
+            loop_of[header] = loop
+            headers[header] = loop
+
+        loops = [headers[block] for block in self.order if block in headers]
+        for loop in loops:
+            if loop.parent:
+                loop.depth = loop.parent.depth + 1
+                loop.parent.children.append(loop)
+        for block in self.order:
+            if block in loop_of:
+                loop_of[block].blocks.append(block)
+        self._loops = loops
+        self._loop_of = loop_of
+
+# The graph built last, reused while no block is relinked
+_last_graph = None
+
+def control_flow_graph(start_block):
+    '''
+    Return the ControlFlowGraph of the blocks reachable from
+    start_block, reusing the graph built last if it is for the same
+    start block and still valid.
+    '''
+    global _last_graph
+    cfg = _last_graph
+    if cfg is None or cfg.start_block is not start_block or not cfg.valid():
+        cfg = _last_graph = ControlFlowGraph(start_block)
+    return cfg
+
+if __name__ == '__main__':
+    import exprlex
+    import exprparse
+    import exprcheck
+    import exprcode
+    import sys
+    from errors import subscribe_errors, errors_reported
+    lexer = exprlex.make_lexer()
+    parser = exprparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg+"\n")):
+        program = parser.parse(open(sys.argv[1]).read())
+        # Check the program
+        exprcheck.check_program(program)
+        # If no errors occurred, generate code
+        if not errors_reported():
+            code = exprcode.generate_code(program)
+            cfg = control_flow_graph(code.start_block)
+            for block in cfg.order:
+                print "%4d %s" % (cfg.number[block], block)
+                print "     idom  %s" % cfg.idom[block]
+                print "     succs %s" % ', '.join(str(cfg.number[succ]) for succ in cfg.succs[block])
+                print "     loop depth %d" % cfg.loop_depth(block)
+            print
+            stack = [loop for loop in reversed(cfg.loops) if loop.parent is None]
+            while stack:
+                loop = stack.pop()
+                print "%s%s: %d blocks" % ('  ' * (loop.depth - 1), loop, len(loop.all_blocks()))
+                stack.extend(reversed(loop.children))
@@ -88,6 +88,57 @@ from errors import error
 from exprast import *
 import exprtype
 import exprlex
+from exprops import evaluate, binary_ops, unary_ops, short_circuit_ops
+
+def compute(op, typename, args):
+    '''
+    Return the result of an operation on known values as a pair
+    (typename, value), or None if it can't be computed.
+    '''
+    try:
+        return evaluate(op, typename, args)
+    except (KeyError, ArithmeticError):
+        return None
+    except TypeError:
+        # Operands of the wrong type, which has been reported already
+        return None
+
+def constant_value(node):
+    '''
+    Return the value of an expression as a pair (typename, value) if it
+    is known at compile time, or None.  Literals, constants with such a
+    value, and operations on them are known, unless the operation fails
+    at run time (like a division by zero).  Types must have been checked.
+    '''
+    if isinstance(node, Literal):
+        return node.type.name, node.value
+    elif isinstance(node, LoadLocation):
+        return getattr(node, 'const_value', None)
+    elif isinstance(node, Group):
+        return constant_value(node.expression)
+    elif isinstance(node, UnaryOp):
+        value = constant_value(node.left)
+        if value is None:
+            return None
+        return compute(unary_ops[node.op], node.left.type.name, [value[1]])
+    elif isinstance(node, (BinaryOp, RelationalOp)):
+        chain = left_chain(node, lambda n: isinstance(n, (BinaryOp, RelationalOp)))
+        value = constant_value(chain[0].left)
+        for op in chain:
+            if value is None:
+                return None
+            if op.op in short_circuit_ops:
+                # The right operand only counts if the left one doesn't
+                # decide the result
+                if value[1] != (op.op == '||'):
+                    value = constant_value(op.right)
+            else:
+                right = constant_value(op.right)
+                if right is None:
+                    return None
+                value = compute(binary_ops[op.op], op.left.type.name, [value[1], right[1]])
+        return value
+    return None
 
 class SymbolTable(object):
     '''
@@ -147,14 +198,23 @@ class CheckProgramVisitor(NodeVisitor):
         self.visit(node.left)
         if not exprlex.operators[node.op] in node.left.type.un_ops:
             error(node.lineno, "Operation not supported with this type")
-        self.type = node.left.type
+        node.type = node.left.type
 
     def visit_BinaryOp(self, node):
+        # a + b + c + ... is a chain of operations down the left side,
+        # which is checked from the bottom up without recursing
+        chain = left_chain(node, lambda n: isinstance(n, (BinaryOp, RelationalOp)))
+        self.visit(chain[0].left)
+        for op in chain:
+            self.visit(op.right)
+            getattr(self, 'check_' + op.__class__.__name__)(op)
+
+    visit_RelationalOp = visit_BinaryOp
+
+    def check_BinaryOp(self, node):
         # 1. Make sure left and right operands have the same type
         # 2. Make sure the operation is supported
         # 3. Assign the result type
-        self.visit(node.left)
-        self.visit(node.right)
         node.type = node.left.type
 
     def visit_AssignmentStatement(self,node):
@@ -162,6 +222,8 @@ class CheckProgramVisitor(NodeVisitor):
         sym = self.symtab.lookup(node.location)
         assert sym, "Assigning to unknown sym"
         ## 2. Check that assignment is allowed, ie. sym is not a constant
+        if isinstance(sym, ConstDeclaration):
+            error(node.lineno, "Can't assign to constant %s" % node.location)
         ## 3. Check that the types match
         self.visit(node.value)
         assert sym.type == node.value.type, "Type mismatch in assignment"
@@ -175,6 +237,9 @@ class CheckProgramVisitor(NodeVisitor):
             self.symtab.add(node.id, node)
         self.visit(node.value)
         node.type = node.value.type
+        # 3. Record the value if it's known at compile time, so that
+        # code generation can use it instead of loading the constant
+        node.const_value = constant_value(node.value)
 
     def visit_VarDeclaration(self,node):
         # 1. Check that the variable name is not already defined
@@ -208,6 +273,9 @@ class CheckProgramVisitor(NodeVisitor):
         sym = self.symtab.lookup(node.name)
         assert(sym)
         node.type = sym.type
+        # 3. Loads of a constant with a known value get the value
+        if isinstance(sym, ConstDeclaration) and getattr(sym, 'const_value', None):
+            node.const_value = sym.const_value
 
     def visit_Literal(self,node):
         # Attach an appropriate type to the literal
@@ -246,9 +314,7 @@ class CheckProgramVisitor(NodeVisitor):
         self.visit(node.expression)
         node.type = node.expression.type
 
-    def visit_RelationalOp(self, node):
-        self.visit(node.left)
-        self.visit(node.right)
+    def check_RelationalOp(self, node):
         if not node.left.type == node.right.type:
             error(node.lineno, "Relational operands are not of same type")
         elif not exprlex.operators[node.op] in node.left.type.bin_ops:
@@ -160,37 +160,59 @@ To start, your SSA code should only contain the following operators:
        ('uadd_type',source,target)        # target = +source
        ('uneg_type',source,target)        # target = -source
        ('print_type',source)              # Print value of source
+
+Comparisons get one opcode per operator:
+
+       ('lt_type',left,right,target)      # target = left < right
+       ('le_type',left,right,target)      # target = left <= right
+       ('eq_type',left,right,target)      # target = left == right
+       ('ne_type',left,right,target)      # target = left != right
+       ('ge_type',left,right,target)      # target = left >= right
+       ('gt_type',left,right,target)      # target = left > right
+
+The logical operators && and || don't evaluate their right operand if
+the left one decides the result.  They become an IfBlock storing to a
+hidden variable (see GenerateCode.short_circuit()).
+
+Constants are only kept in memory if their value isn't known at compile
+time.  The checker (exprcheck.py) computes the value of declarations
+like
+
+       const n = 2 * 3;
+
+and every use of n becomes ('literal_int', 6, target) instead of a
+'load', with no 'alloc' or 'store' for n at all.
 '''
 
 import exprast
 import exprblock
+import exprir
 from exprblock import BasicBlock, IfBlock, WhileBlock
 from collections import defaultdict
 
 # STEP 1: Map map operator symbol names such as +, -, *, /
 # to actual opcode names 'add','sub','mul','div' to be emitted in
-# the SSA code.   This is easy to do using dictionaries:
-
-binary_ops = {
-    '+' : 'add',
-    '-' : 'sub',
-    '*' : 'mul',
-    '/' : 'div',
-    '<' : 'lt',
-    '>' : 'gt',
-    '==': 'eq',
-    '!=': 'ne',
-    '<=': 'le',
-    '>=': 'ge',
-    '&&': 'land',
-    '||': 'lor',
-}
-
-unary_ops = {
-    '+' : 'uadd',
-    '-' : 'usub',
-    '!' : 'lnot',
-}
+# the SSA code.  The dictionaries are shared with the checker and
+# the optimizations (see exprops.py):
+from exprops import binary_ops, unary_ops, short_circuit_ops
+
+# Operators whose chains on ints are balanced (see GenerateCode.balanced)
+associative_ops = set(['+', '*'])
+
+def has_short_circuit(node):
+    '''
+    Return True if the expression node uses && or ||.
+    '''
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, exprast.RelationalOp) and node.op in short_circuit_ops:
+            return True
+        if isinstance(node, exprast.AST):
+            stack.extend(getattr(node, field, None) for field in node._fields)
+        elif isinstance(node, list):
+            stack.extend(node)
+    return False
 
 # STEP 2: Implement the following Node Visitor class so that it creates
 # a sequence of SSA instructions in the form of tuples.  Use the
@@ -199,14 +221,20 @@ class GenerateCode(exprast.NodeVisitor):
     '''
     Node visitor class that creates 3-address encoded instruction sequences.
     '''
-    def __init__(self):
+    def __init__(self, compact=False):
         super(GenerateCode, self).__init__()
 
         # version dictionary for temporaries
         self.versions = defaultdict(int)
 
+        # In compact mode, instructions are stored as integers in
+        # exprir.CompactCode objects and temporaries are registers
+        self.compact = compact
+        if compact:
+            self.registers = exprir.Registers()
+
         # The generated code (list of tuples)
-        self.code = BasicBlock()
+        self.code = self.new_block(BasicBlock)
         self.start_block = self.code
 
         # A list of external declarations (and types)
@@ -216,10 +244,30 @@ class GenerateCode(exprast.NodeVisitor):
         '''
         Create a new temporary variable of a given type.
         '''
+        if self.compact:
+            return self.registers.new_temp(typeobj.name)
         name = "__%s_%d" % (typeobj.name, self.versions[typeobj.name])
         self.versions[typeobj.name] += 1
         return name
 
+    def new_block(self, blockclass):
+        '''
+        Create a new block of the given class.
+        '''
+        block = blockclass()
+        if self.compact:
+            block.instructions = exprir.CompactCode(self.registers)
+        return block
+
+    def test_name(self, location):
+        '''
+        Return the name of the temporary holding the value tested by an
+        IfBlock or WhileBlock.
+        '''
+        if self.compact:
+            return self.registers.name(location)
+        return location
+
     # You must implement visit_Nodename methods for all of the other
     # AST nodes.  In your code, you will need to make instructions
     # and append them to the self.code list.
@@ -239,10 +287,40 @@ class GenerateCode(exprast.NodeVisitor):
         node.gen_location = target
 
     def visit_BinaryOp(self,node):
-        # Visit the left and right expressions
-        self.visit(node.left)
-        self.visit(node.right)
+        if node.op in associative_ops and node.type.name == 'int':
+            same = lambda n: isinstance(n, exprast.BinaryOp) and n.op == node.op
+            chain = exprast.left_chain(node, same)
+            if len(chain) > 1:
+                operands = [chain[0].left] + [op.right for op in chain]
+                node.gen_location = self.balanced(node, operands, 0, len(operands))
+                return
+
+        # a + b - c * d < e ... is a chain of operations down the left
+        # side, which is generated from the bottom up without recursing
+        chain = exprast.left_chain(node, self.chained)
+        self.visit(chain[0].left)
+        for op in chain:
+            self.visit(op.right)
+            self.operation(op)
+
+    def visit_RelationalOp(self,node):
+        if node.op in short_circuit_ops:
+            self.short_circuit(node)
+            return
+        self.visit_BinaryOp(node)
 
+    def chained(self, node):
+        '''
+        Return True if node is an operation of a left chain.
+        '''
+        return isinstance(node, exprast.BinaryOp) or \
+               (isinstance(node, exprast.RelationalOp) and node.op not in short_circuit_ops)
+
+    def operation(self, node):
+        '''
+        Emit the instruction of a binary operation or comparison whose
+        operands have been generated.
+        '''
         # Make a new temporary for storing the result
         target = self.new_temp(node.type)
 
@@ -254,22 +332,100 @@ class GenerateCode(exprast.NodeVisitor):
         # Store location of the result on the node
         node.gen_location = target
 
-    def visit_RelationalOp(self,node):
-        # Visit the left and right expressions
+    def balanced(self, node, operands, start, end):
+        '''
+        Generate operands[start:end] combined by the associative operation
+        of node as a balanced tree, so that a + b + c + d is computed as
+        (a + b) + (c + d).  The operands are still evaluated from left to
+        right.  Returns the location of the result.
+        '''
+        if end - start == 1:
+            self.visit(operands[start])
+            return operands[start].gen_location
+        middle = (start + end) // 2
+        left = self.balanced(node, operands, start, middle)
+        right = self.balanced(node, operands, middle, end)
+        target = self.new_temp(node.type)
+        self.code.append((binary_ops[node.op] + "_" + node.type.name, left, right, target))
+        return target
+
+    def short_circuit(self, node):
+        '''
+        Lower && and || into an IfBlock, so that the right operand is
+        only evaluated if it decides the result.  The result is kept in
+        a hidden variable:
+
+              result = left;
+              if result {          // else branch for ||
+                  result = right;
+              }
+        '''
+        result = self.hidden_variable(node)
         self.visit(node.left)
+        self.code.append(('store_bool', node.left.gen_location, result))
+
+        if_block = self.new_block(IfBlock)
+        self.code.next_block = if_block
+        self.switch_block(if_block)
+        test = self.new_temp(node.type)
+        if_block.append(('load_bool', result, test))
+        if_block.test = self.test_name(test)
+
+        # The right operand goes into the branch taken if it's needed
+        if_block.if_branch = self.new_block(BasicBlock)
+        if node.op == '||':
+            if_block.else_branch = self.new_block(BasicBlock)
+            self.switch_block(if_block.else_branch)
+        else:
+            self.switch_block(if_block.if_branch)
         self.visit(node.right)
+        self.code.append(('store_bool', node.right.gen_location, result))
 
-        # Make a new temporary for storing the result
+        if_block.next_block = self.new_block(BasicBlock)
+        self.switch_block(if_block.next_block)
         target = self.new_temp(node.type)
+        self.code.append(('load_bool', result, target))
+        node.gen_location = target
 
-        # Create the opcode and append to list
-        #opcode = binary_ops[node.op] + "_"+node.left.type.name
-        opcode = "cmp" + "_"+node.left.type.name
-        inst = (opcode, binary_ops[node.op], node.left.gen_location, node.right.gen_location, target)
-        self.code.append(inst)
+    def hidden_variable(self, node):
+        '''
+        Return the name of a variable, not visible in the program, that
+        holds the value of an expression node.  Generating code for the
+        same node again uses the same variable.
+        '''
+        name = getattr(node, 'gen_variable', None)
+        if name is None:
+            name = node.gen_variable = "__cond_%d" % self.versions['cond']
+            self.versions['cond'] += 1
+        return name
 
-        # Store location of the result on the node
-        node.gen_location = target
+    def store_condition(self, node):
+        '''
+        Evaluate a condition into its hidden variable.
+        '''
+        self.visit(node)
+        if not (isinstance(node, exprast.RelationalOp) and node.op in short_circuit_ops):
+            self.code.append(('store_bool', node.gen_location, self.hidden_variable(node)))
+
+    def link_condition(self, node, block):
+        '''
+        Link in an IfBlock or WhileBlock and generate code for its
+        condition so that block computes the tested value.  A condition
+        with && or || needs blocks of its own, so it's evaluated before
+        block into a hidden variable, and block only loads it.
+        '''
+        if has_short_circuit(node):
+            self.store_condition(node)
+            self.code.next_block = block
+            self.switch_block(block)
+            location = self.new_temp(node.type)
+            self.code.append(('load_bool', self.hidden_variable(node), location))
+        else:
+            self.code.next_block = block
+            self.switch_block(block)
+            self.visit(node)
+            location = node.gen_location
+        block.test = self.test_name(location)
 
     def visit_PrintStatement(self,node):
         # Visit the printed expression
@@ -293,6 +449,10 @@ class GenerateCode(exprast.NodeVisitor):
     #    self.code.append(inst)
 
     def visit_ConstDeclaration(self,node):
+        # A constant whose value the checker knows isn't kept in memory.
+        # Every use of it is a literal (see visit_LoadLocation).
+        if getattr(node, 'const_value', None):
+            return
         # allocate in memory
         inst = ('alloc_'+node.type.name, 
                     node.id)
@@ -319,9 +479,14 @@ class GenerateCode(exprast.NodeVisitor):
 
     def visit_LoadLocation(self,node):
         target = self.new_temp(node.type)
-        inst = ('load_'+node.type.name,
-                node.name,
-                target)
+        if getattr(node, 'const_value', None):
+            inst = ('literal_'+node.type.name,
+                    node.const_value[1],
+                    target)
+        else:
+            inst = ('load_'+node.type.name,
+                    node.name,
+                    target)
         self.code.append(inst)
         node.gen_location = target
 
@@ -358,42 +523,39 @@ class GenerateCode(exprast.NodeVisitor):
         self.visit(node.left)
         target = self.new_temp(node.type)
         opcode = unary_ops[node.op] + "_" + node.left.type.name
-        inst = (opcode, node.left.gen_location)
+        inst = (opcode, node.left.gen_location, target)
         self.code.append(inst)
         node.gen_location = target
 
     def visit_IfStatement(self,node):
-        if_block = IfBlock()
-        self.code.next_block = if_block
+        if_block = self.new_block(IfBlock)
         # condition
-        self.switch_block(if_block)
-        self.visit(node.condition)
-        if_block.test = node.condition.gen_location
+        self.link_condition(node.condition, if_block)
         # then branch
-        if_block.if_branch = BasicBlock()
+        if_block.if_branch = self.new_block(BasicBlock)
         self.switch_block(if_block.if_branch)
         self.visit(node.then_b)
         # else branch
         if node.else_b:
-            if_block.else_branch = BasicBlock()
+            if_block.else_branch = self.new_block(BasicBlock)
             self.switch_block(if_block.else_branch)
             self.visit(node.else_b)
         # set up next block
-        if_block.next_block = BasicBlock()
+        if_block.next_block = self.new_block(BasicBlock)
         self.switch_block(if_block.next_block)
 
     def visit_WhileStatement(self, node):
-        while_block = WhileBlock()
-        self.code.next_block = while_block
+        while_block = self.new_block(WhileBlock)
         # condition
-        self.switch_block(while_block)
-        self.visit(node.condition)
-        while_block.test = node.condition.gen_location
+        self.link_condition(node.condition, while_block)
         # body
-        while_block.body = BasicBlock()
+        while_block.body = self.new_block(BasicBlock)
         self.switch_block(while_block.body)
         self.visit(node.body)
-        while_block.next_block = BasicBlock()
+        if has_short_circuit(node.condition):
+            # evaluate the condition for the next round
+            self.store_condition(node.condition)
+        while_block.next_block = self.new_block(BasicBlock)
         self.switch_block(while_block.next_block)
 
     def switch_block(self, next_block):
@@ -414,6 +576,128 @@ class GenerateCode(exprast.NodeVisitor):
     #    self.code.append(inst)
 
 
+class LinearCode(GenerateCode, exprir.Assembler):
+    '''
+    Code generator that emits linked code directly.  Instead of making
+    blocks for BlockLinker (in exprinterp.py) to lay out afterwards,
+    if and while statements emit their jumps right away, with labels
+    backpatched by exprir.Assembler.  The layout is the one of
+    BlockLinker, so that
+
+        gen = LinearCode()
+        gen.visit(program)
+        gen.patch_jumps()
+
+    leaves in gen.code the same instructions as generate_code(),
+    BlockLinker.visit() and patch_jumps() together, in one pass and
+    without making any blocks.  There is no block graph to optimize,
+    so this is only useful when no passes are run.
+    '''
+    def __init__(self):
+        GenerateCode.__init__(self)
+        exprir.Assembler.__init__(self)
+        self.start_block = None
+        self.labels = 0
+
+    def new_label(self):
+        self.labels += 1
+        return self.labels
+
+    def short_circuit(self, node):
+        result = self.hidden_variable(node)
+        self.visit(node.left)
+        self.code.append(('store_bool', node.left.gen_location, result))
+
+        test = self.new_temp(node.type)
+        self.code.append(('load_bool', result, test))
+        right, other, end = self.new_label(), self.new_label(), self.new_label()
+        # The right operand goes into the branch taken if it's needed
+        if node.op == '||':
+            self.emit_jump('cbranch', test, other, right)
+            self.define(other)
+            self.emit_jump('jump', end)
+        else:
+            self.emit_jump('cbranch', test, right, end)
+        self.define(right)
+        self.visit(node.right)
+        self.code.append(('store_bool', node.right.gen_location, result))
+        self.define(end)
+
+        target = self.new_temp(node.type)
+        self.code.append(('load_bool', result, target))
+        node.gen_location = target
+
+    def condition(self, node):
+        '''
+        Generate code for a condition and return the temporary holding
+        its value.  As in link_condition(), a condition with && or ||
+        is evaluated into its hidden variable first.
+        '''
+        if has_short_circuit(node):
+            self.store_condition(node)
+        return self.test_value(node)
+
+    def test_value(self, node):
+        '''
+        Generate the code that would go into the IfBlock or WhileBlock
+        of a condition, and return the temporary holding its value.
+        For a condition with && or || it only loads the hidden variable.
+        '''
+        if has_short_circuit(node):
+            location = self.new_temp(node.type)
+            self.code.append(('load_bool', self.hidden_variable(node), location))
+            return location
+        self.visit(node)
+        return node.gen_location
+
+    def visit_IfStatement(self, node):
+        test = self.condition(node.condition)
+        then_label, else_label, end = self.new_label(), self.new_label(), self.new_label()
+        self.emit_jump('cbranch', test, then_label, else_label if node.else_b else end)
+        # then branch
+        self.define(then_label)
+        self.visit(node.then_b)
+        # else branch
+        if node.else_b:
+            self.emit_jump('jump', end)
+            self.define(else_label)
+            self.visit(node.else_b)
+        self.define(end)
+
+    def visit_WhileStatement(self, node):
+        body, test_label, end = self.new_label(), self.new_label(), self.new_label()
+        # The loop is rotated, so the test is generated now but goes
+        # after the body.  A test without && or || has no jumps.
+        if has_short_circuit(node.condition):
+            self.store_condition(node.condition)
+        start = len(self.code)
+        test = self.test_value(node.condition)
+        test_code = self.code[start:]
+        del self.code[start:]
+        self.emit_jump('jump', test_label)
+        # body
+        self.define(body)
+        self.visit(node.body)
+        if has_short_circuit(node.condition):
+            # evaluate the condition for the next round
+            self.store_condition(node.condition)
+        # test
+        self.define(test_label)
+        self.code.extend(test_code)
+        self.emit_jump('cbranch', test, body, end)
+        self.define(end)
+
+def generate_linear_code(node):
+    '''
+    Generate linked code from the supplied AST node, without blocks.
+    Returns the list of instruction tuples.
+    '''
+    gen = LinearCode()
+    gen.visit(node)
+    gen.patch_jumps()
+    return gen.code
+
+
 # STEP 3: Testing
 # 
 # Try running this program on the input file Project4/Tests/good.e and viewing
@@ -429,29 +713,43 @@ class GenerateCode(exprast.NodeVisitor):
 # ----------------------------------------------------------------------
 #                       DO NOT MODIFY ANYTHING BELOW       
 # ----------------------------------------------------------------------
-def generate_code(node):
+def generate_code(node, compact=False):
     '''
     Generate SSA code from the supplied AST node.
     '''
-    gen = GenerateCode()
+    gen = GenerateCode(compact)
     gen.visit(node)
     return gen
 
+def get_options():
+    parser = optparse.OptionParser()
+    parser.add_option("-C", "--compact",
+                     action="store_true", dest="compact", default=False,
+                     help="store instructions in integer-encoded form")
+    exprpass.add_options(parser)
+    options, args = parser.parse_args(sys.argv[1:])
+    return options, args
+
 if __name__ == '__main__':
     import exprlex
     import exprparse
     import exprcheck
+    import exprpass
     import sys
+    import optparse
     from errors import subscribe_errors, errors_reported
+
+    options, args = get_options()
     lexer = exprlex.make_lexer()
     parser = exprparse.make_parser()
     with subscribe_errors(lambda msg: sys.stdout.write(msg+"\n")):
-        program = parser.parse(open(sys.argv[1]).read())
+        program = parser.parse(open(args[0]).read())
         # Check the program
         exprcheck.check_program(program)
         # If no errors occurred, generate code
         if not errors_reported():
-            code = generate_code(program)
+            code = generate_code(program, options.compact)
+            exprpass.optimize_with_options(code.start_block, options)
             # Emit the code sequence
             exprblock.PrintBlocks().visit(code.start_block)
             #for inst in code.code:
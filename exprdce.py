@@ -0,0 +1,200 @@
+# exprdce.py
+'''
+Dead Code Elimination
+=====================
+After code generation (and even more after constant folding), many
+instructions compute values that are never used.  For example:
+
+       var unused int = 2 * 3;
+       var a int = 4;
+       a = 5;
+       print a;
+
+gives
+
+       ('alloc_int', 'unused')
+       ('literal_int', 2, '__int_0')
+       ('literal_int', 3, '__int_1')
+       ('mul_int', '__int_0', '__int_1', '__int_2')
+       ('store_int', '__int_2', 'unused')
+       ('alloc_int', 'a')
+       ('literal_int', 4, '__int_3')
+       ('store_int', '__int_3', 'a')
+       ('literal_int', 5, '__int_4')
+       ('store_int', '__int_4', 'a')
+       ('load_int', 'a', '__int_5')
+       ('print_int', '__int_5')
+
+The variable 'unused' is never loaded, so its alloc and store are
+dead, which makes the multiplication and both literals dead as well.
+The first store to 'a' is overwritten before 'a' is loaded.  After
+dead code elimination only this remains:
+
+       ('alloc_int', 'a')
+       ('literal_int', 5, '__int_4')
+       ('store_int', '__int_4', 'a')
+       ('load_int', 'a', '__int_5')
+       ('print_int', '__int_5')
+
+The following instructions are removed:
+
+    -  Instructions without side effects ('literal', 'load', 'move',
+       'phi', arithmetic and comparisons) whose result is never read
+       by a live instruction.  Division is only removed if the divisor
+       is a non-zero literal, since a division by zero has to fail at
+       run time.
+
+    -  'alloc' and 'store' of variables that are never loaded by a
+       live instruction.
+
+    -  A 'store' to a variable that is overwritten later in the same
+       block without being loaded in between.
+
+'print', 'call_func' and 'extern_func' instructions are never removed.
+They are live, and so are the instructions computing the tests of
+IfBlocks and WhileBlocks.  Everything they read, directly or through
+other live instructions and variables, is live as well.  The rest is
+removed, even values that only feed each other around a loop.
+'''
+
+from collections import defaultdict
+import exprblock
+import exprir
+
+# Operations that have no effect other than writing their result
+pure_ops = set(['literal', 'load', 'move', 'phi', 'add', 'sub', 'mul',
+                'shl', 'shr', 'uadd', 'usub', 'lnot']) | set(exprir.comparisons)
+
+class EliminateDeadCode(object):
+    '''
+    Dead code elimination over all the blocks reachable from a start
+    block.  Instructions are live if the program's output depends on
+    them, which is found by marking from the instructions with side
+    effects (see remove_unused()).  After eliminate(), self.removed
+    holds the number of removed instructions.
+    '''
+    def __init__(self):
+        self.removed = 0
+
+    def eliminate(self, start_block):
+        blocks = exprblock.all_blocks(start_block)
+        # Removing loads can make earlier stores in a block dead, so
+        # repeat until nothing changes
+        while True:
+            removed = self.removed
+            for block in blocks:
+                self.remove_overwritten(block)
+            self.remove_unused(blocks)
+            if self.removed == removed:
+                break
+
+    def remove_overwritten(self, block):
+        '''
+        Remove stores in a block that are overwritten later in the same
+        block without being loaded in between.
+        '''
+        overwritten = set()
+        keep = []
+        for inst in reversed(list(block.instructions)):
+            op, typename = exprir.split_opcode(inst[0])
+            if op in ('store', 'alloc'):
+                var = inst[-1]
+                if op == 'store' and var in overwritten:
+                    self.removed += 1
+                    continue
+                overwritten.add(var)
+            else:
+                for kind, arg in zip(exprir.operand_kinds(inst), inst[1:]):
+                    if kind == exprir.LOAD:
+                        overwritten.discard(arg)
+            keep.append(inst)
+        if len(keep) != len(block.instructions):
+            keep.reverse()
+            exprir.set_instructions(block, keep)
+
+    def remove_unused(self, blocks):
+        '''
+        Remove instructions whose result is never used.  Starting from
+        the instructions that have to run and the block tests, every
+        instruction computing a temporary they read, and every store
+        to a variable they load, is marked as live.  The instructions
+        left unmarked are removed, including cycles of instructions
+        that only feed each other (like the phis of a variable that is
+        carried around a loop but never read).
+        '''
+        defs = defaultdict(list)        # Temporary -> defining instructions
+        stores = defaultdict(list)      # Variable -> allocating and storing instructions
+        nonzero = set()                 # Temporaries holding non-zero literals
+        code = []
+        for block in blocks:
+            for n, inst in enumerate(block.instructions):
+                location = (block, n)
+                code.append((location, inst))
+                if inst[0].startswith('literal_') and inst[1]:
+                    nonzero.add(inst[2])
+                for kind, arg in zip(exprir.operand_kinds(inst), inst[1:]):
+                    if kind == exprir.DEF:
+                        defs[arg].append(location)
+                    elif kind == exprir.STORE:
+                        stores[arg].append(location)
+
+        def removable(inst):
+            op, typename = exprir.split_opcode(inst[0])
+            return op in ('store', 'alloc', 'nop') or op in pure_ops or \
+                   (op == 'div' and inst[2] in nonzero)
+
+        work = [location for location, inst in code if not removable(inst)]
+        for block in blocks:
+            if isinstance(block, (exprblock.IfBlock, exprblock.WhileBlock)):
+                work.extend(defs[block.test])
+
+        instructions = dict(code)
+        live = set()
+        loaded = set()
+        while work:
+            location = work.pop()
+            if location in live:
+                continue
+            live.add(location)
+            inst = instructions[location]
+            for kind, arg in zip(exprir.operand_kinds(inst), inst[1:]):
+                if kind == exprir.USE:
+                    work.extend(defs[arg])
+                elif kind == exprir.LOAD and arg not in loaded:
+                    loaded.add(arg)
+                    work.extend(stores[arg])
+
+        if len(live) != len(code):
+            self.removed += len(code) - len(live)
+            for block in blocks:
+                exprir.set_instructions(block, [inst for n, inst in enumerate(block.instructions)
+                                                if (block, n) in live])
+
+def eliminate_dead_code(start_block):
+    '''
+    Remove dead code from all blocks reachable from start_block.
+    Returns the number of removed instructions.
+    '''
+    dce = EliminateDeadCode()
+    dce.eliminate(start_block)
+    return dce.removed
+
+if __name__ == '__main__':
+    import exprlex
+    import exprparse
+    import exprcheck
+    import exprcode
+    import sys
+    from errors import subscribe_errors, errors_reported
+    lexer = exprlex.make_lexer()
+    parser = exprparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg+"\n")):
+        program = parser.parse(open(sys.argv[1]).read())
+        # Check the program
+        exprcheck.check_program(program)
+        # If no errors occurred, generate code
+        if not errors_reported():
+            code = exprcode.generate_code(program)
+            removed = eliminate_dead_code(code.start_block)
+            exprblock.PrintBlocks().visit(code.start_block)
+            print "Removed %d instructions" % removed
@@ -0,0 +1,406 @@
+# exprflow.py
+'''
+Dataflow Analysis
+=================
+Many optimizations need facts about the whole program rather than a
+single block: which names may still be read later (liveness), which
+definitions may reach a point (reaching definitions), or which
+computations have been done on every path to a point (available
+expressions).  All of these are found the same way, by solving
+equations over the control flow graph of exprcfg.py.
+
+A dataflow problem numbers its facts and stores a set of facts as a
+Python integer, with bit n set if fact n is in the set.  Every block
+has two sets computed from its instructions alone:
+
+       gen      facts the block makes true
+       kill     facts the block makes false
+
+For a forward problem the facts at the entry of a block are the meet
+(union or intersection) of the facts at the exit of its predecessors,
+and
+
+       exit = gen | (entry & ~kill)
+
+A backward problem works the other way around: the exit of a block is
+the meet of the entries of its successors, and
+
+       entry = gen | (exit & ~kill)
+
+The solver keeps a worklist of blocks, initially all of them, and
+recomputes a block whenever the facts flowing into it change, until
+nothing changes.  Blocks are taken from the worklist in reverse
+postorder (forward) or postorder (backward), so that the facts of a
+loop are settled before they flow on to the rest of the program.
+Since union, intersection and the bit operations above all work on
+whole integers at once, a block costs a few operations no matter how
+many facts there are.
+
+Three problems are defined here:
+
+    -  Liveness (backward, union).  The facts are names, temporaries and
+       variables.  A name is live at a point if it may be read later
+       before being written.  The test of an IfBlock or WhileBlock is
+       read at the end of the block.
+
+    -  ReachingDefinitions (forward, union).  The facts are the
+       locations (block, index) of the instructions writing a name.
+
+    -  AvailableExpressions (forward, intersection).  The facts are
+       computations as keyed by value numbering (see exprlvn.py), which
+       are killed when one of their operands is written.
+
+For example, to print the names live at the start of every block:
+
+       live = liveness(start_block)
+       for block in live.cfg.order:
+           print block, sorted(live.decode(live.at_entry[block]))
+'''
+
+import heapq
+import exprblock
+import exprir
+from exprcfg import control_flow_graph
+from exprlvn import expression_key
+
+class DataFlowAnalysis(object):
+    '''
+    Base class of bit vector dataflow problems over a ControlFlowGraph.
+    Subclasses set forward and union and define local(block), which
+    returns the pair (gen, kill) of a block, numbering the facts it
+    mentions with bit().  After solve(),
+
+        at_entry[block]     Facts holding at the start of the block
+        at_exit[block]      Facts holding at the end of the block
+        visits              Number of blocks computed
+    '''
+    forward = True          # Direction of the problem
+    union = True            # Meet operation, intersection if False
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.facts = []
+        self.bits = {}          # Fact -> bit number
+        self.at_entry = {}
+        self.at_exit = {}
+        self.visits = 0
+
+    def bit(self, fact):
+        '''
+        Return the bit set holding only fact, numbering it if needed.
+        '''
+        number = self.bits.get(fact)
+        if number is None:
+            number = self.bits[fact] = len(self.facts)
+            self.facts.append(fact)
+        return 1 << number
+
+    def encode(self, facts):
+        '''
+        Return the bit set of the facts in an iterable.
+        '''
+        bits = 0
+        for fact in facts:
+            bits |= self.bit(fact)
+        return bits
+
+    def decode(self, bits):
+        '''
+        Return the set of facts in a bit set.
+        '''
+        facts = set()
+        while bits:
+            lowest = bits & -bits
+            facts.add(self.facts[lowest.bit_length() - 1])
+            bits ^= lowest
+        return facts
+
+    def local(self, block):
+        '''
+        Return the pair (gen, kill) of bit sets for a block, which every
+        subclass has to define.  gen holds the facts the block makes
+        true, kill the facts it makes false, so that the facts after the
+        block (in the direction of the problem) are
+
+            gen | (facts before the block & ~kill)
+
+        Facts are numbered with bit() or encode().
+        '''
+        raise NotImplementedError
+
+    def boundary(self):
+        '''
+        Facts at the entry of the start block (forward) or at the exit
+        of blocks ending the program (backward).
+        '''
+        return 0
+
+    def solve(self):
+        '''
+        Compute at_entry and at_exit of every block with a worklist, and
+        return self.
+        '''
+        cfg = self.cfg
+        gen = {}
+        kill = {}
+        for block in cfg.order:
+            gen[block], kill[block] = self.local(block)
+        everything = (1 << len(self.facts)) - 1
+        initial = 0 if self.union else everything
+        boundary = self.boundary()
+
+        if self.forward:
+            before, after = self.at_entry, self.at_exit
+            sources, targets = cfg.preds, cfg.succs
+            order = cfg.order
+        else:
+            before, after = self.at_exit, self.at_entry
+            sources, targets = cfg.succs, cfg.preds
+            order = list(reversed(cfg.order))
+        for block in order:
+            after[block] = initial
+
+        # Blocks where the boundary value flows in
+        ends = set([cfg.start_block]) if self.forward else \
+               set(block for block in order if not cfg.succs[block])
+
+        # The worklist holds positions in order.  Taking the lowest one
+        # first lets a loop settle before the blocks after it are
+        # looked at again.
+        position = dict((block, n) for n, block in enumerate(order))
+        work = range(len(order))
+        pending = set(work)
+        union = self.union
+        while work:
+            n = heapq.heappop(work)
+            pending.discard(n)
+            block = order[n]
+            self.visits += 1
+            if block in ends:
+                value = boundary
+                for source in sources[block]:
+                    value = (value | after[source]) if union else (value & after[source])
+            elif union:
+                value = 0
+                for source in sources[block]:
+                    value |= after[source]
+            else:
+                value = everything
+                for source in sources[block]:
+                    value &= after[source]
+            before[block] = value
+            value = gen[block] | (value & ~kill[block])
+            if value != after[block]:
+                after[block] = value
+                for target in targets[block]:
+                    if position[target] not in pending:
+                        pending.add(position[target])
+                        heapq.heappush(work, position[target])
+        return self
+
+def reads(inst):
+    '''
+    Return the names read by an instruction.
+    '''
+    return [arg for kind, arg in zip(exprir.operand_kinds(inst), inst[1:])
+            if kind in (exprir.USE, exprir.LOAD)]
+
+def writes(inst):
+    '''
+    Return the names written by an instruction.
+    '''
+    return [arg for kind, arg in zip(exprir.operand_kinds(inst), inst[1:])
+            if kind in (exprir.DEF, exprir.STORE)]
+
+def block_names(block):
+    '''
+    Return the pair of sets (exposed, written): the names block reads
+    before writing them, including the test of an IfBlock or
+    WhileBlock, and the names it writes.
+    '''
+    exposed = set()
+    written = set()
+    for inst in block.instructions:
+        kinds = exprir.operand_kinds(inst)
+        for kind, arg in zip(kinds, inst[1:]):
+            if kind in (exprir.USE, exprir.LOAD) and arg not in written:
+                exposed.add(arg)
+        for kind, arg in zip(kinds, inst[1:]):
+            if kind in (exprir.DEF, exprir.STORE):
+                written.add(arg)
+    if isinstance(block, (exprblock.IfBlock, exprblock.WhileBlock)) and block.test:
+        if block.test not in written:
+            exposed.add(block.test)
+    return exposed, written
+
+def crossing_names(cfg):
+    '''
+    Return the set of names read in some block before being written
+    there.  Only these names can carry a value from one block to
+    another.  Most temporaries are written and read in the same block
+    and are left out of the bit sets of Liveness and
+    ReachingDefinitions, which keeps the integers short.
+    '''
+    names = set()
+    for block in cfg.order:
+        names |= block_names(block)[0]
+    return names
+
+class Liveness(DataFlowAnalysis):
+    '''
+    Names that may be read before being written again.  Only names in
+    crossing_names() are tracked between blocks, live_after() gives
+    all names live within a block.
+    '''
+    forward = False
+    union = True
+
+    def solve(self):
+        self.names = dict((block, block_names(block)) for block in self.cfg.order)
+        self.crossing = set()
+        for exposed, written in self.names.values():
+            self.crossing |= exposed
+        return DataFlowAnalysis.solve(self)
+
+    def local(self, block):
+        exposed, written = self.names[block]
+        return self.encode(exposed), self.encode(written & self.crossing)
+
+    def live_after(self, block):
+        '''
+        Return a list with the bit set of names live after each
+        instruction of block.
+        '''
+        live = self.at_exit[block]
+        if isinstance(block, (exprblock.IfBlock, exprblock.WhileBlock)) and block.test:
+            live |= self.bit(block.test)
+        result = []
+        for inst in reversed(list(block.instructions)):
+            result.append(live)
+            # A read makes a name live and a write dead
+            for name in writes(inst):
+                live &= ~self.bit(name)
+            for name in reads(inst):
+                live |= self.bit(name)
+        result.reverse()
+        return result
+
+class ReachingDefinitions(DataFlowAnalysis):
+    '''
+    Locations (block, index) of the instructions whose write of a name
+    may reach a point without being overwritten.  Only writes of names
+    in crossing_names() are tracked.
+    '''
+    forward = True
+    union = True
+
+    def solve(self):
+        # A write kills the writes of the same name in all other blocks
+        crossing = crossing_names(self.cfg)
+        self.written = {}       # Name -> bit set of its writes
+        for block in self.cfg.order:
+            for n, inst in enumerate(block.instructions):
+                for name in writes(inst):
+                    if name in crossing:
+                        self.written[name] = self.written.get(name, 0) | self.bit((block, n))
+        return DataFlowAnalysis.solve(self)
+
+    def local(self, block):
+        gen = kill = 0
+        for n, inst in enumerate(block.instructions):
+            for name in writes(inst):
+                if name in self.written:
+                    gen = (gen & ~self.written[name]) | self.bit((block, n))
+                    # Share the integer if the block writes a single name
+                    kill = (kill | self.written[name]) if kill else self.written[name]
+        return gen, kill
+
+class AvailableExpressions(DataFlowAnalysis):
+    '''
+    Computations done on every path to a point, with none of their
+    operands written since.  Only computations done in more than one
+    block are tracked, since one done in a single block can only be
+    reused there (which value numbering already does).
+    '''
+    forward = True
+    union = False
+
+    def solve(self):
+        blocks = {}             # Key -> a block computing it, or None for several
+        for block in self.cfg.order:
+            for inst in block.instructions:
+                key = expression_key(inst)
+                if key is not None:
+                    blocks[key] = block if blocks.get(key, block) is block else None
+
+        # The keys of shared computations reading each name
+        self.readers = {}       # Name -> bit set of keys reading it
+        for block in self.cfg.order:
+            for inst in block.instructions:
+                key = expression_key(inst)
+                if key is not None and blocks[key] is None:
+                    bit = self.bit(key)
+                    for name in reads(inst):
+                        self.readers[name] = self.readers.get(name, 0) | bit
+        return DataFlowAnalysis.solve(self)
+
+    def local(self, block):
+        gen = kill = 0
+        for inst in block.instructions:
+            key = expression_key(inst)
+            if key in self.bits:
+                gen |= self.bit(key)
+            for name in writes(inst):
+                killed = self.readers.get(name, 0)
+                gen &= ~killed
+                kill |= killed
+        return gen, kill
+
+def liveness(start_block):
+    '''
+    Return the solved Liveness of the blocks reachable from start_block.
+    '''
+    return Liveness(control_flow_graph(start_block)).solve()
+
+def reaching_definitions(start_block):
+    '''
+    Return the solved ReachingDefinitions of the blocks reachable from
+    start_block.
+    '''
+    return ReachingDefinitions(control_flow_graph(start_block)).solve()
+
+def available_expressions(start_block):
+    '''
+    Return the solved AvailableExpressions of the blocks reachable from
+    start_block.
+    '''
+    return AvailableExpressions(control_flow_graph(start_block)).solve()
+
+if __name__ == '__main__':
+    import exprlex
+    import exprparse
+    import exprcheck
+    import exprcode
+    import sys
+    from errors import subscribe_errors, errors_reported
+    lexer = exprlex.make_lexer()
+    parser = exprparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg+"\n")):
+        program = parser.parse(open(sys.argv[1]).read())
+        # Check the program
+        exprcheck.check_program(program)
+        # If no errors occurred, generate code
+        if not errors_reported():
+            code = exprcode.generate_code(program)
+            live = liveness(code.start_block)
+            reaching = reaching_definitions(code.start_block)
+            available = available_expressions(code.start_block)
+            for block in live.cfg.order:
+                print "Block:[%s]" % block
+                print "    live in      %s" % ' '.join(sorted(live.decode(live.at_entry[block])))
+                print "    live out     %s" % ' '.join(sorted(live.decode(live.at_exit[block])))
+                print "    reaching in  %d definitions" % len(reaching.decode(reaching.at_entry[block]))
+                print "    available in %s" % ', '.join(sorted(str(key) for key in
+                                                               available.decode(available.at_entry[block])))
+                print
+            print "Solved in %d, %d and %d block visits" % (live.visits, reaching.visits, available.visits)
@@ -0,0 +1,197 @@
+# exprfold.py
+'''
+Constant Folding and Propagation
+================================
+The code generator emits a 'literal' instruction for every literal in
+the program and leaves all arithmetic to run time, even if every
+operand is known.  For example:
+
+       var n int = 2 * 3;
+       print n + 1;
+
+becomes
+
+       ('alloc_int', 'n')
+       ('literal_int', 2, '__int_0')
+       ('literal_int', 3, '__int_1')
+       ('mul_int', '__int_0', '__int_1', '__int_2')
+       ('store_int', '__int_2', 'n')
+       ('load_int', 'n', '__int_3')
+       ('literal_int', 1, '__int_4')
+       ('add_int', '__int_3', '__int_4', '__int_5')
+       ('print_int', '__int_5')
+
+This file implements a pass over the basic blocks that replaces every
+instruction whose operands are all known by a single 'literal'
+instruction.  Values are also propagated through memory:
+
+    -  Within a block, a 'load' of a variable that was stored (or
+       allocated) earlier in the same block with a known value.
+
+    -  Across blocks, a 'load' of a variable that is stored exactly
+       once, in a block of the top level of the program (not inside an
+       if or while), and that is loaded after the store.  This covers
+       variables that are never assigned to after their declaration.
+       (Constants with a value known at compile time are turned into
+       literals by the code generator already.)
+
+After folding the above becomes
+
+       ...
+       ('literal_int', 6, '__int_2')
+       ('store_int', '__int_2', 'n')
+       ('literal_int', 6, '__int_3')
+       ('literal_int', 1, '__int_4')
+       ('literal_int', 7, '__int_5')
+       ('print_int', '__int_5')
+
+The literals that are no longer used are left for dead code
+elimination to clean up.  All values are computed exactly like the
+interpreter (exprinterp.py) does (see exprops.py), including integer
+division truncating with //.  A division by zero is never folded, so
+it still fails at run time.
+'''
+
+from collections import defaultdict
+import exprblock
+import exprir
+from exprops import evaluate
+
+# Values of freshly allocated variables (see Interpreter.run_alloc_*)
+default_values = {
+    'int'    : 0,
+    'float'  : 0.0,
+    'string' : '',
+    'bool'   : False,
+}
+
+class FoldConstants(object):
+    '''
+    Constant folding and propagation over all the blocks reachable
+    from a start block.  The instructions of the blocks are replaced.
+    After fold(), self.folded holds the number of instructions that
+    were turned into literals.
+    '''
+    def __init__(self):
+        self.folded = 0
+        self.constants = {}     # Temporary -> known value
+        self.globals = {}       # Variable stored once at top level -> value
+
+    def fold(self, start_block):
+        blocks = exprblock.all_blocks(start_block)
+
+        # Blocks on the top level are executed exactly once, in order
+        top_level = set()
+        block = start_block
+        while block:
+            top_level.add(block)
+            block = block.next_block
+
+        # Count definitions of temporaries and stores to variables
+        self.defs = defaultdict(int)
+        stores = defaultdict(int)
+        allocs = defaultdict(int)
+        store_block = {}
+        for block in blocks:
+            for inst in block.instructions:
+                op, typename = exprir.split_opcode(inst[0])
+                for kind, arg in zip(exprir.operand_kinds(inst), inst[1:]):
+                    if kind == exprir.DEF:
+                        self.defs[arg] += 1
+                    elif kind == exprir.STORE and op == 'alloc':
+                        allocs[arg] += 1
+                    elif kind == exprir.STORE:
+                        stores[arg] += 1
+                        store_block[arg] = block
+        self.single_store = set(var for var, n in stores.items()
+                                if n == 1 and allocs[var] <= 1 and store_block[var] in top_level)
+
+        for block in blocks:
+            self.known = {}     # Variable -> value known in this block
+            exprir.set_instructions(block, [self.fold_instruction(inst)
+                                            for inst in block.instructions])
+
+    def record(self, target, value):
+        '''
+        Remember the value of a temporary, if it has a single definition.
+        '''
+        if self.defs[target] == 1:
+            self.constants[target] = value
+
+    def fold_instruction(self, inst):
+        '''
+        Return the folded replacement for instruction inst.
+        '''
+        op, typename = exprir.split_opcode(inst[0])
+        if op == 'literal':
+            self.record(inst[2], inst[1])
+        elif op == 'alloc':
+            self.known[inst[1]] = default_values[typename]
+        elif op == 'store':
+            source, var = inst[1:]
+            if source in self.constants:
+                self.known[var] = self.constants[source]
+                if var in self.single_store:
+                    self.globals[var] = self.constants[source]
+            else:
+                self.known.pop(var, None)
+        elif op == 'load':
+            var, target = inst[1:]
+            if var in self.known:
+                value = self.known[var]
+            elif var in self.globals:
+                value = self.globals[var]
+            else:
+                return inst
+            self.folded += 1
+            self.record(target, value)
+            return ('literal_'+typename, value, target)
+        else:
+            kinds = exprir.operand_kinds(inst)
+            if kinds[-1:] != exprir.DEF or len(kinds) != len(inst) - 1:
+                return inst
+            args = []
+            for kind, arg in zip(kinds[:-1], inst[1:-1]):
+                if kind == exprir.USE:
+                    if arg not in self.constants:
+                        return inst
+                    args.append(self.constants[arg])
+                else:
+                    args.append(arg)
+            try:
+                typename, value = evaluate(op, typename, args)
+            except (KeyError, ArithmeticError):
+                return inst
+            self.folded += 1
+            self.record(inst[-1], value)
+            return ('literal_'+typename, value, inst[-1])
+        return inst
+
+def fold_constants(start_block):
+    '''
+    Fold constants in all blocks reachable from start_block.  Returns
+    the number of folded instructions.
+    '''
+    folder = FoldConstants()
+    folder.fold(start_block)
+    return folder.folded
+
+if __name__ == '__main__':
+    import exprlex
+    import exprparse
+    import exprcheck
+    import exprcode
+    import sys
+    from errors import subscribe_errors, errors_reported
+    lexer = exprlex.make_lexer()
+    parser = exprparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg+"\n")):
+        program = parser.parse(open(sys.argv[1]).read())
+        # Check the program
+        exprcheck.check_program(program)
+        # If no errors occurred, generate code
+        if not errors_reported():
+            code = exprcode.generate_code(program)
+            folded = fold_constants(code.start_block)
+            exprblock.PrintBlocks().visit(code.start_block)
+            print "Folded %d instructions" % folded
@@ -0,0 +1,438 @@
+# exprfuse.py
+'''
+Superinstructions
+=================
+The instructions of exprcode.py are very small, so the interpreter
+spends much of its time dispatching rather than computing.  The
+statement
+
+       c = c + 1;
+
+takes four dispatches:
+
+       ('load_int', 'c', '__int_0')
+       ('literal_int', 1, '__int_1')
+       ('add_int', '__int_0', '__int_1', '__int_2')
+       ('store_int', '__int_2', 'c')
+
+This file rewrites linked code (see BlockLinker in exprinterp.py),
+replacing frequent sequences of instructions by one superinstruction
+each that does the same work in one dispatch:
+
+       ('add_vcs_int', 'c', 1, 'c')
+
+The sequences were chosen by counting which opcode follows which
+while running the sample programs, each program weighing the same
+(run this file on some programs to see the counts).  The most frequent
+pairs were:
+
+       -O0                              -O3
+       load_int    literal_int  12.2%   move_int  move_int   10.3%
+       cbranch     load_int      8.2%   lt_int    cbranch     6.6%
+       store_int   load_int      5.9%   literal_int literal_int 5.1%
+       lt_int      cbranch       4.2%   move_int  lt_int      4.3%
+       load_int    load_int      3.9%   move_int  jump        3.4%
+       load_bool   cbranch       3.7%   add_int   move_int    3.0%
+       add_int     store_int     3.6%   eq_int    cbranch     2.9%
+
+Pairs that cross a jump, or that load what was just stored, can't be
+merged without changing what gets computed.  The others lead to these
+superinstructions, where op is an arithmetic operation or comparison
+(see exprir.py):
+
+       load x; literal c; op          op_vc    x op c
+       load x; load y; op             op_vv    x op y
+       op; store z                    op_s     z = a op b
+       load x; literal c; op; store z op_vcs   z = x op c
+       load x; load y; op; store z    op_vvs   z = x op y
+       compare; cbranch               cmp_br   branch on a cmp b
+       load x; literal c; compare; cbranch    cmp_vc_br
+       load x; load y; compare; cbranch       cmp_vv_br
+       load; cbranch                  load_br  branch on a variable
+       move; move                     move2
+
+and an operation followed by a move of its result just computes into
+the target of the move.  Only the temporaries passed between the
+merged instructions disappear, so a sequence is merged only if none of
+them is read afterwards.  This is decided by liveness (see
+exprflow.py) over the blocks of the linked code.  A sequence is never
+merged across a jump target.
+
+On loop.e, an iteration of the loop takes 18 instructions at -O0 and 7
+after merging, and 9 and 7 at -O3.
+'''
+
+import operator
+from collections import defaultdict
+import exprir
+import exprflow
+
+# Python functions of the binary operations that can be merged, by opcode
+binary_functions = {
+    'add_int'    : operator.add,
+    'add_float'  : operator.add,
+    'add_string' : operator.add,
+    'sub_int'    : operator.sub,
+    'sub_float'  : operator.sub,
+    'mul_int'    : operator.mul,
+    'mul_float'  : operator.mul,
+    'div_int'    : operator.floordiv,
+    'div_float'  : operator.truediv,
+    'shl_int'    : operator.lshift,
+    'shr_int'    : operator.rshift,
+    'eq_bool'    : operator.eq,
+    'ne_bool'    : operator.ne,
+}
+for _op in exprir.comparisons:
+    binary_functions[_op + '_int'] = getattr(operator, _op)
+    binary_functions[_op + '_float'] = getattr(operator, _op)
+del _op
+
+def fused_opcode(opcode, suffix):
+    '''
+    Return the superinstruction merging the binary operation opcode
+    with the instructions given by suffix:
+
+        fused_opcode('add_int', '_vc')  -> 'add_vc_int'
+    '''
+    op, typename = exprir.split_opcode(opcode)
+    return '%s%s_%s' % (op, suffix, typename)
+
+def fused_operations():
+    '''
+    Return a dictionary mapping the superinstructions made from binary
+    operations to the pairs (opcode, suffix) of the operation they
+    merge:
+
+        'add_vc_int'  -> ('add_int', '_vc')
+    '''
+    result = {}
+    for opcode in binary_functions:
+        suffixes = ['_vc', '_vv', '_s', '_vcs', '_vvs']
+        if exprir.split_opcode(opcode)[0] in exprir.comparisons:
+            suffixes += ['_br', '_vc_br', '_vv_br']
+        for suffix in suffixes:
+            result[fused_opcode(opcode, suffix)] = (opcode, suffix)
+    return result
+
+def superinstructions():
+    '''
+    Return a dictionary mapping the superinstructions made from binary
+    operations to the pairs (suffix, function), where function computes
+    the operation.
+    '''
+    return dict((fused, (suffix, binary_functions[opcode]))
+                for fused, (opcode, suffix) in fused_operations().items())
+
+class LinearBlock(object):
+    '''
+    A block of linked code: the instructions from a jump target or
+    the instruction after a jump up to the next one.
+    '''
+    def __init__(self, start, instructions):
+        self.start = start
+        self.instructions = instructions
+
+    def __repr__(self):
+        return "<LinearBlock %d>" % self.start
+
+class LinearGraph(object):
+    '''
+    Control flow graph of linked code with the attributes of
+    exprcfg.ControlFlowGraph that exprflow.py uses.
+
+        order          Blocks in the order of the code
+        succs[block]   List of successor blocks
+        preds[block]   List of predecessor blocks
+        block_at[pc]   The block starting at pc
+    '''
+    def __init__(self, code):
+        leaders = set([0])
+        for pc, inst in enumerate(code):
+            if inst[0] == 'jump':
+                leaders.update((pc + 1, inst[1]))
+            elif inst[0] == 'cbranch':
+                leaders.update((pc + 1, inst[2], inst[3]))
+        starts = sorted(pc for pc in leaders if pc < len(code))
+        self.order = []
+        self.block_at = {}
+        for n, start in enumerate(starts):
+            end = starts[n+1] if n+1 < len(starts) else len(code)
+            block = LinearBlock(start, code[start:end])
+            self.order.append(block)
+            self.block_at[start] = block
+        self.start_block = self.order[0] if self.order else None
+
+        self.succs = {}
+        self.preds = dict((block, []) for block in self.order)
+        for block in self.order:
+            last = block.instructions[-1]
+            if last[0] == 'jump':
+                targets = [last[1]]
+            elif last[0] == 'cbranch':
+                targets = [last[2], last[3]]
+            else:
+                targets = [block.start + len(block.instructions)]
+            self.succs[block] = []
+            for target in targets:
+                succ = self.block_at.get(target)
+                if succ is not None and succ not in self.succs[block]:
+                    self.succs[block].append(succ)
+                    self.preds[succ].append(block)
+
+class LinearLiveness(exprflow.Liveness):
+    '''
+    Liveness over a LinearGraph, given the lists of names read and
+    written by every instruction of the code.
+    '''
+    def __init__(self, cfg, reads, writes):
+        exprflow.Liveness.__init__(self, cfg)
+        self.reads = reads
+        self.writes = writes
+
+    def solve(self):
+        self.names = {}
+        self.crossing = set()
+        for block in self.cfg.order:
+            exposed = set()
+            written = set()
+            for pc in range(block.start, block.start + len(block.instructions)):
+                exposed.update(name for name in self.reads[pc] if name not in written)
+                written.update(self.writes[pc])
+            self.names[block] = exposed, written
+            self.crossing |= exposed
+        return exprflow.DataFlowAnalysis.solve(self)
+
+class FuseInstructions(object):
+    '''
+    Replaces sequences of linked instructions by superinstructions.
+    After fuse(), self.counts maps each kind of superinstruction made
+    to how many times it was made.
+    '''
+    # Longest sequence merged
+    longest = 4
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+
+    def fuse(self, code):
+        '''
+        Return a new list of instructions with the sequences merged and
+        the jumps relabeled.
+        '''
+        self.code = code
+        graph = LinearGraph(code)
+        self.leaders = set(graph.block_at)
+        self.find_live(graph)
+
+        fused = []
+        position = []           # Old pc -> new pc
+        pc = 0
+        while pc < len(code):
+            length, inst = self.match(pc)
+            for n in range(length):
+                position.append(len(fused))
+            fused.append(inst)
+            pc += length
+        position.append(len(fused))
+
+        labelled = set(op for op, kinds in exprir.signatures.items() if exprir.LABEL in kinds)
+        for pc, inst in enumerate(fused):
+            if exprir.split_opcode(inst[0])[0] in labelled:
+                fused[pc] = tuple(position[arg] if kind == exprir.LABEL else arg
+                                  for kind, arg in zip(' ' + exprir.operand_kinds(inst), inst))
+        return fused
+
+    def find_live(self, graph):
+        '''
+        Find, for every pc, the names written by the instructions just
+        before it in its block that are still live after it.  Only
+        these can stop a sequence ending at pc from being merged.
+        '''
+        # The names read and written by every instruction, found by
+        # looking up the operand kinds once per opcode
+        positions = {}
+        reads = []
+        writes = []
+        for inst in self.code:
+            key = inst[0], len(inst)
+            if key not in positions:
+                kinds = exprir.operand_kinds(inst)
+                positions[key] = ([n for n, kind in enumerate(kinds, 1) if kind in (exprir.USE, exprir.LOAD)],
+                                  [n for n, kind in enumerate(kinds, 1) if kind in (exprir.DEF, exprir.STORE)])
+            read, written = positions[key]
+            reads.append([inst[n] for n in read])
+            writes.append([inst[n] for n in written])
+
+        live = LinearLiveness(graph, reads, writes).solve()
+        self.live_after = {}    # pc -> set of recently written names live after it
+        for block in graph.order:
+            names = live.decode(live.at_exit[block])
+            start = block.start
+            for pc in range(start + len(block.instructions) - 1, start - 1, -1):
+                for before in writes[max(start, pc - self.longest + 1):pc]:
+                    for name in before:
+                        if name in names:
+                            self.live_after.setdefault(pc, set()).add(name)
+                names.difference_update(writes[pc])
+                names.update(reads[pc])
+
+    def dead(self, names, pc, target=None):
+        '''
+        Return True if none of names, apart from target, is read after
+        pc before being written again.
+        '''
+        live = self.live_after.get(pc, ())
+        return not any(name in live and name != target for name in names)
+
+    def following(self, pc, n):
+        '''
+        Return the instruction n places after pc if it is in the same
+        block, or None.
+        '''
+        pc += n
+        if pc < len(self.code) and pc not in self.leaders:
+            return self.code[pc]
+        return None
+
+    def match(self, pc):
+        '''
+        Return the pair (length, instruction): the number of
+        instructions merged starting at pc and the instruction
+        replacing them (which is the one at pc if nothing matches).
+        '''
+        first = self.code[pc]
+        op = exprir.split_opcode(first[0])[0]
+        second = self.following(pc, 1)
+        if second is None:
+            return 1, first
+
+        if op == 'load':
+            # load x; literal c or load y; op
+            third = self.following(pc, 2)
+            if third and third[0] in binary_functions and \
+               exprir.split_opcode(second[0])[0] in ('literal', 'load') and \
+               third[1] == first[2] and third[2] == second[2] and first[2] != second[2]:
+                suffix = '_vc' if second[0].startswith('literal') else '_vv'
+                temps = (first[2], second[2], third[3])
+                fourth = self.following(pc, 3)
+                if fourth and fourth[0].startswith('store_') and fourth[1] == third[3] and \
+                   self.dead(temps, pc + 3):
+                    return self.made(4, fused_opcode(third[0], suffix + 's'), first[1], second[1], fourth[2])
+                if fourth and fourth[0] == 'cbranch' and fourth[1] == third[3] and \
+                   exprir.split_opcode(third[0])[0] in exprir.comparisons and self.dead(temps, pc + 3):
+                    return self.made(4, fused_opcode(third[0], suffix + '_br'), first[1], second[1],
+                                     fourth[2], fourth[3])
+                if self.dead(temps[:2], pc + 2, third[3]):
+                    return self.made(3, fused_opcode(third[0], suffix), first[1], second[1], third[3])
+            # load x; cbranch
+            if second[0] == 'cbranch' and second[1] == first[2] and self.dead([first[2]], pc + 1):
+                return self.made(2, first[0].replace('load', 'load_br'), first[1], second[2], second[3])
+
+        elif first[0] in binary_functions and second[1] == first[3] and self.dead([first[3]], pc + 1):
+            if second[0].startswith('store_'):
+                return self.made(2, fused_opcode(first[0], '_s'), first[1], first[2], second[2])
+            if second[0] == 'cbranch' and op in exprir.comparisons:
+                return self.made(2, fused_opcode(first[0], '_br'), first[1], first[2], second[2], second[3])
+            if second[0].startswith('move_'):
+                # Compute into the target of the move
+                return self.made(2, first[0], first[1], first[2], second[2])
+
+        elif op == 'move' and exprir.split_opcode(second[0])[0] == 'move':
+            return self.made(2, 'move2', first[1], first[2], second[1], second[2])
+
+        return 1, first
+
+    def made(self, length, opcode, *operands):
+        self.counts[exprir.split_opcode(opcode)[0]] += 1
+        return length, (opcode,) + operands
+
+def fuse(code):
+    '''
+    Return linked code with sequences of instructions replaced by
+    superinstructions.
+    '''
+    return FuseInstructions().fuse(code)
+
+def add_options(parser):
+    '''
+    Add the command line option turning superinstructions off to an
+    optparse.OptionParser.
+    '''
+    parser.add_option("--no-fuse",
+                     action="store_false", dest="fuse", default=True,
+                     help="don't merge instructions into superinstructions")
+
+if __name__ == '__main__':
+    import os
+    import sys
+    import optparse
+    import exprlex
+    import exprparse
+    import exprcheck
+    import exprcode
+    import exprpass
+    import exprinterp
+    from errors import subscribe_errors, errors_reported
+
+    class CountingInterpreter(exprinterp.Interpreter):
+        '''
+        Counts the executed instructions and pairs of opcodes executed
+        one after the other.
+        '''
+        def execute(self, program):
+            self.executed = 0
+            self.pairs = defaultdict(int)
+            self.pc = 0
+            previous = None
+            end = len(program)
+            while self.pc < end:
+                opcode = self.opcodes[self.pc]
+                handler, args = program[self.pc]
+                self.pc += 1
+                handler(*args)
+                self.executed += 1
+                self.pairs[previous, opcode] += 1
+                previous = opcode
+
+    def count(code):
+        interpreter = CountingInterpreter()
+        interpreter.opcodes = [inst[0] for inst in code]
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            interpreter.run(code)
+        except ArithmeticError:
+            # Count what ran up to the error
+            pass
+        finally:
+            sys.stdout = stdout
+        return interpreter
+
+    parser = optparse.OptionParser(usage="%prog [options] file.e ...")
+    exprpass.add_options(parser)
+    options, args = parser.parse_args(sys.argv[1:])
+    frequencies = defaultdict(float)
+    for filename in args:
+        lexer = exprlex.make_lexer()
+        parser = exprparse.make_parser()
+        with subscribe_errors(lambda msg: sys.stdout.write(msg+"\n")):
+            program = parser.parse(open(filename).read())
+            exprcheck.check_program(program)
+            if errors_reported():
+                continue
+            code = exprcode.generate_code(program)
+            exprpass.optimize_with_options(code.start_block, options)
+            linker = exprinterp.BlockLinker()
+            linker.visit(code.start_block)
+            linker.patch_jumps()
+        plain = count(linker.code)
+        merged = count(fuse(linker.code))
+        print "%-20s %9d instructions executed, %9d with superinstructions" % (
+            filename, plain.executed, merged.executed)
+        for pair, number in plain.pairs.items():
+            if pair[0] is not None:
+                frequencies[pair] += float(number) / plain.executed / len(args)
+    print
+    for pair in sorted(frequencies, key=frequencies.get, reverse=True)[:25]:
+        print "%-14s %-14s %5.1f%%" % (pair[0], pair[1], 100 * frequencies[pair])
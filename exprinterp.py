@@ -19,6 +19,10 @@ typing:
 '''
 
 import exprblock
+import exprir
+import exprpy
+import exprbytecode
+import exprfuse
 
 class Interpreter(object):
     '''
@@ -42,7 +46,9 @@ class Interpreter(object):
              self.run_print_int('_int_3')
 
     To store the values of variables created in the intermediate
-    language, simply use a dictionary.
+    language, simply use a dictionary.  If the code was rewritten by
+    SlotResolver to use integer slots instead of names, self.vars
+    can be replaced by the list returned from register_file().
 
     For external function declarations, allow specific Python modules
     (e.g., math, os, etc.) to be registered with the interpreter.
@@ -53,6 +59,9 @@ class Interpreter(object):
         # Dictionary of currently defined variables
         self.vars = {}
 
+        # Dictionary of resolved external functions
+        self.funcs = {}
+
         # List of Python modules to search for external decls
         external_libs = [ 'math', 'os' ]
         self.external_libs = [ __import__(name) for name in external_libs ]
@@ -60,8 +69,82 @@ class Interpreter(object):
     def run(self, ircode):
         '''
         Run intermediate code in the interpreter.  ircode is a list
-        of instruction tuples.  Each instruction (opcode, *args) is 
-        dispatched to a method self.run_opcode(*args)
+        of instruction tuples.  The code is turned into threaded code
+        by load() and then handed to execute().
+        '''
+        self.execute(self.load(ircode))
+
+    def load(self, ircode):
+        '''
+        Resolve a list of instruction tuples into "threaded code".  Each
+        instruction (opcode, *args) becomes a pair (handler, args) where
+        handler is the bound method self.run_opcode and args are the
+        already unpacked operands.  The method lookup is thus done once
+        per instruction in the program and not once per executed
+        instruction.
+        '''
+        program = []
+        for op in ircode:
+            opcode = op[0]
+            handler = getattr(self, "run_"+opcode, None)
+            if handler is None:
+                print "Warning: No run_"+opcode+"() method"
+                program.append((self.run_nop, ()))
+            else:
+                program.append((handler, op[1:]))
+        return program
+
+    def execute(self, program):
+        '''
+        Execute threaded code as produced by load().  The loop only
+        indexes the program and calls the handler; jump handlers
+        change self.pc.
+        '''
+        self.pc = 0
+        end = len(program)
+        while self.pc < end:
+            handler, args = program[self.pc]
+            self.pc += 1
+            handler(*args)
+        if self.pc > end:
+            print "Wrong PC %d - terminating" % self.pc
+
+    def run_bytecode(self, bytecode):
+        '''
+        Run an exprbytecode.Bytecode program straight from its buffer.
+        An instruction is decoded into threaded code (see load()) the
+        first time it is executed, so a program starts at once and its
+        loops run as fast as with execute().
+        '''
+        handlers = {}
+        for opcode in bytecode.opcodes:
+            handlers[opcode] = getattr(self, "run_"+opcode, None)
+            if handlers[opcode] is None:
+                print "Warning: No run_"+opcode+"() method"
+
+        self.vars = [None] * bytecode.slots
+        end = bytecode.count
+        program = [None] * end
+        self.pc = 0
+        while self.pc < end:
+            entry = program[self.pc]
+            if entry is None:
+                opcode, args = bytecode.instruction(self.pc)
+                if handlers[opcode] is None:
+                    entry = (self.run_nop, ())
+                else:
+                    entry = (handlers[opcode], args)
+                program[self.pc] = entry
+            self.pc += 1
+            entry[0](*entry[1])
+        if self.pc > end:
+            print "Wrong PC %d - terminating" % self.pc
+
+    def dispatch(self, ircode):
+        '''
+        Run intermediate code by looking up the method self.run_opcode
+        for every executed instruction.  This is the original
+        interpreter loop; it is kept as the reference for run().
         '''
         self.pc = 0
         while True:
@@ -81,6 +164,9 @@ class Interpreter(object):
     # YOU MUST IMPLEMENT:  Methods for different opcodes.  A few sample
     # opcodes are shown below to get you started.
 
+    def run_nop(self):
+        pass
+
     def run_jump(self, label):
         self.pc = label
 
@@ -110,6 +196,7 @@ class Interpreter(object):
 
     run_literal_float = run_literal_int
     run_literal_string = run_literal_int
+    run_literal_bool = run_literal_int
 
     def run_alloc_int(self, name):
         self.vars[name] = 0
@@ -120,17 +207,29 @@ class Interpreter(object):
     def run_alloc_string(self, name):
         self.vars[name] = ''
 
+    def run_alloc_bool(self, name):
+        self.vars[name] = False
+
     def run_store_int(self, source, target):
         self.vars[target] = self.vars[source]
 
     run_store_float = run_store_int
     run_store_string = run_store_int
+    run_store_bool = run_store_int
+
+    def run_move_int(self, source, target):
+        self.vars[target] = self.vars[source]
+
+    run_move_float = run_move_int
+    run_move_string = run_move_int
+    run_move_bool = run_move_int
 
     def run_load_int(self, name, target):
         self.vars[target] = self.vars[name]
 
     run_load_float = run_load_int
     run_load_string = run_load_int
+    run_load_bool = run_load_int
 
     run_add_float = run_add_int
     run_add_string = run_add_int
@@ -151,6 +250,12 @@ class Interpreter(object):
     def run_div_float(self, left, right, target):
         self.vars[target] = self.vars[left] / self.vars[right]
 
+    def run_shl_int(self, left, right, target):
+        self.vars[target] = self.vars[left] << self.vars[right]
+
+    def run_shr_int(self, left, right, target):
+        self.vars[target] = self.vars[left] >> self.vars[right]
+
     def run_uadd_int(self, source, target):
         self.vars[target] = self.vars[source]
 
@@ -161,41 +266,51 @@ class Interpreter(object):
 
     run_usub_float = run_usub_int
 
-    def run_cmp_int(self, op, left, right, target):
-        compare = cmp(self.vars[left], self.vars[right])
-        if op == 'lt':
-            result = bool(compare < 0)
-        elif op == 'le':
-            result = bool(compare <= 0)
-        elif op == 'eq':
-            result = bool(compare == 0)
-        elif op == 'ne':
-            result = bool(compare != 0)
-        elif op == 'ge':
-            result = bool(compare >= 0)
-        elif op == 'gt':
-            result = bool(compare > 0)
-        elif op == 'land':
-            result = self.vars[left] and self.vars[right]
-        elif op == 'lor':
-            result = self.vars[left] or self.vars[right]
-        self.vars[target] = result
-
-    run_cmp_float = run_cmp_int
-    run_cmp_bool = run_cmp_int
+    def run_lnot_bool(self, source, target):
+        self.vars[target] = not self.vars[source]
+
+    # Comparisons
+    def run_lt_int(self, left, right, target):
+        self.vars[target] = self.vars[left] < self.vars[right]
+
+    def run_le_int(self, left, right, target):
+        self.vars[target] = self.vars[left] <= self.vars[right]
+
+    def run_eq_int(self, left, right, target):
+        self.vars[target] = self.vars[left] == self.vars[right]
+
+    def run_ne_int(self, left, right, target):
+        self.vars[target] = self.vars[left] != self.vars[right]
+
+    def run_ge_int(self, left, right, target):
+        self.vars[target] = self.vars[left] >= self.vars[right]
+
+    def run_gt_int(self, left, right, target):
+        self.vars[target] = self.vars[left] > self.vars[right]
+
+    run_lt_float = run_lt_int
+    run_le_float = run_le_int
+    run_eq_float = run_eq_int
+    run_ne_float = run_ne_int
+    run_ge_float = run_ge_int
+    run_gt_float = run_gt_int
+
+    run_eq_bool = run_eq_int
+    run_ne_bool = run_ne_int
 
     run_print_float = run_print_int
     run_print_string = run_print_int
+    run_print_bool = run_print_int
 
     def run_extern_func(self, name, rettypename, *parmtypenames):
         '''
         Scan the list of external modules for a matching function name.
-        Place a reference to the external function in the dict of vars.
+        Place a reference to the external function in the dict of funcs.
         '''
         for module in self.external_libs:
             func = getattr(module, name, None)
             if func:
-                self.vars[name] = func
+                self.funcs[name] = func
                 break
         else:
             raise RuntimeError("No extern function %s found" % name)
@@ -205,61 +320,314 @@ class Interpreter(object):
         Call a previously declared external function.
         '''
         target = args[-1]
-        func = self.vars.get(funcname)
+        func = self.funcs.get(funcname)
         argvals = [self.vars[name] for name in args[:-1]]
         self.vars[target] = func(*argvals)
 
-class BlockLinker(exprblock.BlockVisitor):
-    def __init__(self):
-        self.code = []
-        self.code_map = {}
-        self.jump_list = []
+    # Superinstructions (see exprfuse.py).  Those merging an arithmetic
+    # operation or comparison are added after the class.
+    run_load_br_bool = run_cbranch
 
-    def rec_jump(self):
-        self.jump_list.append(len(self.code))
+    def run_move2(self, source, target, source2, target2):
+        self.vars[target] = self.vars[source]
+        self.vars[target2] = self.vars[source2]
 
-    def rec_block(self, block):
-        self.code_map[block] = len(self.code)
+def superinstruction(suffix, function):
+    '''
+    Return the run_ method of a superinstruction of exprfuse.py that
+    merges a binary operation, computed by function, as given by suffix.
+    '''
+    if suffix in ('_vc', '_vcs'):
+        def run(self, name, value, target):
+            self.vars[target] = function(self.vars[name], value)
+    elif suffix in ('_vv', '_vvs', '_s'):
+        def run(self, left, right, target):
+            self.vars[target] = function(self.vars[left], self.vars[right])
+    elif suffix == '_vc_br':
+        def run(self, name, value, if_label, else_label):
+            if function(self.vars[name], value):
+                self.pc = if_label
+            else:
+                self.pc = else_label
+    else:
+        def run(self, left, right, if_label, else_label):
+            if function(self.vars[left], self.vars[right]):
+                self.pc = if_label
+            else:
+                self.pc = else_label
+    return run
 
-    def patch_jumps(self):
-        for n in self.jump_list:
-            self.code[n] = tuple(self.code_map.get(e,e) for e in self.code[n])
+for _opcode, (_suffix, _function) in exprfuse.superinstructions().items():
+    setattr(Interpreter, "run_" + _opcode, superinstruction(_suffix, _function))
+del _opcode, _suffix, _function
+
+class TracingInterpreter(Interpreter):
+    '''
+    Interpreter with a tracing tier for hot loops.  The linker ends
+    every while loop with a backward cbranch to the loop body (see
+    BlockLinker.visit_WhileBlock()), which exprfuse.py may merge into
+    a superinstruction ending in a branch; backward jumps are loops as
+    well.
+    These back-edges are counted, and once a loop has gone around
+    hot_loop times, the instructions of its next iteration are recorded
+    while they are interpreted.
+
+    The recorded trace is compiled into a Python closure (using the
+    translations from exprpy.py) that keeps running iterations of the
+    loop.  Every branch on the trace, including the back-edge, becomes
+    a guard: if the branch goes the other way than during recording,
+    the closure returns the pc of the branch target and interpretation
+    continues there.  Loops whose iteration contains another loop are
+    not traced; their inner loops are.
+    '''
+    hot_loop = 50         # Back-edges taken before a loop is traced
+    max_trace = 1000      # Longest trace recorded, in instructions
+
+    def __init__(self, name="module"):
+        super(TracingInterpreter, self).__init__(name)
+        self.counters = {}       # Loop header -> back-edges taken
+        self.traces = {}         # Loop header -> compiled trace
+        self.trace_sources = {}  # Loop header -> trace source code
+        self.backedges = {}      # pc of back-edge -> loop header
+        self.loop_ends = {}      # Loop header -> pc of its back-edge
+
+    def load(self, ircode):
+        '''
+        Resolve ircode into threaded code, with the backward jumps
+        bound to run_backedge() and the backward conditional branches
+        (cbranch and the superinstructions ending in one) wrapped by
+        run_backbranch().
+        '''
+        program = super(TracingInterpreter, self).load(ircode)
+        for pc, op in enumerate(ircode):
+            if op[0] == 'jump' and op[1] <= pc:
+                header = op[1]
+                program[pc] = (self.run_backedge, (header,))
+            elif exprir.operand_kinds(op).endswith(exprir.LABEL * 2) and op[-2] <= pc:
+                header = op[-2]
+                program[pc] = (self.run_backbranch, program[pc] + (header,))
+            else:
+                continue
+            self.backedges[pc] = header
+            self.loop_ends[header] = pc
+        self.code = ircode
+        self.program = program
+        return program
+
+    def run_backedge(self, header):
+        trace = self.traces.get(header)
+        if trace is None:
+            count = self.counters[header] = self.counters.get(header, 0) + 1
+            if count != self.hot_loop:
+                self.pc = header
+                return
+            if self.record(header) is not None:
+                # Take the back-edge again, this time into the trace
+                self.pc = self.loop_ends[header]
+            return
+        self.pc = trace(self.vars, self.funcs)
+
+    def run_backbranch(self, handler, args, header):
+        handler(*args)
+        if self.pc == header:
+            self.run_backedge(header)
+
+    def record(self, header):
+        '''
+        Interpret one iteration of the loop starting at header while
+        recording the pcs of the executed instructions.  Returns the
+        compiled trace, or None if the iteration left the loop or
+        went through a nested loop.  In that case self.pc is set to
+        where interpretation has to continue.
+        '''
+        end = self.loop_ends[header]
+        path = []
+        pc = header
+        while True:
+            if pc in self.backedges or len(path) > self.max_trace:
+                break
+            handler, args = self.program[pc]
+            path.append(pc)
+            self.pc = pc + 1
+            handler(*args)
+            pc = self.pc
+            if not header <= pc <= end:
+                break
+        if pc != end:
+            self.pc = pc
+            return None
+        try:
+            source = self.trace_source(path, end)
+        except (KeyError, RuntimeError):
+            # Some instruction has no translation, leave the loop alone.
+            # The iteration has run, so continue with the back-edge
+            # testing whether to go around again.  Its counter is past
+            # hot_loop by then, so the loop isn't recorded again.
+            self.pc = end
+            return None
+        namespace = {
+            '_extern' : exprpy.extern_resolver(self.external_libs),
+        }
+        exec(compile(source, '<trace %d>' % header, 'exec'), namespace)
+        self.traces[header] = namespace['trace']
+        self.trace_sources[header] = source
+        return self.traces[header]
+
+    def trace_source(self, path, end):
+        '''
+        Return the source code of a trace function for a recorded path
+        through a loop.  end is the pc of the loop's back-edge.
+        '''
+        location = lambda name: 'v[%r]' % (name,)
+        function = lambda name: 'f[%r]' % (name,)
+        lines = ['def trace(v, f):',
+                 '    while True:']
+        for n, pc in enumerate(path):
+            inst = self.code[pc]
+            taken = path[n+1] if n+1 < len(path) else end
+            branch = exprpy.python_branch(inst, location)
+            if inst[0] == 'jump':
+                continue
+            elif branch is not None:
+                test, if_label, else_label = branch
+                if if_label == else_label:
+                    continue
+                elif taken == if_label:
+                    lines.append('        if not (%s): return %d' % (test, else_label))
+                else:
+                    lines.append('        if %s: return %d' % (test, if_label))
+            else:
+                lines.append('        ' + exprpy.python_statement(inst, location, function))
+        branch = exprpy.python_branch(self.code[end], location)
+        if branch is not None:
+            lines.append('        if not (%s): return %d' % (branch[0], branch[2]))
+        return '\n'.join(lines) + '\n'
+
+class BlockLinker(exprblock.BlockVisitor, exprir.Assembler):
+    '''
+    Lays out a chain of blocks as one list of instructions.  A block's
+    next_block is always laid out right after the block (and its
+    branches or body), so control falls through to it without a jump.
+    While loops are rotated: the body comes first and the test after
+    it, so that every iteration ends in one cbranch back to the body:
+
+             jump test
+       body: ...
+       test: ...
+             cbranch t, body, exit
+       exit: ...
+
+    Labels are blocks, or ('after', block) for the code following a
+    block at the end of a chain.  Jumps to them are backpatched as the
+    code is made (see exprir.Assembler), and patch_jumps() threads
+    them when the whole chain is laid out.
+
+    The blocks are visited with an explicit stack rather than by
+    recursion, so deeply nested programs link in linear time.
+    '''
+    def __init__(self):
+        exprir.Assembler.__init__(self)
+        self.work = []
+
+    def label_after(self, block):
+        '''
+        Return the label of the code that follows block.
+        '''
+        return block.next_block if block.next_block else ('after', block)
+
+    def visit(self, block):
+        '''
+        Lay out the chain of blocks starting at block.  The visit_
+        methods push what is left to do onto self.work: blocks still to
+        be laid out and (method, block) pairs to call afterwards.
+        '''
+        self.work.append(block)
+        while self.work:
+            item = self.work.pop()
+            if isinstance(item, exprblock.Block):
+                getattr(self, "visit_%s" % type(item).__name__)(item)
+            elif item is not None:
+                method, block = item
+                method(block)
 
     def visit_BasicBlock(self, block):
-        self.rec_block(block)
+        self.work.append(block.next_block)
+        self.define(block)
         self.code.extend(block.instructions)
-        if block.next_block:
-            self.rec_jump()
-            self.code.append(('jump', block.next_block))
 
-    def visit_IfBlock(self,block):
-        self.rec_block(block)
+    def visit_IfBlock(self, block):
+        self.work.append(block.next_block)
+        self.define(block)
         self.code.extend(block.instructions)
         # then branch
-        self.rec_jump()
-        self.code.append(('cbranch', block.test, 
-            block.if_branch, 
-            block.else_branch if block.else_branch else block.next_block))
-        self.visit(block.if_branch)
-        self.rec_jump()
-        self.code.append(('jump', block.next_block))
+        self.emit_jump('cbranch', block.test,
+            block.if_branch or self.label_after(block),
+            block.else_branch or self.label_after(block))
+        self.work.append((self.end_if, block))
+        self.work.append(block.if_branch)
+
+    def end_if(self, block):
         # else branch
         if block.else_branch:
-            self.visit(block.else_branch)
-            self.rec_jump()
-            self.code.append(('jump', block.next_block))
+            self.emit_jump('jump', self.label_after(block))
+            self.work.append((self.define, ('after', block)))
+            self.work.append(block.else_branch)
+        else:
+            self.define(('after', block))
 
     def visit_WhileBlock(self, block):
-        self.rec_block(block)
+        self.work.append(block.next_block)
+        self.emit_jump('jump', block)
+        self.work.append((self.end_while, block))
+        self.work.append(block.body)
+
+    def end_while(self, block):
+        # test
+        self.define(block)
         self.code.extend(block.instructions)
-        self.visit(block.test)
-        self.rec_jump()
-        self.code.append(('cbranch', block.test,
-            block.body, block.next_block))
-        self.visit(block.body)
-        self.rec_jump()
-        self.code.append(('jump', block))
+        self.emit_jump('cbranch', block.test,
+            block.body if block.body else block, self.label_after(block))
+        self.define(('after', block))
 
+class SlotResolver(object):
+    '''
+    Maps every temporary and variable name used in linked code to a
+    dense integer slot.  resolve() rewrites the instruction tuples to
+    use slot numbers in place of names, so the Interpreter can run
+    against a preallocated list (see register_file()) instead of a
+    dictionary keyed by strings.  Run it after BlockLinker.patch_jumps().
+    '''
+    def __init__(self):
+        self.slots = {}
+
+    def slot(self, name):
+        '''
+        Return the slot number of name, allocating a new one if needed.
+        '''
+        try:
+            return self.slots[name]
+        except KeyError:
+            n = self.slots[name] = len(self.slots)
+            return n
+
+    def resolve(self, code):
+        '''
+        Return a copy of the instruction list code with all names
+        replaced by slot numbers.
+        '''
+        resolved = []
+        for inst in code:
+            kinds = exprir.operand_kinds(inst)
+            resolved.append((inst[0],) + tuple(
+                self.slot(arg) if kind in exprir.NAMES else arg
+                for kind, arg in zip(kinds, inst[1:])))
+        return resolved
+
+    def register_file(self):
+        '''
+        Return a fresh register file with one entry per slot.
+        '''
+        return [None] * len(self.slots)
 
 def get_options():
     
@@ -267,6 +635,12 @@ def get_options():
     parser.add_option("-c", "--show-instructions",
                      action="store_true", dest="show_code", default=False,
                      help="show linearized 3A instructions")
+    parser.add_option("-t", "--trace",
+                     action="store_true", dest="trace", default=False,
+                     help="compile traces of hot loops")
+    exprpass.add_options(parser)
+    exprfuse.add_options(parser)
+    exprcache.add_options(parser)
     options, args = parser.parse_args(sys.argv[1:])
     return options, args
 
@@ -279,34 +653,66 @@ if __name__ == '__main__':
     import exprparse
     import exprcheck
     import exprcode
+    import exprpass
+    import exprcache
     import sys
     import optparse
     from errors import subscribe_errors, errors_reported
 
     options, args = get_options()
-    lexer = exprlex.make_lexer()
-    parser = exprparse.make_parser()
-    with subscribe_errors(lambda msg: sys.stdout.write(msg+"\n")):
-        program = parser.parse(open(sys.argv[1]).read())
-        # Check the program
-        exprcheck.check_program(program)
-        # If no errors occurred, generate code
-        if not errors_reported():
-            code = exprcode.generate_code(program)
-            linker = BlockLinker()
-            linker.visit(code.start_block)
-            linker.patch_jumps()
-
-            if options.show_code:
-                for n, inst in enumerate(linker.code):
-                    print n,":", inst
-                print "GIVES"
-
+    ircode = None
+    bytecode = None
+    if exprbytecode.is_bytecode(args[0]):
+        bytecode = exprbytecode.Bytecode.open(args[0])
+    else:
+        source = open(args[0]).read()
+        fuse = options.fuse
+        cache = exprcache.cache_from_options(options)
+        if cache:
+            key = cache.key(source, exprpass.selected_pipeline(options) + (['fuse'] if fuse else []))
+            bytecode = cache.load(args[0], key)
+
+        if bytecode is None:
+            lexer = exprlex.make_lexer()
+            parser = exprparse.make_parser()
+            with subscribe_errors(lambda msg: sys.stdout.write(msg+"\n")):
+                program = parser.parse(source)
+                # Check the program
+                exprcheck.check_program(program)
+                # If no errors occurred, generate code
+                if not errors_reported():
+                    if exprpass.selected_pipeline(options):
+                        code = exprcode.generate_code(program)
+                        exprpass.optimize_with_options(code.start_block, options)
+                        linker = BlockLinker()
+                        linker.visit(code.start_block)
+                        linker.patch_jumps()
+                        ircode = linker.code
+                    else:
+                        # Without passes there is no need for blocks
+                        ircode = exprcode.generate_linear_code(program)
+                    if fuse:
+                        ircode = exprfuse.fuse(ircode)
+                    if cache:
+                        cache.store(args[0], key, ircode)
+
+    if bytecode is not None and (options.show_code or options.trace):
+        ircode = bytecode.instructions()
+
+    if options.show_code and ircode is not None:
+        for n, inst in enumerate(ircode):
+            print n,":", inst
+        print "GIVES"
+
+    if bytecode is not None and not options.trace:
+        # Run straight from the mapped file
+        Interpreter().run_bytecode(bytecode)
+    elif ircode is not None:
+        resolver = SlotResolver()
+        resolved = resolver.resolve(ircode)
+        if options.trace:
+            interpreter = TracingInterpreter()
+        else:
             interpreter = Interpreter()
-            interpreter.run(linker.code)
-
-
-
-        
-        
-        
+        interpreter.vars = resolver.register_file()
+        interpreter.run(resolved)
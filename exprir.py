@@ -0,0 +1,447 @@
+# exprir.py
+'''
+Intermediate Code Helpers
+=========================
+The code generator in exprcode.py emits instructions as tuples of
+the form (opcode, operands, ..., destination).  Most opcodes are an
+operation name with a type suffix such as 'add_int' or 'load_float'.
+
+This file records what kind of thing each operand of an instruction
+is.  Later stages (linking, interpreting, optimizing) use it to find
+the names read and written by an instruction without having to know
+every single opcode.  The operand kinds are:
+
+       VALUE     'c'    Immediate value (e.g. the value of a literal)
+       LABEL     'l'    Jump target
+       USE       'u'    Temporary that is read
+       DEF       'd'    Temporary that is written
+       LOAD      'r'    Declared variable that is read
+       STORE     'w'    Declared variable that is written
+       FUNC      'f'    Name of an external function
+       TYPE      't'    Type name
+
+A signature is a string of operand kinds.  A '*' means zero or more
+operands of the kind in front of it.
+
+Assembler, at the end of this file, builds linear code with jumps to
+labels.  It is shared by the BlockLinker of exprinterp.py and the
+LinearCode generator of exprcode.py.
+'''
+
+VALUE = 'c'
+LABEL = 'l'
+USE = 'u'
+DEF = 'd'
+LOAD = 'r'
+STORE = 'w'
+FUNC = 'f'
+TYPE = 't'
+
+# Operand kinds that name a storage location (temporary or variable)
+NAMES = USE + DEF + LOAD + STORE
+
+signatures = {
+    # Memory
+    'alloc'   : 'w',
+    'literal' : 'cd',
+    'load'    : 'rd',
+    'store'   : 'uw',
+    'move'    : 'ud',
+    'phi'     : 'u*d',
+
+    # Binary operators
+    'add'     : 'uud',
+    'sub'     : 'uud',
+    'mul'     : 'uud',
+    'div'     : 'uud',
+    'shl'     : 'uud',
+    'shr'     : 'uud',
+
+    # Comparisons
+    'lt'      : 'uud',
+    'le'      : 'uud',
+    'eq'      : 'uud',
+    'ne'      : 'uud',
+    'ge'      : 'uud',
+    'gt'      : 'uud',
+
+    # Unary operators
+    'uadd'    : 'ud',
+    'usub'    : 'ud',
+    'lnot'    : 'ud',
+
+    'print'   : 'u',
+
+    # Untyped opcodes
+    'nop'         : '',
+    'jump'        : 'l',
+    'cbranch'     : 'ull',
+    'extern_func' : 'ft*',
+    'call_func'   : 'fu*d',
+}
+
+# Comparison operations, giving a bool
+comparisons = ('lt', 'le', 'eq', 'ne', 'ge', 'gt')
+
+# Superinstructions, made from linked code by exprfuse.py.  The suffix
+# tells what the operation is combined with: a load and a literal
+# (_vc), two loads (_vv), a store of the result (_s) or a cbranch on
+# it (_br).
+for _op in ('add', 'sub', 'mul', 'div', 'shl', 'shr') + comparisons:
+    signatures[_op + '_vc'] = 'rcd'
+    signatures[_op + '_vv'] = 'rrd'
+    signatures[_op + '_s'] = 'uuw'
+    signatures[_op + '_vcs'] = 'rcw'
+    signatures[_op + '_vvs'] = 'rrw'
+for _op in comparisons:
+    signatures[_op + '_br'] = 'uull'
+    signatures[_op + '_vc_br'] = 'rcll'
+    signatures[_op + '_vv_br'] = 'rrll'
+signatures['load_br'] = 'rll'
+signatures['move2'] = 'udud'
+del _op
+
+# Opcodes that have no type suffix
+untyped_ops = ('nop', 'jump', 'cbranch', 'extern_func', 'call_func', 'move2')
+
+def split_opcode(opcode):
+    '''
+    Split an opcode into its operation and type name.  Opcodes
+    without a type suffix return None as type name.
+
+        split_opcode('add_int')  -> ('add', 'int')
+        split_opcode('cbranch')  -> ('cbranch', None)
+    '''
+    if opcode in untyped_ops:
+        return opcode, None
+    op, _, typename = opcode.rpartition('_')
+    return op, typename
+
+def operand_kinds(inst):
+    '''
+    Return the operand kinds of an instruction tuple as a string
+    with one character per operand.
+    '''
+    op, typename = split_opcode(inst[0])
+    kinds = signatures[op]
+    if '*' in kinds:
+        head, tail = kinds.split('*')
+        repeat = len(inst) - len(head) - len(tail)
+        kinds = head[:-1] + head[-1]*repeat + tail
+    return kinds
+
+# ----------------------------------------------------------------------
+# Compact encoding
+#
+# Instruction tuples carry a formatted opcode string and a formatted
+# name for every temporary.  For large programs these dominate the
+# memory used by the compiler.  The classes below store the same
+# instructions as small integers in arrays instead:
+#
+#    - opcodes are numbered (see opcode_numbers below)
+#    - temporaries and variables are register numbers (see Registers)
+#    - literal values live in a constant pool and are referenced by index
+#    - type names are numbered as well
+#
+# Iterating over a CompactCode object still produces the instruction
+# tuples described above, so code printing and linking blocks does not
+# need to know about the encoding.
+# ----------------------------------------------------------------------
+
+from array import array
+
+typenames = ['int', 'float', 'string', 'bool']
+
+def _make_opcodes():
+    names = []
+    for op in sorted(signatures):
+        if op in untyped_ops:
+            names.append(op)
+        else:
+            names.extend('%s_%s' % (op, typename) for typename in typenames)
+    return names
+
+opcode_names = _make_opcodes()
+opcode_numbers = dict((name, n) for n, name in enumerate(opcode_names))
+
+class Registers(object):
+    '''
+    Register numbering shared by all the code of one program.  Named
+    registers hold declared variables and external functions.
+    Temporaries are created by new_temp() without making a name; their
+    name (e.g. '__int_3') is only formatted when asked for.
+    '''
+    def __init__(self):
+        self.types = array('b')       # Type index of temporaries, -1 if named
+        self.versions = array('l')    # Version number of temporaries
+        self.names = {}               # Register -> name of named registers
+        self.numbers = {}             # Name -> register of named registers
+        self.counts = [0] * len(typenames)
+
+        # Constant pool for literal values
+        self.constants = []
+        self.constant_index = {}
+
+    def __len__(self):
+        return len(self.types)
+
+    def new_temp(self, typename):
+        '''
+        Create a new temporary of a given type and return its register.
+        '''
+        t = typenames.index(typename)
+        self.types.append(t)
+        self.versions.append(self.counts[t])
+        self.counts[t] += 1
+        return len(self.types) - 1
+
+    def number(self, name):
+        '''
+        Return the register of a name, allocating one if needed.
+        Register numbers are returned unchanged.
+        '''
+        if isinstance(name, int):
+            return name
+        reg = self.numbers.get(name)
+        if reg is None:
+            reg = self.numbers[name] = len(self.types)
+            self.names[reg] = name
+            self.types.append(-1)
+            self.versions.append(0)
+        return reg
+
+    def name(self, reg):
+        '''
+        Return the textual name of a register.
+        '''
+        t = self.types[reg]
+        if t < 0:
+            return self.names[reg]
+        return "__%s_%d" % (typenames[t], self.versions[reg])
+
+    def constant(self, value):
+        '''
+        Return the index of value in the constant pool.
+        '''
+        # The type is part of the key and repr() is used instead of the
+        # value so that 1, 1.0, True and 0.0, -0.0 stay apart
+        key = (type(value), repr(value))
+        index = self.constant_index.get(key)
+        if index is None:
+            index = self.constant_index[key] = len(self.constants)
+            self.constants.append(value)
+        return index
+
+class CompactCode(object):
+    '''
+    A sequence of instructions stored as integers.  It supports the
+    list operations used on Block.instructions (append, iteration,
+    len and indexing), but keeps every instruction as an opcode number
+    followed by its encoded operands in one array.  Indexing and
+    iteration return the decoded instruction tuples; encoded() gives
+    the integers.
+    '''
+    def __init__(self, registers):
+        self.registers = registers
+        self.code = array('l')      # Opcode and operand numbers
+        self.starts = array('l')    # Start of each instruction in code
+
+    def __len__(self):
+        return len(self.starts)
+
+    def append(self, inst):
+        registers = self.registers
+        self.starts.append(len(self.code))
+        self.code.append(opcode_numbers[inst[0]])
+        for kind, arg in zip(operand_kinds(inst), inst[1:]):
+            if kind == VALUE:
+                self.code.append(registers.constant(arg))
+            elif kind == TYPE:
+                self.code.append(typenames.index(arg))
+            elif kind == LABEL:
+                self.code.append(arg)
+            else:
+                self.code.append(registers.number(arg))
+
+    def extend(self, insts):
+        for inst in insts:
+            self.append(inst)
+
+    def encoded(self, index):
+        '''
+        Return instruction number index as a tuple of integers.
+        '''
+        start = self.starts[index]
+        if index + 1 < len(self.starts):
+            end = self.starts[index+1]
+        else:
+            end = len(self.code)
+        return tuple(self.code[start:end])
+
+    def decode(self, encoded):
+        '''
+        Turn an encoded instruction back into an instruction tuple.
+        '''
+        registers = self.registers
+        opcode = opcode_names[encoded[0]]
+        inst = [opcode]
+        for kind, arg in zip(operand_kinds((opcode,) + encoded[1:]), encoded[1:]):
+            if kind == VALUE:
+                inst.append(registers.constants[arg])
+            elif kind == TYPE:
+                inst.append(typenames[arg])
+            elif kind == LABEL:
+                inst.append(arg)
+            else:
+                inst.append(registers.name(arg))
+        return tuple(inst)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.starts)
+        if not 0 <= index < len(self.starts):
+            raise IndexError(index)
+        return self.decode(self.encoded(index))
+
+    def __iter__(self):
+        for index in range(len(self.starts)):
+            yield self.decode(self.encoded(index))
+
+def set_instructions(block, instructions):
+    '''
+    Replace the instructions of a block by a list of instruction
+    tuples, keeping the compact encoding if the block uses one.
+    '''
+    if isinstance(block.instructions, CompactCode):
+        code = CompactCode(block.instructions.registers)
+        code.extend(instructions)
+        block.instructions = code
+    else:
+        block.instructions = list(instructions)
+
+class Assembler(object):
+    '''
+    Builds a list of instruction tuples in which jumps refer to labels.
+    A label is any hashable object naming a position; define() places
+    it at the end of the code so far.  The code is made in one pass: a
+    jump to a label already placed gets its pc at once, and a jump to a
+    label further down is backpatched when the label is placed.  Its
+    place in self.code holds None until then, and its tuple is built
+    once, when all its labels are known.
+
+        code           The instructions
+        code_map       Label -> pc
+    '''
+    def __init__(self):
+        self.code = []
+        self.code_map = {}
+        self.fixups = {}            # Label -> [(pc, operand index)] of jumps waiting for it
+        self.unresolved = {}        # pc -> [operands, number of unknown labels]
+
+    def define(self, label):
+        '''
+        Place label at the current pc and backpatch the jumps to it.
+        '''
+        pc = self.code_map[label] = len(self.code)
+        for jump_pc, index in self.fixups.pop(label, ()):
+            entry = self.unresolved[jump_pc]
+            entry[0][index] = pc
+            entry[1] -= 1
+            if not entry[1]:
+                self.code[jump_pc] = tuple(entry[0])
+                del self.unresolved[jump_pc]
+
+    def emit_jump(self, *inst):
+        '''
+        Append a jump or cbranch whose label operands are labels.
+        '''
+        pc = len(self.code)
+        operands = list(inst)
+        missing = 0
+        for index, kind in enumerate(signatures[inst[0]], 1):
+            if kind == LABEL:
+                target = self.code_map.get(operands[index])
+                if target is None:
+                    self.fixups.setdefault(operands[index], []).append((pc, index))
+                    missing += 1
+                else:
+                    operands[index] = target
+        if missing:
+            self.code.append(None)
+            self.unresolved[pc] = [operands, missing]
+        else:
+            self.code.append(tuple(operands))
+
+    def patch_jumps(self, thread=True):
+        '''
+        Finish the code once all labels are placed.  Jumps have been
+        backpatched already, so this only checks that none is left and
+        threads them (see thread_jumps()) unless thread is False.
+        '''
+        if self.unresolved:
+            raise ValueError("Jump to a label that is never placed: %r" % (self.fixups.keys()[0],))
+        if thread:
+            self.thread_jumps()
+
+    def thread_jumps(self):
+        '''
+        Retarget jumps and cbranches that lead to a jump (such as the
+        one left by an empty block) to its final destination, and
+        remove jumps to the instruction right after them.  Must be run
+        after the jumps are patched.
+        '''
+        code = self.code
+        final = {}                  # pc -> where a jump there ends up
+
+        def destination(label):
+            path = []
+            while label < len(code) and code[label][0] == 'jump' and label not in final:
+                final[label] = label            # Stops cycles
+                path.append(label)
+                label = code[label][1]
+            label = final.get(label, label)
+            for pc in path:
+                final[pc] = label
+            return label
+
+        for pc, inst in enumerate(code):
+            if inst[0] == 'jump':
+                code[pc] = ('jump', destination(inst[1]))
+            elif inst[0] == 'cbranch':
+                test, if_label, else_label = inst[1:]
+                if_label, else_label = destination(if_label), destination(else_label)
+                if if_label == else_label:
+                    code[pc] = ('jump', if_label)
+                else:
+                    code[pc] = ('cbranch', test, if_label, else_label)
+
+        # A forward jump can go if everything between it and its target
+        # goes, which one backward pass finds.  next_kept[pc] is the
+        # first pc from pc on that stays.
+        next_kept = [len(code)] * (len(code) + 1)
+        for pc in range(len(code) - 1, -1, -1):
+            inst = code[pc]
+            if inst[0] == 'jump' and inst[1] > pc and next_kept[pc+1] == next_kept[inst[1]]:
+                next_kept[pc] = next_kept[pc+1]
+            else:
+                next_kept[pc] = pc
+        if all(next_kept[pc] == pc for pc in range(len(code))):
+            return
+        # New pc of every old pc (a removed jump goes to the next one)
+        position = []
+        n = 0
+        for pc in range(len(code)):
+            position.append(n)
+            n += next_kept[pc] == pc
+        position.append(n)
+        relabeled = []
+        for pc, inst in enumerate(code):
+            if next_kept[pc] != pc:
+                continue
+            if inst[0] == 'jump':
+                inst = ('jump', position[inst[1]])
+            elif inst[0] == 'cbranch':
+                inst = ('cbranch', inst[1], position[inst[2]], position[inst[3]])
+            relabeled.append(inst)
+        self.code = relabeled
+
@@ -0,0 +1,199 @@
+# exprlicm.py
+'''
+Loop-Invariant Code Motion
+==========================
+A while loop evaluates its test and runs its body over and over, even
+the parts that compute the same value every time around.  For example,
+in
+
+       while c - 3 == a {
+           a = b / c;
+           c = 3;
+       }
+
+the literal 3 of the test, the literal 3 stored to 'c' and the load of
+'b' give the same result in every iteration.  This file implements a
+pass that moves such instructions out of the loop into a new
+preheader block that is linked in right before the WhileBlock and runs
+once:
+
+       ('literal_int', 3, '__int_2')         # preheader
+       ('load_int', 'b', '__int_5')
+       ('literal_int', 3, '__int_8')
+    WhileBlock:
+       ('load_int', 'c', '__int_1')
+       ('sub_int', '__int_1', '__int_2', '__int_3')
+       ...
+
+An instruction of the loop (its test or any block of its body,
+including nested loops) is invariant if
+
+    -  it has no side effects: 'literal', 'load', 'move', arithmetic,
+       comparisons, and 'call_func' of an external function listed
+       in pure_functions.
+
+    -  every temporary it reads is defined outside of the loop, or by
+       an invariant instruction.
+
+    -  it's a 'load' of a variable that isn't stored or allocated
+       anywhere in the loop.
+
+    -  its result is a temporary with a single definition.
+
+The preheader runs even if the loop doesn't, so an instruction that
+can fail ('div' and external function calls) is only moved if it
+belongs to the test, which always runs at least once, and no call with
+side effects comes before it there.  A division by a non-zero literal
+can't fail and is moved from the body as well.  Nested loops are
+handled from the inside out, so code can move out of several loops.
+'''
+
+from collections import defaultdict
+import exprblock
+import exprir
+
+# Operations that can't fail and have no effect other than their result
+invariant_ops = set(['literal', 'load', 'move', 'add', 'sub', 'mul',
+                     'shl', 'shr', 'uadd', 'usub', 'lnot']) | set(exprir.comparisons)
+
+# External functions without side effects
+pure_functions = set(['acos', 'asin', 'atan', 'atan2', 'ceil', 'cos', 'cosh',
+                      'exp', 'fabs', 'floor', 'fmod', 'hypot', 'log', 'log10',
+                      'pow', 'sin', 'sinh', 'sqrt', 'tan', 'tanh'])
+
+class HoistInvariants(object):
+    '''
+    Loop-invariant code motion for all the WhileBlocks reachable from a
+    start block.  After hoist(), self.hoisted holds the number of
+    instructions moved.
+    '''
+    def __init__(self):
+        self.hoisted = 0
+
+    def hoist(self, start_block):
+        blocks = exprblock.all_blocks(start_block)
+
+        # Where each block is linked from, to insert preheaders
+        self.links = {}
+        for block in blocks:
+            for attr in exprblock.links:
+                child = getattr(block, attr, None)
+                if isinstance(child, exprblock.Block):
+                    self.links[child] = (block, attr)
+
+        self.defs = defaultdict(int)
+        self.nonzero = set()        # Temporaries holding non-zero literals
+        for block in blocks:
+            for inst in block.instructions:
+                if inst[0].startswith('literal_') and inst[1]:
+                    self.nonzero.add(inst[2])
+                for kind, arg in zip(exprir.operand_kinds(inst), inst[1:]):
+                    if kind == exprir.DEF:
+                        self.defs[arg] += 1
+
+        # Inner loops come after outer loops in link order
+        for block in reversed(blocks):
+            if isinstance(block, exprblock.WhileBlock):
+                self.hoist_loop(block)
+
+    def hoist_loop(self, loop):
+        if loop not in self.links:
+            return
+        loop_blocks = [loop] + exprblock.all_blocks(loop.body)
+
+        # Names written inside the loop
+        stored = set()
+        defined = set()
+        for block in loop_blocks:
+            for inst in block.instructions:
+                for kind, arg in zip(exprir.operand_kinds(inst), inst[1:]):
+                    if kind == exprir.STORE:
+                        stored.add(arg)
+                    elif kind == exprir.DEF:
+                        defined.add(arg)
+
+        hoisted = []
+        invariant = set()           # Targets of hoisted instructions
+        changed = True
+        while changed:
+            changed = False
+            for block in loop_blocks:
+                keep = []
+                side_effects = False
+                for inst in block.instructions:
+                    if self.is_invariant(inst, block is loop and not side_effects,
+                                         stored, defined, invariant):
+                        hoisted.append(inst)
+                        invariant.add(inst[-1])
+                        changed = True
+                    else:
+                        keep.append(inst)
+                        if exprir.split_opcode(inst[0])[0] not in invariant_ops:
+                            side_effects = True
+                if len(keep) != len(block.instructions):
+                    exprir.set_instructions(block, keep)
+
+        if hoisted:
+            self.hoisted += len(hoisted)
+            preheader = exprblock.BasicBlock()
+            if isinstance(loop.instructions, exprir.CompactCode):
+                preheader.instructions = exprir.CompactCode(loop.instructions.registers)
+            exprir.set_instructions(preheader, hoisted)
+            owner, attr = self.links[loop]
+            setattr(owner, attr, preheader)
+            preheader.next_block = loop
+            self.links[preheader] = (owner, attr)
+            self.links[loop] = (preheader, 'next_block')
+
+    def is_invariant(self, inst, may_fail, stored, defined, invariant):
+        '''
+        Return True if instruction inst computes the same value in every
+        iteration of the loop and can be moved.  may_fail tells whether
+        an instruction that can fail may be moved.
+        '''
+        op, typename = exprir.split_opcode(inst[0])
+        if op == 'div':
+            if not (may_fail or inst[2] in self.nonzero):
+                return False
+        elif op == 'call_func':
+            if not (may_fail and inst[1] in pure_functions):
+                return False
+        elif op not in invariant_ops:
+            return False
+        if self.defs[inst[-1]] != 1:
+            return False
+        for kind, arg in zip(exprir.operand_kinds(inst), inst[1:]):
+            if kind == exprir.USE and arg in defined and arg not in invariant:
+                return False
+            elif kind == exprir.LOAD and arg in stored:
+                return False
+        return True
+
+def hoist_invariants(start_block):
+    '''
+    Move loop-invariant instructions out of all while loops reachable
+    from start_block.  Returns the number of instructions moved.
+    '''
+    licm = HoistInvariants()
+    licm.hoist(start_block)
+    return licm.hoisted
+
+if __name__ == '__main__':
+    import exprlex
+    import exprparse
+    import exprcheck
+    import exprcode
+    import sys
+    from errors import subscribe_errors, errors_reported
+    lexer = exprlex.make_lexer()
+    parser = exprparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg+"\n")):
+        program = parser.parse(open(sys.argv[1]).read())
+        # Check the program
+        exprcheck.check_program(program)
+        # If no errors occurred, generate code
+        if not errors_reported():
+            code = exprcode.generate_code(program)
+            hoisted = hoist_invariants(code.start_block)
+            exprblock.PrintBlocks().visit(code.start_block)
+            print "Hoisted %d instructions" % hoisted
@@ -0,0 +1,196 @@
+# exprlvn.py
+'''
+Local Value Numbering
+=====================
+Expressions in a block often recompute values that are already
+available.  For example, the statements
+
+       b = c - a;
+       b = c - a;
+
+load 'a' and 'c' twice and subtract twice.  This file implements hash-based
+value numbering over the instructions of each basic block.  Every
+temporary gets a value, represented by the first temporary that held
+it.  An instruction is looked up by its opcode and the values of its
+operands:
+
+       ('load_int', 'c', '__int_5')
+       ('load_int', 'a', '__int_6')
+       ('sub_int', '__int_5', '__int_6', '__int_7')
+       ('store_int', '__int_7', 'b')
+       ('load_int', 'c', '__int_8')             # same as __int_5
+       ('load_int', 'a', '__int_9')             # same as __int_6
+       ('sub_int', '__int_8', '__int_9', '__int_10')   # same as __int_7
+       ('store_int', '__int_10', 'b')
+
+If the same computation was seen before, the instruction is removed
+and all uses of its result are renamed to the earlier temporary:
+
+       ('load_int', 'c', '__int_5')
+       ('load_int', 'a', '__int_6')
+       ('sub_int', '__int_5', '__int_6', '__int_7')
+       ('store_int', '__int_7', 'b')
+       ('store_int', '__int_7', 'b')
+
+The rules are:
+
+    -  'literal' instructions with the same value are the same.
+
+    -  A 'load' of a variable gives the value last stored to it in the
+       block, or the value of an earlier load if the variable hasn't
+       been stored to since.  'alloc' forgets the value of a variable.
+
+    -  Arithmetic and comparisons with the same operand values are the
+       same.  The operands of int and float add and mul, and of the
+       eq and ne comparisons, are put in a fixed order first, so that
+       a+b and b+a are found to be the same as well.
+
+    -  'call_func' is never reused, since external functions may have
+       side effects.
+
+Only temporaries assigned exactly once in the program take part.
+'''
+
+from collections import defaultdict
+import exprblock
+import exprir
+
+# Operations that can be reused when computed again
+reusable_ops = set(['literal', 'add', 'sub', 'mul', 'div', 'shl', 'shr',
+                    'uadd', 'usub', 'lnot']) | set(exprir.comparisons)
+
+# Commutative operations (string add is concatenation and not commutative)
+commutative = set(['add_int', 'add_float', 'mul_int', 'mul_float',
+                   'eq_int', 'eq_float', 'eq_bool', 'ne_int', 'ne_float', 'ne_bool'])
+
+def expression_key(inst):
+    '''
+    Return the lookup key for the computation done by inst, or None
+    if it can't be reused.
+    '''
+    op, typename = exprir.split_opcode(inst[0])
+    if op not in reusable_ops or len(exprir.operand_kinds(inst)) != len(inst) - 1:
+        return None
+    if op == 'literal':
+        # repr() keeps 0.0 and -0.0 apart
+        return (inst[0], repr(inst[1]))
+    args = inst[1:-1]
+    if inst[0] in commutative:
+        args = tuple(sorted(args))
+    return (inst[0],) + args
+
+class LocalValueNumbering(object):
+    '''
+    Value numbering over each block reachable from a start block.  After
+    number(), self.eliminated maps every block to the number of
+    instructions removed from it.
+    '''
+    def __init__(self):
+        self.eliminated = {}
+        self.renames = {}       # Removed temporary -> earlier temporary
+
+    def number(self, start_block):
+        blocks = exprblock.all_blocks(start_block)
+
+        self.defs = defaultdict(int)
+        for block in blocks:
+            for inst in block.instructions:
+                for kind, arg in zip(exprir.operand_kinds(inst), inst[1:]):
+                    if kind == exprir.DEF:
+                        self.defs[arg] += 1
+
+        for block in blocks:
+            self.number_block(block)
+
+        # Temporaries may be read in later blocks (e.g. as a block test)
+        if self.renames:
+            for block in blocks:
+                exprir.set_instructions(block, [self.rename(inst) for inst in block.instructions])
+                if isinstance(block, (exprblock.IfBlock, exprblock.WhileBlock)):
+                    block.test = self.renames.get(block.test, block.test)
+
+    def rename(self, inst):
+        '''
+        Return inst with the temporaries it reads renamed.
+        '''
+        kinds = exprir.operand_kinds(inst)
+        return (inst[0],) + tuple(self.renames.get(arg, arg) if kind == exprir.USE else arg
+                                  for kind, arg in zip(kinds, inst[1:]))
+
+    def number_block(self, block):
+        available = {}      # Computation key -> temporary holding it
+        memory = {}         # Variable -> temporary holding its value
+        keep = []
+        for inst in block.instructions:
+            inst = self.rename(inst)
+            op, typename = exprir.split_opcode(inst[0])
+            target = inst[-1]
+            if op == 'load' and self.defs[target] == 1:
+                var = inst[1]
+                if var in memory:
+                    self.renames[target] = memory[var]
+                    continue
+                memory[var] = target
+            elif op == 'store':
+                source, var = inst[1:]
+                if self.defs[source] == 1:
+                    memory[var] = source
+                else:
+                    memory.pop(var, None)
+            elif op == 'alloc':
+                memory.pop(inst[1], None)
+            else:
+                key = expression_key(inst)
+                if key is not None and self.defs[target] == 1:
+                    if key in available:
+                        self.renames[target] = available[key]
+                        continue
+                    available[key] = target
+            keep.append(inst)
+        self.eliminated[block] = len(block.instructions) - len(keep)
+        if self.eliminated[block]:
+            exprir.set_instructions(block, keep)
+
+def number_values(start_block):
+    '''
+    Run local value numbering on all blocks reachable from start_block.
+    Returns a dictionary mapping each block to the number of
+    instructions eliminated from it.
+    '''
+    lvn = LocalValueNumbering()
+    lvn.number(start_block)
+    return lvn.eliminated
+
+class PrintEliminated(exprblock.PrintBlocks):
+    '''
+    Print blocks together with the number of instructions value
+    numbering removed from each.
+    '''
+    def __init__(self, eliminated):
+        self.eliminated = eliminated
+
+    def visit_BasicBlock(self, block):
+        print("Block:[%s] eliminated %d" % (block, self.eliminated.get(block, 0)))
+        for inst in block.instructions:
+            print("    %s" % (inst,))
+        print("")
+
+if __name__ == '__main__':
+    import exprlex
+    import exprparse
+    import exprcheck
+    import exprcode
+    import sys
+    from errors import subscribe_errors, errors_reported
+    lexer = exprlex.make_lexer()
+    parser = exprparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg+"\n")):
+        program = parser.parse(open(sys.argv[1]).read())
+        # Check the program
+        exprcheck.check_program(program)
+        # If no errors occurred, generate code
+        if not errors_reported():
+            code = exprcode.generate_code(program)
+            eliminated = number_values(code.start_block)
+            PrintEliminated(eliminated).visit(code.start_block)
+            print "Eliminated %d instructions" % sum(eliminated.values())
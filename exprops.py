@@ -0,0 +1,91 @@
+# exprops.py
+'''
+Operators
+=========
+The front end, the code generator and the optimizations all need to
+know what the operators of the Expr language mean.  This file maps the
+operator symbols of the language to the operation names used in the
+intermediate code:
+
+       a + b     ('add_int', a, b, target)
+       a < b     ('lt_int', a, b, target)
+       -a        ('usub_int', a, target)
+
+and computes operations on known values exactly like the interpreter
+(exprinterp.py) does:
+
+       >>> evaluate('div', 'int', [-7, 2])
+       ('int', -4)
+       >>> evaluate('lt', 'float', [1.0, 2.0])
+       ('bool', True)
+
+It doesn't depend on any other part of the compiler, so that the
+checker (exprcheck.py) can work out the values of constants without
+reaching into code generation or the optimizations.
+'''
+
+import operator
+
+# Binary operators and comparisons of the language and their operations
+binary_ops = {
+    '+' : 'add',
+    '-' : 'sub',
+    '*' : 'mul',
+    '/' : 'div',
+    '<' : 'lt',
+    '>' : 'gt',
+    '==': 'eq',
+    '!=': 'ne',
+    '<=': 'le',
+    '>=': 'ge',
+}
+
+# Logical operators that only evaluate their right operand if needed
+short_circuit_ops = set(['&&', '||'])
+
+unary_ops = {
+    '+' : 'uadd',
+    '-' : 'usub',
+    '!' : 'lnot',
+}
+
+# Comparisons as done by Interpreter.run_lt_int() and friends
+compare_ops = {
+    'lt' : operator.lt,
+    'le' : operator.le,
+    'eq' : operator.eq,
+    'ne' : operator.ne,
+    'ge' : operator.ge,
+    'gt' : operator.gt,
+}
+
+def evaluate(op, typename, args):
+    '''
+    Compute the result of operation op with type typename on a list of
+    operand values.  Returns a tuple (typename, value) with the type of
+    the result.  Raises ArithmeticError for operations that fail at run
+    time, and KeyError for operations that can't be folded.
+    '''
+    if op == 'add':
+        return typename, args[0] + args[1]
+    elif op == 'sub':
+        return typename, args[0] - args[1]
+    elif op == 'mul':
+        return typename, args[0] * args[1]
+    elif op == 'div':
+        if typename == 'int':
+            return typename, args[0] // args[1]
+        return typename, args[0] / args[1]
+    elif op == 'shl':
+        return typename, args[0] << args[1]
+    elif op == 'shr':
+        return typename, args[0] >> args[1]
+    elif op in compare_ops:
+        return 'bool', compare_ops[op](args[0], args[1])
+    elif op in ('uadd', 'move'):
+        return typename, args[0]
+    elif op == 'usub':
+        return typename, -args[0]
+    elif op == 'lnot':
+        return typename, not args[0]
+    raise KeyError(op)
@@ -0,0 +1,186 @@
+# exprpass.py
+'''
+Optimization Pass Manager
+=========================
+The optimizations in exprsccp.py, exprfold.py, exprsimplify.py,
+exprlvn.py, exprlicm.py, exprdce.py, exprssa.py and exprslots.py all
+work on the basic blocks made by exprcode.py and are run between code
+generation and linking.  This file runs them as
+a pipeline, chosen by name or by optimization level:
+
+       -O0     no optimization
+       -O1     constant propagation with removal of branches that
+               are never taken, constant folding, algebraic
+               simplification and dead code elimination
+       -O2     adds value numbering and loop-invariant code motion
+       -O3     runs the -O2 passes on SSA form (see exprssa.py), which
+               also removes the loads and stores of variables
+
+All levels from -O1 up end with 'slots', which renames temporaries to
+reusable slots to keep the register file of the interpreter small.
+
+For every pass the manager records its wall time and how much it
+changed the number of instructions, so that compile time can be
+weighed against the speed of the compiled program.  For example:
+
+    bash % python exprinterp.py -O2 --pass-stats loop.e
+
+prints a line per pass to stderr like this
+
+       fold         0.16 ms       25 ->       25  (+0)
+       lvn          0.39 ms       25 ->       22  (-3)
+       licm         0.21 ms       22 ->       22  (+0)
+       dce          0.16 ms       22 ->       22  (+0)
+       slots        0.47 ms       22 ->       22  (+0)
+       total        1.39 ms
+'''
+
+import sys
+import time
+import exprblock
+import exprsccp
+import exprfold
+import exprsimplify
+import exprlvn
+import exprlicm
+import exprdce
+import exprssa
+import exprslots
+
+def count_instructions(start_block):
+    '''
+    Return the number of instructions in all blocks reachable from
+    start_block.
+    '''
+    return sum(len(block.instructions) for block in exprblock.all_blocks(start_block))
+
+def value_numbering(start_block):
+    return sum(exprlvn.number_values(start_block).values())
+
+# Available passes.  Each one is a function taking the start block,
+# changing the blocks in place.
+passes = {
+    'sccp'     : exprsccp.propagate_constants,
+    'fold'     : exprfold.fold_constants,
+    'simplify' : exprsimplify.simplify_algebra,
+    'lvn'      : value_numbering,
+    'licm'     : exprlicm.hoist_invariants,
+    'dce'      : exprdce.eliminate_dead_code,
+    'ssa'      : exprssa.promote_variables,
+    'unssa'    : exprssa.leave_ssa,
+    'slots'    : exprslots.allocate_slots,
+}
+
+# Pass pipelines of the optimization levels
+levels = {
+    0 : [],
+    1 : ['sccp', 'fold', 'simplify', 'dce', 'slots'],
+    2 : ['sccp', 'fold', 'lvn', 'simplify', 'licm', 'dce', 'slots'],
+    3 : ['ssa', 'sccp', 'fold', 'lvn', 'simplify', 'licm', 'dce', 'unssa', 'slots'],
+}
+
+class PassManager(object):
+    '''
+    Runs a list of passes (names from the passes dictionary) over the
+    blocks of a program.  After run(), self.stats holds a tuple
+    (name, seconds, instructions before, instructions after) for every
+    pass run.
+    '''
+    def __init__(self, pipeline):
+        for name in pipeline:
+            if name not in passes:
+                raise ValueError("Unknown pass %s" % name)
+        self.pipeline = list(pipeline)
+        self.stats = []
+
+    def run(self, start_block):
+        count = count_instructions(start_block)
+        for name in self.pipeline:
+            start = time.time()
+            passes[name](start_block)
+            seconds = time.time() - start
+            before, count = count, count_instructions(start_block)
+            self.stats.append((name, seconds, before, count))
+
+    def report(self, out):
+        '''
+        Write the statistics of the passes run to file out.
+        '''
+        total = 0.0
+        for name, seconds, before, after in self.stats:
+            total += seconds
+            out.write("%-8s %8.2f ms %8d -> %8d  (%+d)\n" %
+                      (name, seconds*1000, before, after, after - before))
+        out.write("%-8s %8.2f ms\n" % ('total', total*1000))
+
+def optimize(start_block, level=None, pipeline=None):
+    '''
+    Optimize the blocks reachable from start_block at an optimization
+    level, or with an explicit list of pass names.  Returns the
+    PassManager holding the statistics.
+    '''
+    if pipeline is None:
+        pipeline = levels[level or 0]
+    manager = PassManager(pipeline)
+    manager.run(start_block)
+    return manager
+
+def add_options(parser):
+    '''
+    Add the command line options that select passes to an
+    optparse.OptionParser.
+    '''
+    parser.add_option("-O", "--optimize",
+                     action="store", type="int", dest="level", default=0,
+                     help="optimization level 0-%d" % max(levels))
+    parser.add_option("--passes",
+                     action="store", dest="passes", default=None,
+                     help="comma separated list of passes to run (%s)"
+                           % ', '.join(sorted(passes)))
+    parser.add_option("--pass-stats",
+                     action="store_true", dest="pass_stats", default=False,
+                     help="show time and instruction count change of each pass")
+
+def selected_pipeline(options):
+    '''
+    Return the list of pass names selected by the options of
+    add_options().
+    '''
+    if options.passes:
+        return options.passes.split(',')
+    if options.level not in levels:
+        raise ValueError("Unknown optimization level %d" % options.level)
+    return levels[options.level]
+
+def optimize_with_options(start_block, options):
+    '''
+    Run the passes selected by the options of add_options().
+    '''
+    manager = optimize(start_block, pipeline=selected_pipeline(options))
+    if options.pass_stats:
+        manager.report(sys.stderr)
+    return manager
+
+if __name__ == '__main__':
+    import exprlex
+    import exprparse
+    import exprcheck
+    import exprcode
+    import optparse
+    from errors import subscribe_errors, errors_reported
+
+    parser = optparse.OptionParser()
+    add_options(parser)
+    options, args = parser.parse_args(sys.argv[1:])
+    options.pass_stats = True
+    lexer = exprlex.make_lexer()
+    parser = exprparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg+"\n")):
+        program = parser.parse(open(args[0]).read())
+        # Check the program
+        exprcheck.check_program(program)
+        # If no errors occurred, generate code
+        if not errors_reported():
+            code = exprcode.generate_code(program)
+            optimize_with_options(code.start_block, options)
+            exprblock.PrintBlocks().visit(code.start_block)
@@ -0,0 +1,302 @@
+# exprpy.py
+'''
+Python Code Generation
+======================
+In this file, the basic blocks created by exprcode.py are translated
+into Python source code.  IfBlocks and WhileBlocks become real if and
+while statements, temporaries and variables become local variables of
+a single function.  The source is compiled with compile() and the
+resulting function is executed by CPython directly, so there is no
+dispatch per instruction as in the interpreter (exprinterp.py).
+
+For example, the blocks of the program
+
+       var a int = 2;
+       while a < 10 {
+           a = a * 2;
+       }
+       print a;
+
+are turned into something like this:
+
+       def main():
+           v_a = 0
+           v___int_0 = 2
+           v_a = v___int_0
+           while True:
+               v___int_1 = v_a
+               v___int_2 = 10
+               v___bool_0 = v___int_1 < v___int_2
+               if not v___bool_0:
+                   break
+               ...
+           v___int_6 = v_a
+           print(v___int_6)
+
+Run programs by typing:
+
+    bash % python exprpy.py someprogram.e
+'''
+
+import re
+import math
+import exprblock
+import exprir
+import exprfuse
+
+# Initial values of allocated variables
+default_values = {
+    'int'    : '0',
+    'float'  : '0.0',
+    'string' : "''",
+    'bool'   : 'False',
+}
+
+# Python statements for each operation.  The operands are numbered in
+# instruction order, with names and values already turned into Python
+# expressions.
+templates = {
+    'literal' : '{1} = {0}',
+    'load'    : '{1} = {0}',
+    'store'   : '{1} = {0}',
+    'move'    : '{1} = {0}',
+    'add'     : '{2} = {0} + {1}',
+    'sub'     : '{2} = {0} - {1}',
+    'mul'     : '{2} = {0} * {1}',
+    'shl'     : '{2} = {0} << {1}',
+    'shr'     : '{2} = {0} >> {1}',
+    'uadd'    : '{1} = {0}',
+    'usub'    : '{1} = -{0}',
+    'lnot'    : '{1} = not {0}',
+    'print'   : 'print({0})',
+    'nop'     : 'pass',
+    'move2'   : '{1} = {0}; {3} = {2}',
+}
+
+# Python operators of the comparisons
+comparison_operators = {
+    'lt' : '<',
+    'le' : '<=',
+    'eq' : '==',
+    'ne' : '!=',
+    'ge' : '>=',
+    'gt' : '>',
+}
+for _op, _operator in comparison_operators.items():
+    templates[_op] = '{2} = {0} %s {1}' % _operator
+del _op, _operator
+
+# Superinstructions of linked code (see exprfuse.py) -> (opcode, suffix)
+# of the binary operation they merge
+fused_operations = exprfuse.fused_operations()
+
+def python_value(value):
+    '''
+    Return a Python expression for a constant value.  repr() gives one
+    for everything but infinite floats and NaN, whose repr() ('inf',
+    'nan') is not an expression.
+    '''
+    if isinstance(value, float) and math.isinf(value):
+        return "float('inf')" if value > 0 else "-float('inf')"
+    elif isinstance(value, float) and math.isnan(value):
+        return "float('nan')"
+    return repr(value)
+
+def python_statement(inst, location, function=None):
+    '''
+    Return a line of Python source code that carries out the
+    instruction inst.  location is a function that returns the
+    Python expression for the storage of a temporary or variable
+    name.  function does the same for external function names and
+    defaults to location.  Control flow instructions (jump, cbranch
+    and the superinstructions ending in one) have no translation, see
+    python_branch() for the test of a branch.
+    '''
+    if function is None:
+        function = location
+    op, typename = exprir.split_opcode(inst[0])
+    args = []
+    for kind, arg in zip(exprir.operand_kinds(inst), inst[1:]):
+        if kind == exprir.VALUE:
+            args.append(python_value(arg))
+        elif kind == exprir.TYPE:
+            args.append(arg)
+        elif kind == exprir.FUNC:
+            args.append(function(arg))
+        else:
+            args.append(location(arg))
+
+    # Superinstructions merging a binary operation take its operands,
+    # whether loaded, literal or stored, in the same order
+    fused = fused_operations.get(inst[0])
+    if fused is not None and not fused[1].endswith('_br'):
+        op, typename = exprir.split_opcode(fused[0])
+
+    if op == 'alloc':
+        return '%s = %s' % (args[0], default_values[typename])
+    elif op == 'div':
+        # Integer division truncates like run_div_int() in the interpreter
+        divide = '//' if typename == 'int' else '/'
+        return '%s = %s %s %s' % (args[2], args[0], divide, args[1])
+    elif op == 'extern_func':
+        return '%s = _extern(%r)' % (args[0], inst[1])
+    elif op == 'call_func':
+        return '%s = %s(%s)' % (args[-1], args[0], ', '.join(args[1:-1]))
+    try:
+        return templates[op].format(*args)
+    except KeyError:
+        raise RuntimeError("No Python translation for opcode %s" % inst[0])
+
+def python_branch(inst, location):
+    '''
+    Return the triple (test, if_label, else_label) for a conditional
+    branch: a cbranch or a superinstruction ending in one.  test is a
+    Python expression that is true if the branch goes to if_label.
+    Returns None for other instructions.
+    '''
+    op = exprir.split_opcode(inst[0])[0]
+    if op in ('cbranch', 'load_br'):
+        return location(inst[1]), inst[2], inst[3]
+    fused = fused_operations.get(inst[0])
+    if fused is None or not fused[1].endswith('_br'):
+        return None
+    left, right = [python_value(arg) if kind == exprir.VALUE else location(arg)
+                   for kind, arg in zip(exprir.operand_kinds(inst), inst[1:3])]
+    operator = comparison_operators[exprir.split_opcode(fused[0])[0]]
+    return '%s %s %s' % (left, operator, right), inst[3], inst[4]
+
+class GeneratePython(exprblock.BlockVisitor):
+    '''
+    Block visitor that emits the source code of a Python function
+    for a chain of basic blocks.  Every temporary and variable name
+    of the intermediate code gets its own local variable.
+    '''
+    def __init__(self, funcname='main'):
+        self.funcname = funcname
+        self.lines = ['def %s():' % funcname]
+        self.depth = 1
+
+        # Maps names in the intermediate code to Python identifiers
+        self.identifiers = {}
+        self.used = set()
+
+    def identifier(self, name):
+        '''
+        Return the Python identifier used for an intermediate code name.
+        '''
+        ident = self.identifiers.get(name)
+        if ident is None:
+            ident = base = 'v_' + re.sub(r'\W', '_', name)
+            n = 0
+            while ident in self.used:
+                n += 1
+                ident = '%s_%d' % (base, n)
+            self.identifiers[name] = ident
+            self.used.add(ident)
+        return ident
+
+    def emit(self, line):
+        self.lines.append('    '*self.depth + line)
+
+    def emit_suite(self, block):
+        '''
+        Emit the chain of blocks starting at block as an indented suite.
+        '''
+        self.depth += 1
+        start = len(self.lines)
+        self.visit(block)
+        if len(self.lines) == start:
+            self.emit('pass')
+        self.depth -= 1
+
+    def visit_BasicBlock(self, block):
+        for inst in block.instructions:
+            self.emit(python_statement(inst, self.identifier))
+
+    def visit_IfBlock(self, block):
+        self.visit_BasicBlock(block)
+        self.emit('if %s:' % self.identifier(block.test))
+        self.emit_suite(block.if_branch)
+        if block.else_branch:
+            self.emit('else:')
+            self.emit_suite(block.else_branch)
+
+    def visit_WhileBlock(self, block):
+        self.emit('while True:')
+        self.depth += 1
+        self.visit_BasicBlock(block)
+        self.emit('if not %s:' % self.identifier(block.test))
+        self.emit('    break')
+        self.visit(block.body)
+        self.depth -= 1
+
+    def source(self):
+        '''
+        Return the generated source code.
+        '''
+        if len(self.lines) == 1:
+            self.emit('pass')
+        return '\n'.join(self.lines) + '\n'
+
+def extern_resolver(modules):
+    '''
+    Return a function that looks up external functions by name in a
+    list of Python modules (see Interpreter.run_extern_func()).
+    '''
+    def _extern(name):
+        for module in modules:
+            func = getattr(module, name, None)
+            if func:
+                return func
+        raise RuntimeError("No extern function %s found" % name)
+    return _extern
+
+def compile_blocks(start_block, filename='<expr>', external_libs=('math', 'os')):
+    '''
+    Translate the chain of blocks beginning at start_block into a
+    Python function.  Returns (function, source).
+    '''
+    gen = GeneratePython()
+    gen.visit(start_block)
+    source = gen.source()
+    namespace = {
+        '_extern' : extern_resolver([__import__(name) for name in external_libs]),
+    }
+    exec(compile(source, filename, 'exec'), namespace)
+    return namespace[gen.funcname], source
+
+def get_options():
+    parser = optparse.OptionParser()
+    parser.add_option("-s", "--show-source",
+                     action="store_true", dest="show_source", default=False,
+                     help="show generated Python source")
+    exprpass.add_options(parser)
+    options, args = parser.parse_args(sys.argv[1:])
+    return options, args
+
+if __name__ == '__main__':
+    import exprlex
+    import exprparse
+    import exprcheck
+    import exprcode
+    import exprpass
+    import sys
+    import optparse
+    from errors import subscribe_errors, errors_reported
+
+    options, args = get_options()
+    lexer = exprlex.make_lexer()
+    parser = exprparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg+"\n")):
+        program = parser.parse(open(args[0]).read())
+        # Check the program
+        exprcheck.check_program(program)
+        # If no errors occurred, generate code
+        if not errors_reported():
+            code = exprcode.generate_code(program)
+            exprpass.optimize_with_options(code.start_block, options)
+            func, source = compile_blocks(code.start_block, args[0])
+            if options.show_source:
+                print source
+                print "GIVES"
+            func()
@@ -0,0 +1,439 @@
+# exprsccp.py
+'''
+Sparse Conditional Constant Propagation
+=======================================
+Programs configured by flags guard whole regions of code with tests
+that always go the same way:
+
+       var verbose bool = false;
+       var n int = 10;
+       if verbose {
+           print n;
+       }
+       print n * 2;
+
+Constant folding (see exprfold.py) finds that the test is false, but
+the IfBlock is still linked, evaluates the test and jumps around the
+if branch on every run.  This file implements the constant propagation
+of Wegman and Zadeck ("Constant Propagation with Conditional
+Branches"), which only follows the edges of the control flow graph
+(see exprcfg.py) that can be taken given the constants found so far,
+and then removes the branches that are never taken.
+
+Every temporary has a value in the lattice
+
+       TOP        no definition of it has been seen to run (yet)
+       constant   every definition that can run gives this value
+       BOTTOM     the value isn't known at compile time
+
+and so does every variable at every point of the program, where the
+value at the start of a block is the meet of the values at the end of
+the predecessors whose edge can be taken.  A phi only looks at the
+sources of edges that can be taken.  Starting from the start block,
+the analysis evaluates the blocks that can run, and follows
+
+    -  both edges of a test that is BOTTOM,
+    -  one edge of a test that is constant,
+    -  no edge of a test that is TOP,
+
+until nothing changes.  Values only go down the lattice, so every
+block is evaluated a few times at most.  Then
+
+    -  instructions without side effects whose result is constant
+       become 'literal' instructions (a division only gets there if it
+       can't fail),
+
+    -  an IfBlock with a constant test becomes a BasicBlock followed by
+       the branch that is taken, and a WhileBlock whose test is false
+       the first time becomes a BasicBlock,
+
+    -  phis lose the sources of the edges that can't be taken, and a
+       phi left with one source becomes a 'move',
+
+    -  consecutive BasicBlocks are merged into one.
+
+For the program above, only one block is left for the other passes:
+
+       ('alloc_bool', 'verbose')
+       ('literal_bool', False, '__bool_0')
+       ('store_bool', '__bool_0', 'verbose')
+       ('alloc_int', 'n')
+       ('literal_int', 10, '__int_0')
+       ('store_int', '__int_0', 'n')
+       ('literal_bool', False, '__bool_1')
+       ('literal_int', 10, '__int_2')
+       ('literal_int', 2, '__int_3')
+       ('literal_int', 20, '__int_4')
+       ('print_int', '__int_4')
+
+and dead code elimination (see exprdce.py) removes the literals that
+are no longer used.  A while loop whose test is always true is left as it is.
+'''
+
+from collections import defaultdict
+import heapq
+import exprblock
+import exprir
+from exprcfg import control_flow_graph
+from exprflow import block_names, reads
+from exprfold import default_values
+from exprops import evaluate
+
+# The lattice value of a name that isn't known at compile time.  TOP
+# is None, constants are pairs (typename, value).
+BOTTOM = 'BOTTOM'
+
+# Operations that have no effect other than writing their result
+replaceable_ops = set(['load', 'move', 'phi', 'add', 'sub', 'mul', 'div', 'shl', 'shr',
+                       'uadd', 'usub', 'lnot']) | set(exprir.comparisons)
+
+def same(a, b):
+    '''
+    Return True if a and b are the same lattice value.
+    '''
+    if a is None or a is BOTTOM or b is None or b is BOTTOM:
+        return a is b
+    # repr() keeps 1, 1.0, True and 0.0, -0.0 apart
+    return a[0] == b[0] and type(a[1]) is type(b[1]) and repr(a[1]) == repr(b[1])
+
+def same_states(a, b):
+    '''
+    Return True if two dictionaries mapping variables to lattice values
+    are the same.
+    '''
+    if a is None or b is None:
+        return a is b
+    return set(a) == set(b) and all(same(a[var], b[var]) for var in a)
+
+def meet(a, b):
+    '''
+    Return the meet of two lattice values.
+    '''
+    if a is None:
+        return b
+    if b is None or same(a, b):
+        return a
+    return BOTTOM
+
+def meet_states(states):
+    '''
+    Return the meet of a list of dictionaries mapping variables to
+    lattice values.
+    '''
+    result = dict(states[0])
+    for state in states[1:]:
+        for var in set(result) | set(state):
+            result[var] = meet(result.get(var), state.get(var))
+    return result
+
+class PropagateConstants(object):
+    '''
+    Sparse conditional constant propagation over all the blocks reachable
+    from a start block.  Blocks that can't run are removed and the
+    remaining ones relinked.  After propagate(), self.replaced holds the
+    number of instructions turned into literals and self.pruned the
+    number of IfBlocks and WhileBlocks removed.
+    '''
+    def __init__(self):
+        self.replaced = 0
+        self.pruned = 0
+        self.values = {}        # Temporary -> lattice value
+        self.executable = set() # Edges (block, successor) that can be taken
+        self.reached = set()    # Blocks that can run
+        self.at_exit = {}       # Block -> values of variables at its end
+        self.replacement = {}   # Removed block -> block taking its place
+
+    def propagate(self, start_block):
+        self.analyze(start_block)
+        self.rewrite(start_block)
+
+    # ------------------------------------------------------------------
+    # Analysis
+
+    def analyze(self, start_block):
+        self.cfg = cfg = control_flow_graph(start_block)
+
+        # Blocks reading each name, and names a block reads before
+        # writing them
+        self.readers = defaultdict(set)
+        self.exposed = {}
+        for block in cfg.order:
+            self.exposed[block] = block_names(block)[0]
+            for inst in block.instructions:
+                for name in reads(inst):
+                    self.readers[name].add(block)
+            if isinstance(block, (exprblock.IfBlock, exprblock.WhileBlock)) and block.test:
+                self.readers[block.test].add(block)
+
+        # Blocks are evaluated in reverse postorder, so that a loop
+        # settles before the blocks after it are looked at again
+        self.work = [cfg.number[start_block]]
+        self.pending = set(self.work)
+        self.reached.add(start_block)
+        while self.work:
+            n = heapq.heappop(self.work)
+            self.pending.discard(n)
+            self.evaluate_block(cfg.order[n])
+
+    def queue(self, block):
+        n = self.cfg.number[block]
+        if n not in self.pending:
+            self.pending.add(n)
+            heapq.heappush(self.work, n)
+
+    def evaluate_block(self, block):
+        preds = [pred for pred in self.cfg.preds[block]
+                 if (pred, block) in self.executable and pred in self.at_exit]
+        state = meet_states([self.at_exit[pred] for pred in preds]) if preds else {}
+        changed = set()
+        for inst in block.instructions:
+            self.evaluate(block, inst, state, changed)
+
+        # Blocks reading a name that went down the lattice.  Reads in
+        # this block after the write have seen the new value already.
+        for name in changed:
+            for reader in self.readers[name]:
+                if reader in self.reached and (reader is not block or name in self.exposed[block]):
+                    self.queue(reader)
+
+        if not same_states(state, self.at_exit.get(block)):
+            self.at_exit[block] = state
+            for succ in self.cfg.succs[block]:
+                if (block, succ) in self.executable:
+                    self.queue(succ)
+        for succ in self.branch_targets(block):
+            if (block, succ) not in self.executable:
+                self.executable.add((block, succ))
+                self.reached.add(succ)
+                self.queue(succ)
+
+    def evaluate(self, block, inst, state, changed):
+        '''
+        Evaluate an instruction, updating the values of the variables in
+        state and of the temporaries it writes.
+        '''
+        op, typename = exprir.split_opcode(inst[0])
+        kinds = exprir.operand_kinds(inst)
+        if op == 'alloc':
+            state[inst[1]] = (typename, default_values[typename])
+            return
+        elif op == 'store':
+            state[inst[2]] = self.values.get(inst[1])
+            return
+        elif kinds[-1:] != exprir.DEF or len(kinds) != len(inst) - 1:
+            return
+
+        if op == 'literal':
+            value = (typename, inst[1])
+        elif op == 'load':
+            value = state.get(inst[1])
+        elif op == 'phi':
+            value = None
+            for pred, source in zip(self.cfg.preds[block], inst[1:-1]):
+                if (pred, block) in self.executable:
+                    value = meet(value, self.values.get(source))
+        else:
+            value = self.compute(op, typename, kinds, inst)
+        self.lower(inst[-1], value, changed)
+
+    def compute(self, op, typename, kinds, inst):
+        '''
+        Return the lattice value of the result of an operation.
+        '''
+        args = []
+        for kind, arg in zip(kinds[:-1], inst[1:-1]):
+            if kind == exprir.USE:
+                value = self.values.get(arg)
+                if value is None or value is BOTTOM:
+                    return value
+                args.append(value[1])
+            else:
+                return BOTTOM
+        try:
+            return evaluate(op, typename, args)
+        except (KeyError, ArithmeticError):
+            return BOTTOM
+
+    def lower(self, name, value, changed):
+        old = self.values.get(name)
+        new = meet(old, value)
+        if not same(new, old):
+            self.values[name] = new
+            changed.add(name)
+
+    def branch_targets(self, block):
+        '''
+        Return the successors of block that can be taken, given the
+        value of its test.
+        '''
+        succs = self.cfg.succs[block]
+        if isinstance(block, exprblock.IfBlock):
+            first, second = block.if_branch, block.else_branch
+        elif isinstance(block, exprblock.WhileBlock):
+            first, second = block.body or block, None
+        else:
+            return succs
+        others = [succ for succ in succs if succ is not first and succ is not second]
+        after = others[0] if others else None
+        test = self.values.get(block.test)
+        if test is None:
+            targets = []
+        elif test is BOTTOM:
+            targets = [first or after, second or after]
+        else:
+            targets = [first or after] if test[1] else [second or after]
+        return [target for target in targets if target is not None]
+
+    # ------------------------------------------------------------------
+    # Rewriting
+
+    def rewrite(self, start_block):
+        cfg = self.cfg
+        phi_preds = {}          # Block -> its predecessors the phis keep
+        for block in cfg.order:
+            if block in self.reached:
+                preds = [pred for pred in cfg.preds[block] if (pred, block) in self.executable]
+                exprir.set_instructions(block, self.rewrite_block(block, preds))
+                if len(preds) > 1:
+                    phi_preds[block] = preds
+
+        # The block owning the link to each block
+        owner = {}
+        for block in exprblock.all_blocks(start_block):
+            for link in exprblock.links:
+                child = getattr(block, link, None)
+                if isinstance(child, exprblock.Block):
+                    owner[child] = (block, link)
+
+        for block in cfg.order:
+            if block in self.reached and isinstance(block, (exprblock.IfBlock, exprblock.WhileBlock)):
+                test = self.values.get(block.test)
+                if test is None or test is BOTTOM:
+                    continue
+                if isinstance(block, exprblock.IfBlock):
+                    self.prune(block, block.if_branch if test[1] else block.else_branch, owner)
+                elif not test[1]:
+                    self.prune(block, None, owner)
+
+        self.merge(start_block)
+        if self.replacement:
+            self.reorder_phis(start_block, phi_preds)
+
+    def rewrite_block(self, block, preds):
+        '''
+        Return the instructions of a block that can run, with constant
+        results turned into literals and phis reading only the sources
+        of edges that can be taken.
+        '''
+        code = []
+        for inst in block.instructions:
+            op, typename = exprir.split_opcode(inst[0])
+            value = self.values.get(inst[-1]) if op in replaceable_ops else None
+            if value is not None and value is not BOTTOM:
+                code.append(('literal_'+value[0], value[1], inst[-1]))
+                self.replaced += 1
+            elif op == 'phi':
+                sources = [source for pred, source in zip(self.cfg.preds[block], inst[1:-1])
+                           if pred in preds]
+                if len(sources) == 1:
+                    code.append(('move_'+typename, sources[0], inst[-1]))
+                else:
+                    code.append((inst[0],) + tuple(sources) + (inst[-1],))
+            else:
+                code.append(inst)
+        return code
+
+    def prune(self, block, branch, owner):
+        '''
+        Replace an IfBlock or WhileBlock by a BasicBlock with its
+        instructions, followed by the chain of blocks starting with
+        branch (which may be None), and then by its next block.
+        '''
+        replacement = exprblock.BasicBlock()
+        replacement.instructions = block.instructions
+        after = block.next_block
+        if branch is not None:
+            replacement.next_block = branch
+            owner[branch] = (replacement, 'next_block')
+            end = branch
+            while isinstance(end.next_block, exprblock.Block):
+                end = end.next_block
+            end.next_block = after
+        else:
+            end = replacement
+            replacement.next_block = after
+        if isinstance(after, exprblock.Block):
+            owner[after] = (end, 'next_block')
+        parent, link = owner[block]
+        setattr(parent, link, replacement)
+        owner[replacement] = (parent, link)
+        self.replacement[block] = replacement
+        self.pruned += 1
+
+    def merge(self, start_block):
+        '''
+        Merge every BasicBlock followed by another BasicBlock with it.
+        '''
+        for block in exprblock.all_blocks(start_block):
+            if not isinstance(block, exprblock.BasicBlock) or block in self.replacement:
+                continue
+            while isinstance(block.next_block, exprblock.BasicBlock):
+                after = block.next_block
+                exprir.set_instructions(block, list(block.instructions) + list(after.instructions))
+                block.next_block = after.next_block
+                self.replacement[after] = block
+
+    def find(self, block):
+        while block in self.replacement:
+            block = self.replacement[block]
+        return block
+
+    def reorder_phis(self, start_block, phi_preds):
+        '''
+        Put the sources of the phis left in the order of the
+        predecessors of their block in the relinked control flow graph.
+        '''
+        cfg = control_flow_graph(start_block)
+        for block, preds in phi_preds.items():
+            block = self.find(block)
+            old = [self.find(pred) for pred in preds]
+            new = cfg.preds[block]
+            if old == new:
+                continue
+            order = [old.index(pred) for pred in new]
+            exprir.set_instructions(block, [
+                (inst[0],) + tuple(inst[1+n] for n in order) + (inst[-1],)
+                if inst[0].startswith('phi_') else inst
+                for inst in block.instructions])
+
+def propagate_constants(start_block):
+    '''
+    Propagate constants through the blocks reachable from start_block
+    and remove the branches that can't be taken.  Returns the number of
+    instructions turned into literals and blocks removed.
+    '''
+    propagator = PropagateConstants()
+    propagator.propagate(start_block)
+    return propagator.replaced + propagator.pruned
+
+if __name__ == '__main__':
+    import exprlex
+    import exprparse
+    import exprcheck
+    import exprcode
+    import sys
+    from errors import subscribe_errors, errors_reported
+    lexer = exprlex.make_lexer()
+    parser = exprparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg+"\n")):
+        program = parser.parse(open(sys.argv[1]).read())
+        # Check the program
+        exprcheck.check_program(program)
+        # If no errors occurred, generate code
+        if not errors_reported():
+            code = exprcode.generate_code(program)
+            propagator = PropagateConstants()
+            propagator.propagate(code.start_block)
+            exprblock.PrintBlocks().visit(code.start_block)
+            print "Replaced %d instructions by literals and removed %d tests" % (
+                propagator.replaced, propagator.pruned)
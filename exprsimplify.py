@@ -0,0 +1,303 @@
+# exprsimplify.py
+'''
+Algebraic Simplification
+========================
+Programs made from templates are full of operations that do nothing,
+like multiplying by 1 or adding 0, and of operations that can be done
+more cheaply, like dividing by a power of two.  For example:
+
+       var x int = 7;
+       print (x * 1 + 0) / 4;
+
+becomes, after constant folding (see exprfold.py),
+
+       ('load_int', 'x', '__int_1')
+       ('literal_int', 1, '__int_2')
+       ('mul_int', '__int_1', '__int_2', '__int_3')
+       ('literal_int', 0, '__int_4')
+       ('add_int', '__int_3', '__int_4', '__int_5')
+       ('literal_int', 4, '__int_6')
+       ('div_int', '__int_5', '__int_6', '__int_7')
+       ('print_int', '__int_7')
+
+This file implements a pass over the basic blocks that rewrites such
+instructions using what is known about their operands: the values of
+temporaries written by a single 'literal', the instructions writing
+the other temporaries, and which temporaries were loaded from the same
+variable in a block.  The rules are
+
+       int       x + 0, 0 + x, x - 0, x * 1, 1 * x, x / 1   ->  x
+                 x - x, x * 0, 0 * x                         ->  0
+                 x * -1, -1 * x, x / -1                      ->  -x
+                 x * 2**k, 2**k * x                          ->  x << k
+                 x / 2**k                                    ->  x >> k
+
+       float     x + -0.0, -0.0 + x, x - 0.0, x * 1.0,
+                 1.0 * x, x / 1.0                            ->  x
+                 x * -1.0, -1.0 * x, x / -1.0                ->  -x
+                 x * 2.0, 2.0 * x                            ->  x + x
+                 x / 2.0**k                                  ->  x * 2.0**-k
+
+       string    x + '', '' + x                              ->  x
+
+       all       - -x, + x, not not x                        ->  x
+
+The float rules give exactly the same result as the interpreter for
+every x, including -0.0, infinities and NaN, which is why x + 0.0 and
+x - x are left alone for floats (-0.0 + 0.0 is 0.0 and inf - inf is
+NaN).  Integer division in the interpreter truncates with //, which
+rounds towards minus infinity like >> does, so x / 2**k is x >> k for
+negative x as well.  Shifts ('shl' and 'shr') take the shift count as
+an operand like any other binary operation, so a literal for it is
+put in front of them.
+
+An instruction that comes down to one of its operands is removed and
+its target renamed to that operand everywhere, or becomes a 'move' if
+either is written more than once.  The example becomes
+
+       ('load_int', 'x', '__int_1')
+       ('literal_int', 1, '__int_2')
+       ('literal_int', 0, '__int_4')
+       ('literal_int', 4, '__int_6')
+       ('literal_int', 2, '__int_7.k')
+       ('shr_int', '__int_1', '__int_7.k', '__int_7')
+       ('print_int', '__int_7')
+
+and dead code elimination removes the literals that are no longer
+used.
+'''
+
+import math
+import sys
+from collections import defaultdict
+import exprblock
+import exprir
+
+def power_of_two(value):
+    '''
+    Return k if value is the integer 2**k with k > 0, else None.
+    '''
+    if isinstance(value, (int, long)) and not isinstance(value, bool) and \
+       value > 1 and value & (value - 1) == 0:
+        return value.bit_length() - 1
+    return None
+
+def exact_reciprocal(value):
+    '''
+    Return 1.0 / value if value is a float power of two whose reciprocal
+    is a normal float, so that x / value == x * (1.0 / value) for every
+    float x.  Returns None otherwise.
+    '''
+    if not isinstance(value, float) or value == 0.0 or math.isinf(value) or math.isnan(value):
+        return None
+    if abs(math.frexp(value)[0]) != 0.5:
+        return None
+    reciprocal = 1.0 / value
+    if math.isinf(reciprocal) or abs(reciprocal) < sys.float_info.min:
+        return None
+    return reciprocal
+
+def is_negative_zero(value):
+    return isinstance(value, float) and value == 0.0 and math.copysign(1.0, value) < 0
+
+def is_positive_zero(value):
+    return isinstance(value, float) and value == 0.0 and math.copysign(1.0, value) > 0
+
+class SimplifyAlgebra(object):
+    '''
+    Algebraic simplification and strength reduction over all the blocks
+    reachable from a start block.  The instructions of the blocks are
+    replaced.  After simplify(), self.simplified holds the number of
+    instructions rewritten.
+    '''
+    def __init__(self):
+        self.simplified = 0
+        self.constants = {}     # Temporary -> value of its literal
+        self.definitions = {}   # Temporary -> negation writing it
+        self.renames = {}       # Removed temporary -> temporary with the same value
+
+    def simplify(self, start_block):
+        blocks = exprblock.all_blocks(start_block)
+
+        self.defs = defaultdict(int)
+        for block in blocks:
+            for inst in block.instructions:
+                for kind, arg in zip(exprir.operand_kinds(inst), inst[1:]):
+                    if kind == exprir.DEF:
+                        self.defs[arg] += 1
+
+        for block in blocks:
+            self.memory = {}    # Variable -> temporary loaded from it in this block
+            self.same = {}      # Temporary -> earlier temporary loaded from the same variable
+            code = []
+            for inst in block.instructions:
+                code.extend(self.simplify_instruction(self.rename(inst)))
+            exprir.set_instructions(block, code)
+
+        # Temporaries may be read in later blocks (e.g. as a block test)
+        if self.renames:
+            for block in blocks:
+                exprir.set_instructions(block, [self.rename(inst) for inst in block.instructions])
+                if isinstance(block, (exprblock.IfBlock, exprblock.WhileBlock)):
+                    block.test = self.renames.get(block.test, block.test)
+
+    def rename(self, inst):
+        '''
+        Return inst with the temporaries it reads renamed.
+        '''
+        kinds = exprir.operand_kinds(inst)
+        return (inst[0],) + tuple(self.renames.get(arg, arg) if kind == exprir.USE else arg
+                                  for kind, arg in zip(kinds, inst[1:]))
+
+    def single(self, *names):
+        return all(self.defs[name] == 1 for name in names)
+
+    def equal(self, left, right):
+        '''
+        Return True if temporaries left and right hold the same value.
+        '''
+        return self.same.get(left, left) == self.same.get(right, right)
+
+    def simplify_instruction(self, inst):
+        '''
+        Return the list of instructions replacing inst.
+        '''
+        op, typename = exprir.split_opcode(inst[0])
+        target = inst[-1]
+        if op == 'literal':
+            if self.single(target):
+                self.constants[target] = inst[1]
+            return [inst]
+        elif op == 'load':
+            var = inst[1]
+            if var in self.memory:
+                self.same[target] = self.memory[var]
+            elif self.single(target):
+                self.memory[var] = target
+            return [inst]
+        elif op in ('store', 'alloc'):
+            self.memory.pop(inst[-1], None)
+            return [inst]
+
+        if op in ('add', 'sub', 'mul', 'div'):
+            result = self.simplify_binary(op, typename, inst[1], inst[2], target)
+        elif op == 'uadd':
+            result = self.same_as(typename, inst[1], target)
+        elif op in ('usub', 'lnot'):
+            # Two negations in a row
+            source = self.definitions.get(inst[1])
+            result = None
+            if source is not None and source[0] == inst[0] and self.single(source[1]):
+                result = self.same_as(typename, source[1], target)
+        else:
+            result = None
+
+        if result is None:
+            if op in ('usub', 'lnot') and self.single(target):
+                self.definitions[target] = inst
+            return [inst]
+        self.simplified += 1
+        return result
+
+    def same_as(self, typename, source, target):
+        '''
+        Return the instructions giving target the value of source.
+        '''
+        if self.single(source, target):
+            self.renames[target] = source
+            return []
+        return [('move_'+typename, source, target)]
+
+    def literal(self, typename, value, target):
+        '''
+        Return the instructions giving target a constant value.
+        '''
+        if self.single(target):
+            self.constants[target] = value
+        return [('literal_'+typename, value, target)]
+
+    def operation(self, op, typename, left, value, target):
+        '''
+        Return the instructions computing op of left and a constant value
+        into target, with a new temporary holding the value.
+        '''
+        temp = target + '.k'
+        self.defs[temp] += 1
+        return self.literal(typename, value, temp) + [(op+'_'+typename, left, temp, target)]
+
+    def simplify_binary(self, op, typename, left, right, target):
+        '''
+        Return the instructions replacing a binary operation, or None if
+        it stays as it is.
+        '''
+        a = self.constants.get(left)
+        b = self.constants.get(right)
+        if typename == 'int':
+            if (op in ('add', 'sub') and b == 0) or (op in ('mul', 'div') and b == 1):
+                return self.same_as(typename, left, target)
+            if (op == 'add' and a == 0) or (op == 'mul' and a == 1):
+                return self.same_as(typename, right, target)
+            if (op == 'sub' and self.equal(left, right)) or (op == 'mul' and 0 in (a, b)):
+                return self.literal(typename, 0, target)
+            if op in ('mul', 'div') and b == -1:
+                return [('usub_int', left, target)]
+            if op == 'mul' and a == -1:
+                return [('usub_int', right, target)]
+            if op == 'mul' and power_of_two(b):
+                return self.operation('shl', typename, left, power_of_two(b), target)
+            if op == 'mul' and power_of_two(a):
+                return self.operation('shl', typename, right, power_of_two(a), target)
+            if op == 'div' and power_of_two(b):
+                return self.operation('shr', typename, left, power_of_two(b), target)
+        elif typename == 'float':
+            if (op == 'add' and is_negative_zero(b)) or (op == 'sub' and is_positive_zero(b)) or \
+               (op in ('mul', 'div') and b == 1.0):
+                return self.same_as(typename, left, target)
+            if (op == 'add' and is_negative_zero(a)) or (op == 'mul' and a == 1.0):
+                return self.same_as(typename, right, target)
+            if op in ('mul', 'div') and b == -1.0:
+                return [('usub_float', left, target)]
+            if op == 'mul' and a == -1.0:
+                return [('usub_float', right, target)]
+            if op == 'mul' and b == 2.0:
+                return [('add_float', left, left, target)]
+            if op == 'mul' and a == 2.0:
+                return [('add_float', right, right, target)]
+            if op == 'div' and exact_reciprocal(b):
+                return self.operation('mul', typename, left, exact_reciprocal(b), target)
+        elif typename == 'string' and op == 'add':
+            if b == '':
+                return self.same_as(typename, left, target)
+            if a == '':
+                return self.same_as(typename, right, target)
+        return None
+
+def simplify_algebra(start_block):
+    '''
+    Simplify the arithmetic in all blocks reachable from start_block.
+    Returns the number of instructions rewritten.
+    '''
+    simplifier = SimplifyAlgebra()
+    simplifier.simplify(start_block)
+    return simplifier.simplified
+
+if __name__ == '__main__':
+    import exprlex
+    import exprparse
+    import exprcheck
+    import exprcode
+    import exprfold
+    from errors import subscribe_errors, errors_reported
+    lexer = exprlex.make_lexer()
+    parser = exprparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg+"\n")):
+        program = parser.parse(open(sys.argv[1]).read())
+        # Check the program
+        exprcheck.check_program(program)
+        # If no errors occurred, generate code
+        if not errors_reported():
+            code = exprcode.generate_code(program)
+            exprfold.fold_constants(code.start_block)
+            simplified = simplify_algebra(code.start_block)
+            exprblock.PrintBlocks().visit(code.start_block)
+            print "Simplified %d instructions" % simplified
@@ -0,0 +1,161 @@
+# exprslots.py
+'''
+Temporary Slot Allocation
+=========================
+exprcode.py gives every temporary a name of its own, so the register
+file of the interpreter (see SlotResolver in exprinterp.py) has one
+entry for every temporary in the program, even though only a few of
+them hold a value that is still needed at any point.  For example:
+
+       print 2 + 3 * 4;
+
+gives
+
+       ('literal_int', 2, '__int_0')
+       ('literal_int', 3, '__int_1')
+       ('literal_int', 4, '__int_2')
+       ('mul_int', '__int_1', '__int_2', '__int_3')
+       ('add_int', '__int_0', '__int_3', '__int_4')
+       ('print_int', '__int_4')
+
+'__int_1' and '__int_2' aren't needed after the multiplication, so
+its result can go into the place of one of them.  This file renames
+the temporaries to a small set of reusable slots, like a register
+allocator:
+
+       ('literal_int', 2, '__slot_0')
+       ('literal_int', 3, '__slot_1')
+       ('literal_int', 4, '__slot_2')
+       ('mul_int', '__slot_1', '__slot_2', '__slot_1')
+       ('add_int', '__slot_0', '__slot_1', '__slot_0')
+       ('print_int', '__slot_0')
+
+Temporaries that are live at the start of some block (see Liveness in
+exprflow.py) and temporaries written more than once keep their names.
+Every other temporary lives from its definition to its last read
+within one block, where the test of an IfBlock or WhileBlock is read
+after the last instruction.  Going through a block, a temporary takes
+the lowest free slot when it is written and gives it back after its
+last read, so that the instruction reading it for the last time can
+write its result to the same slot.  Every block starts with all slots
+free.
+
+Other passes rely on temporaries being written once, so this one has
+to run last.
+'''
+
+import heapq
+from collections import defaultdict
+import exprblock
+import exprir
+import exprflow
+
+class AllocateSlots(object):
+    '''
+    Renames the temporaries of all blocks reachable from a start block
+    to slots.  After allocate(), self.renamed holds the number of
+    temporaries renamed and self.slots the number of slots used.
+    '''
+    def __init__(self):
+        self.renamed = 0
+        self.slots = 0
+
+    def allocate(self, start_block):
+        live = exprflow.liveness(start_block)
+        blocks = live.cfg.order
+
+        # Temporaries that have to keep their names
+        entry = 0
+        for block in blocks:
+            entry |= live.at_entry[block]
+        fixed = live.decode(entry)
+        defs = defaultdict(int)
+        for block in blocks:
+            for inst in block.instructions:
+                for kind, arg in zip(exprir.operand_kinds(inst), inst[1:]):
+                    if kind == exprir.DEF:
+                        defs[arg] += 1
+        fixed.update(name for name, count in defs.items() if count > 1)
+
+        for block in blocks:
+            self.allocate_block(block, fixed)
+
+    def allocate_block(self, block, fixed):
+        instructions = list(block.instructions)
+        last = {}           # Temporary -> index of the instruction reading it last
+        for n, inst in enumerate(instructions):
+            for kind, arg in zip(exprir.operand_kinds(inst), inst[1:]):
+                if kind == exprir.USE and arg not in fixed:
+                    last[arg] = n
+        # The test is read after the last instruction
+        test = getattr(block, 'test', None)
+        if test is not None and test not in fixed:
+            last[test] = len(instructions)
+
+        slot = {}           # Temporary -> slot number
+        free = []           # Heap of free slot numbers
+        used = 0
+        code = []
+        for n, inst in enumerate(instructions):
+            kinds = exprir.operand_kinds(inst)
+            # Slots of temporaries read for the last time are free for the target
+            for kind, arg in zip(kinds, inst[1:]):
+                if kind == exprir.USE and last.get(arg) == n and arg in slot:
+                    heapq.heappush(free, slot[arg])
+                    del last[arg]
+            args = []
+            for kind, arg in zip(kinds, inst[1:]):
+                if kind == exprir.USE and arg in slot:
+                    arg = slot_name(slot[arg])
+                elif kind == exprir.DEF and arg not in fixed:
+                    if free:
+                        number = heapq.heappop(free)
+                    else:
+                        number = used
+                        used += 1
+                    slot[arg] = number
+                    self.renamed += 1
+                    if arg not in last:
+                        # Never read
+                        heapq.heappush(free, number)
+                    arg = slot_name(number)
+                args.append(arg)
+            code.append((inst[0],) + tuple(args))
+        self.slots = max(self.slots, used)
+        if slot:
+            exprir.set_instructions(block, code)
+        if test in slot:
+            block.test = slot_name(slot[test])
+
+def slot_name(number):
+    return '__slot_%d' % number
+
+def allocate_slots(start_block):
+    '''
+    Rename the temporaries of all blocks reachable from start_block to
+    reusable slots.  Returns the number of temporaries renamed.
+    '''
+    allocator = AllocateSlots()
+    allocator.allocate(start_block)
+    return allocator.renamed
+
+if __name__ == '__main__':
+    import exprlex
+    import exprparse
+    import exprcheck
+    import exprcode
+    import sys
+    from errors import subscribe_errors, errors_reported
+    lexer = exprlex.make_lexer()
+    parser = exprparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg+"\n")):
+        program = parser.parse(open(sys.argv[1]).read())
+        # Check the program
+        exprcheck.check_program(program)
+        # If no errors occurred, generate code
+        if not errors_reported():
+            code = exprcode.generate_code(program)
+            allocator = AllocateSlots()
+            allocator.allocate(code.start_block)
+            exprblock.PrintBlocks().visit(code.start_block)
+            print "Renamed %d temporaries to %d slots" % (allocator.renamed, allocator.slots)
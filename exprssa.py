@@ -0,0 +1,297 @@
+# exprssa.py
+'''
+Static Single Assignment Form
+=============================
+exprcode.py keeps declared variables in memory and reads and writes
+them with 'load' and 'store' instructions.  Only the temporaries are
+assigned once.  This file turns the variables into temporaries as
+well, so that every value in the program has exactly one definition
+(true SSA form), and back again.
+
+Promotion
+---------
+Every 'store' to a variable starts a new version of the variable and
+every 'load' is replaced by the version that reaches it.  For example:
+
+       var a int = 1;
+       while a < 100 {
+           a = a * 2;
+       }
+       print a;
+
+becomes
+
+       ('literal_int', 0, 'a.1')              # alloc_int a
+       ('literal_int', 1, '__int_0')          # a is now __int_0
+    WhileBlock:
+       ('phi_int', '__int_0', '__int_5', 'a.2')
+       ('literal_int', 100, '__int_2')
+       ('lt_int', 'a.2', '__int_2', '__bool_0')
+    body:
+       ('literal_int', 2, '__int_4')
+       ('mul_int', 'a.2', '__int_4', '__int_5')  # a is now __int_5
+    next:
+       ('print_int', 'a.2')
+
+Where different versions of a variable meet, a 'phi' instruction
+picks the version for the edge control came from:
+
+       ('phi_type', source1, source2, ..., target)
+
+There is one source for every predecessor of the block, in the order
+of ControlFlowGraph.preds (see exprcfg.py).  Phis are placed on the
+iterated dominance frontiers of the blocks storing to a variable
+(Cytron et al., "Efficiently Computing Static Single Assignment Form
+and the Control Dependence Graph"), which are the joins after an
+IfBlock and the test of a WhileBlock.  A 'store' makes the stored
+temporary the current version, an 'alloc' a literal with the initial
+value of the type.  Other versions are named 'name.n'.
+
+Leaving SSA form
+----------------
+Neither the interpreter nor the Python backend can run a phi.
+leave_ssa() replaces each phi by copies at the end of its predecessors:
+
+       ('move_type', source, target)
+
+If a predecessor has other successors as well (an IfBlock without an
+else branch), the copies go into a new else branch.  Copies along one
+edge happen at the same time, so if a source is also the target of
+another phi in the block, all sources are first copied aside.
+'''
+
+from collections import defaultdict
+import exprblock
+import exprir
+from exprcfg import control_flow_graph
+from exprfold import default_values
+
+class PromoteVariables(object):
+    '''
+    Rewrite all the variables in the blocks reachable from a start
+    block into SSA form.  After promote(), self.promoted holds the
+    number of variables and self.phis the number of phis placed.
+    '''
+    def __init__(self):
+        self.promoted = 0
+        self.phis = 0
+
+    def promote(self, start_block):
+        cfg = control_flow_graph(start_block)
+        self.cfg = cfg
+
+        # Types and storing blocks of variables, definitions of temporaries
+        self.types = {}
+        self.defs = defaultdict(int)
+        stores = defaultdict(set)
+        for block in cfg.order:
+            for inst in block.instructions:
+                op, typename = exprir.split_opcode(inst[0])
+                for kind, arg in zip(exprir.operand_kinds(inst), inst[1:]):
+                    if kind == exprir.DEF:
+                        self.defs[arg] += 1
+                    elif kind in (exprir.LOAD, exprir.STORE):
+                        self.types[arg] = typename
+                        if kind == exprir.STORE:
+                            stores[arg].add(block)
+        self.promoted = len(self.types)
+
+        # Place phis on the iterated dominance frontiers
+        frontiers = cfg.dominance_frontiers()
+        self.block_phis = defaultdict(list)      # Block -> [var, [sources], target]
+        for var in sorted(self.types):
+            placed = set()
+            work = list(stores[var])
+            while work:
+                block = work.pop()
+                for join in frontiers[block]:
+                    if join not in placed:
+                        placed.add(join)
+                        sources = [None] * len(cfg.preds[join])
+                        self.block_phis[join].append([var, sources, None])
+                        work.append(join)
+            self.phis += len(placed)
+
+        self.versions = defaultdict(int)
+        self.current = defaultdict(list)     # Variable -> stack of versions
+        self.renames = {}                    # Removed load target -> version
+        self.undefined = {}                  # Variable -> version with initial value
+        self.rename(start_block)
+
+        # Sources of phis are only complete after all blocks are renamed
+        for block, phis in self.block_phis.items():
+            exprir.set_instructions(block, [('phi_'+self.types[var],) + tuple(sources) + (target,)
+                                            for var, sources, target in phis] +
+                                    list(block.instructions))
+
+        # Versions used before any store get the initial value at the start
+        if self.undefined:
+            initial = [('literal_'+self.types[var], default_values[self.types[var]], name)
+                       for var, name in sorted(self.undefined.items())]
+            exprir.set_instructions(start_block, initial + list(start_block.instructions))
+
+    def new_version(self, var):
+        self.versions[var] += 1
+        return '%s.%d' % (var, self.versions[var])
+
+    def reaching(self, var):
+        '''
+        Return the version of var that reaches the current point.
+        '''
+        if self.current[var]:
+            return self.current[var][-1]
+        if var not in self.undefined:
+            self.undefined[var] = '%s.0' % var
+        return self.undefined[var]
+
+    def rename(self, start_block):
+        '''
+        Rename loads and stores by walking the dominator tree.  The walk
+        uses an explicit stack so that deep nesting can't overflow the
+        Python stack.
+        '''
+        children = self.cfg.dominator_tree()
+        stack = [(start_block, None)]
+        while stack:
+            block, pushed = stack.pop()
+            if pushed is not None:
+                # Leaving the subtree of block
+                for var in pushed:
+                    self.current[var].pop()
+                continue
+            pushed = self.rename_block(block)
+            stack.append((block, pushed))
+            for child in reversed(children[block]):
+                stack.append((child, None))
+
+    def rename_block(self, block):
+        '''
+        Rename the instructions of one block and fill in the phi sources
+        of its successors.  Returns the list of variables that got a new
+        version in this block.
+        '''
+        pushed = []
+        code = []
+        for phi in self.block_phis.get(block, ()):
+            var = phi[0]
+            phi[2] = self.new_version(var)
+            self.current[var].append(phi[2])
+            pushed.append(var)
+
+        for inst in block.instructions:
+            kinds = exprir.operand_kinds(inst)
+            inst = (inst[0],) + tuple(self.renames.get(arg, arg) if kind == exprir.USE else arg
+                                      for kind, arg in zip(kinds, inst[1:]))
+            op, typename = exprir.split_opcode(inst[0])
+            if op == 'alloc':
+                var = inst[1]
+                version = self.new_version(var)
+                code.append(('literal_'+typename, default_values[typename], version))
+            elif op == 'store':
+                source, var = inst[1:]
+                if self.defs[source] == 1:
+                    version = source
+                else:
+                    version = self.new_version(var)
+                    code.append(('move_'+typename, source, version))
+            elif op == 'load':
+                var, target = inst[1:]
+                if self.defs[target] == 1:
+                    self.renames[target] = self.reaching(var)
+                else:
+                    code.append(('move_'+typename, self.reaching(var), target))
+                continue
+            else:
+                code.append(inst)
+                continue
+            self.current[var].append(version)
+            pushed.append(var)
+
+        if isinstance(block, (exprblock.IfBlock, exprblock.WhileBlock)):
+            block.test = self.renames.get(block.test, block.test)
+
+        exprir.set_instructions(block, code)
+
+        for succ in self.cfg.succs[block]:
+            index = self.cfg.preds[succ].index(block)
+            for var, sources, target in self.block_phis.get(succ, ()):
+                sources[index] = self.reaching(var)
+        return pushed
+
+def promote_variables(start_block):
+    '''
+    Rewrite all variables of the blocks reachable from start_block into
+    SSA form.  Returns the number of phis placed.
+    '''
+    promoter = PromoteVariables()
+    promoter.promote(start_block)
+    return promoter.phis
+
+def split_edge(block, succ):
+    '''
+    Insert a new empty block on the edge from an IfBlock or WhileBlock
+    to succ, by filling in the missing branch or body.
+    '''
+    edge = exprblock.BasicBlock()
+    if isinstance(block, exprblock.IfBlock) and block.if_branch is None and succ is not block.else_branch:
+        block.if_branch = edge
+    elif isinstance(block, exprblock.IfBlock) and block.else_branch is None:
+        block.else_branch = edge
+    elif isinstance(block, exprblock.WhileBlock) and block.body is None:
+        block.body = edge
+    else:
+        raise RuntimeError("Can't split the edge from %s to %s" % (block, succ))
+    return edge
+
+def leave_ssa(start_block):
+    '''
+    Replace all phis in the blocks reachable from start_block by moves
+    in the predecessor blocks.  Returns the number of moves inserted.
+    '''
+    cfg = control_flow_graph(start_block)
+    moves = 0
+    for block in cfg.order:
+        phis = [inst for inst in block.instructions if inst[0].startswith('phi_')]
+        if not phis:
+            continue
+        exprir.set_instructions(block, [inst for inst in block.instructions
+                                        if not inst[0].startswith('phi_')])
+        targets = set(phi[-1] for phi in phis)
+        for index, pred in enumerate(cfg.preds[block]):
+            copies = [('move_'+exprir.split_opcode(phi[0])[1], phi[index+1], phi[-1])
+                      for phi in phis if phi[index+1] != phi[-1]]
+            if any(source in targets for opcode, source, target in copies):
+                # Parallel copy: copy every source aside first
+                copies = ([(opcode, source, target+'.in') for opcode, source, target in copies] +
+                          [(opcode, target+'.in', target) for opcode, source, target in copies])
+            if not copies:
+                continue
+            if len(cfg.succs[pred]) > 1:
+                pred = split_edge(pred, block)
+            exprir.set_instructions(pred, list(pred.instructions) + copies)
+            moves += len(copies)
+    return moves
+
+if __name__ == '__main__':
+    import exprlex
+    import exprparse
+    import exprcheck
+    import exprcode
+    import sys
+    from errors import subscribe_errors, errors_reported
+    lexer = exprlex.make_lexer()
+    parser = exprparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg+"\n")):
+        program = parser.parse(open(sys.argv[1]).read())
+        # Check the program
+        exprcheck.check_program(program)
+        # If no errors occurred, generate code
+        if not errors_reported():
+            code = exprcode.generate_code(program)
+            phis = promote_variables(code.start_block)
+            exprblock.PrintBlocks().visit(code.start_block)
+            print "Placed %d phis" % phis
+            print
+            moves = leave_ssa(code.start_block)
+            exprblock.PrintBlocks().visit(code.start_block)
+            print "Inserted %d moves" % moves
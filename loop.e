@@ -0,0 +1,11 @@
+/* A loop-heavy program used for benchmarking the interpreter */
+
+var i int = 0;
+var sum int = 0;
+
+while i < 20000 {
+    sum = sum + i * 2 - i / 3;
+    i = i + 1;
+}
+
+print sum;
@@ -0,0 +1,13 @@
+var x float = 0.0;
+var y float = 0.0;
+var i int = 0;
+while i < 2 {
+    if i == 1 {
+        x = -0.0;
+    }
+    i = i + 1;
+}
+print x;
+y = -x;
+y = -y;
+print y;
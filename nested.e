@@ -0,0 +1,28 @@
+/* Nested loops with conditionals, used for benchmarking */
+
+var i int = 0;
+var j int;
+var s int = 0;
+var f float = 1.5;
+var msg string = "x";
+
+while i < 300 {
+    j = 0;
+    while j < 100 {
+        if j / 7 * 7 == j && i > 10 {
+            s = s + j;
+        } else {
+            if j > 50 || i == 3 {
+                s = s - 1;
+            }
+        }
+        j = j + 1;
+    }
+    i = i + 1;
+}
+
+f = f * 3.0 / 2.0;
+msg = msg + "yz";
+print s;
+print f;
+print msg;
@@ -0,0 +1,13 @@
+var x float = 1.0e300;
+var y float = x * x;
+var z float = y - y;
+print y;
+print z;
+var i int = 0;
+var s float = 0.0;
+while i < 100 {
+    s = s + y - y;
+    i = i + 1;
+}
+print s;
+print -y;
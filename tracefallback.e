@@ -0,0 +1,10 @@
+// The back-edge of this loop is fused into a superinstruction, and
+// tracing must test it after every iteration.  Run as fused bytecode:
+//     python exprbytecode.py tracefallback.e
+//     python exprinterp.py -t tracefallback.ebc
+// which prints 50, like running it without -t.
+var i int = 0;
+while !(i >= 50) {
+    i = i + 1;
+}
+print i;